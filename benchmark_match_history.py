@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пагинации истории матчей: OFFSET против keyset-курсора
+
+Создает схему bench_match_history, наполняет match_history 1M+ строками,
+строит индекс из migrations/003_match_history_keyset.sql и сравнивает время
+получения глубоких страниц через старый OFFSET-подход и через
+DatabaseStorage.get_match_history_page.
+
+Запуск:
+    BENCH_DATABASE_URL=postgresql://... python benchmark_match_history.py [rows] [users]
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+
+# Добавляем путь к проекту
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bot.services.database_storage import DatabaseStorage, MATCH_HISTORY_COLUMNS, decode_history_cursor
+
+SCHEMA = "bench_match_history"
+PAGE_SIZE = 20
+DEEP_PAGES = (1, 10, 100, 1000)
+
+
+async def prepare_data(conn: asyncpg.Connection, rows: int, users: int):
+    """Создать схему и наполнить таблицу тестовыми матчами"""
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}")
+
+    await conn.execute("""
+        CREATE TABLE match_history (
+            match_id VARCHAR(255) PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            finished_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            result VARCHAR(10) NOT NULL,
+            kills INTEGER DEFAULT 0,
+            deaths INTEGER DEFAULT 0,
+            assists INTEGER DEFAULT 0,
+            adr FLOAT DEFAULT 0.0,
+            hltv_rating FLOAT DEFAULT 0.0,
+            headshots INTEGER DEFAULT 0,
+            headshot_percentage FLOAT DEFAULT 0.0,
+            map_name VARCHAR(100),
+            score_team1 INTEGER DEFAULT 0,
+            score_team2 INTEGER DEFAULT 0,
+            rounds_played INTEGER DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+        )
+    """)
+
+    print(f"Наполняем match_history: {rows:,} строк для {users:,} пользователей...")
+    started = time.perf_counter()
+    await conn.execute("""
+        INSERT INTO match_history (
+            match_id, user_id, finished_at, result, kills, deaths, assists,
+            adr, hltv_rating, headshots, headshot_percentage, map_name,
+            score_team1, score_team2, rounds_played
+        )
+        SELECT
+            '1-' || md5(g::text),
+            g % $2,
+            NOW() - (g || ' minutes')::interval,
+            CASE WHEN random() < 0.5 THEN 'win' ELSE 'loss' END,
+            (random() * 30)::int, (random() * 25)::int, (random() * 10)::int,
+            random() * 120, random() * 2, (random() * 15)::int, random() * 100,
+            (ARRAY['de_mirage', 'de_inferno', 'de_nuke', 'de_ancient', 'de_anubis'])[1 + g % 5],
+            13, (random() * 12)::int, 13 + (random() * 12)::int
+        FROM generate_series(1, $1) AS g
+    """, rows, users)
+    print(f"  готово за {time.perf_counter() - started:.1f}s")
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "migrations", "003_match_history_keyset.sql"), encoding="utf-8") as f:
+        await conn.execute(f.read())
+    await conn.execute("VACUUM ANALYZE match_history")
+
+
+async def time_query(coro_factory, repeats: int = 5) -> float:
+    """Медианное время выполнения в миллисекундах"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await coro_factory()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+async def run_benchmark(rows: int, users: int):
+    """Сравнить OFFSET и keyset на глубоких страницах"""
+    database_url = os.getenv("BENCH_DATABASE_URL") or os.getenv("DATABASE_URL")
+    if not database_url:
+        print("Укажите BENCH_DATABASE_URL")
+        return
+
+    conn = await asyncpg.connect(database_url, server_settings={"search_path": SCHEMA})
+    try:
+        await prepare_data(conn, rows, users)
+
+        storage = DatabaseStorage()
+        storage.postgres = conn
+
+        # Самый "тяжелый" пользователь - у него больше всего матчей
+        user_id = await conn.fetchval(
+            "SELECT user_id FROM match_history GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+        )
+        total = await conn.fetchval("SELECT COUNT(*) FROM match_history WHERE user_id = $1", user_id)
+        print(f"\nПользователь {user_id}: {total:,} матчей, страница {PAGE_SIZE}\n")
+
+        columns = ", ".join(MATCH_HISTORY_COLUMNS)
+        offset_query = f"""
+            SELECT * FROM match_history WHERE user_id = $1
+            ORDER BY finished_at DESC LIMIT $2 OFFSET $3
+        """
+
+        # Собираем курсоры для нужных страниц, проходя историю целиком
+        cursors = {1: None}
+        cursor = None
+        for page in range(1, max(DEEP_PAGES)):
+            result = await storage.get_match_history_page(user_id, PAGE_SIZE, cursor)
+            cursor = result['next_cursor']
+            if not cursor:
+                break
+            cursors[page + 1] = cursor
+
+        print(f"{'страница':>10} | {'OFFSET, мс':>12} | {'keyset, мс':>12}")
+        print("-" * 42)
+        for page in DEEP_PAGES:
+            if page not in cursors:
+                continue
+            offset_ms = await time_query(
+                lambda: conn.fetch(offset_query, user_id, PAGE_SIZE, (page - 1) * PAGE_SIZE)
+            )
+            keyset_ms = await time_query(
+                lambda: storage.get_match_history_page(user_id, PAGE_SIZE, cursors[page])
+            )
+            print(f"{page:>10} | {offset_ms:>12.2f} | {keyset_ms:>12.2f}")
+
+        # План запроса для глубокой страницы
+        deepest = max(p for p in DEEP_PAGES if p in cursors)
+        if cursors[deepest]:
+            finished_at, match_id = decode_history_cursor(cursors[deepest])
+            plan = await conn.fetch(f"""
+                EXPLAIN (ANALYZE, BUFFERS)
+                SELECT {columns} FROM match_history
+                WHERE user_id = $1 AND (finished_at, match_id) < ($2, $3)
+                ORDER BY finished_at DESC, match_id DESC
+                LIMIT $4
+            """, user_id, finished_at, match_id, PAGE_SIZE + 1)
+            print(f"\nПлан keyset-запроса (страница {deepest}):")
+            for line in plan:
+                print("  " + line[0])
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(run_benchmark(rows, users))
@@ -4,19 +4,26 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Dict, List, Any, Optional, Tuple, Callable, Awaitable
+from functools import partial
 import re
 import asyncio
+import time
 from datetime import datetime
 
 from keyboards import get_main_menu_keyboard, get_back_to_main_keyboard
 from storage import storage
 from faceit_client import faceit_client
+from config import settings
+from bot.services.match_analysis import MatchAnalysisPrecomputer
 
 
 # Создаем роутер для анализа текущего матча
 router = Router(name="current_match_handler")
 
+# Минимальный интервал между обновлениями сообщения с прогрессом анализа (сек)
+ANALYSIS_PROGRESS_INTERVAL = 1.0
+
 
 class CurrentMatchStates(StatesGroup):
     """FSM состояния для анализа текущего матча"""
@@ -229,49 +236,74 @@ def analyze_map_performance(players_stats: List[Dict[str, Any]], map_name: str)
     }
 
 
-async def get_team_players_stats(team_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+async def get_player_match_stats(player: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
-    Получить статистику всех игроков команды
+    Получить статистику одного игрока (детали и статистика запрашиваются параллельно)
     """
-    players_stats = []
+    player_id = player.get('player_id')
+    nickname = player.get('nickname', 'Unknown')
     
-    if not team_data or 'players' not in team_data:
-        return players_stats
+    if not player_id:
+        return None
     
-    for player in team_data['players']:
-        player_id = player.get('player_id')
-        nickname = player.get('nickname', 'Unknown')
+    try:
+        # Лимиты API соблюдает семафор faceit_client
+        player_details, player_stats_data = await asyncio.gather(
+            faceit_client.get_player_details(player_id),
+            faceit_client.get_player_stats(player_id)
+        )
         
-        if not player_id:
-            continue
+        if player_details and player_stats_data:
+            return faceit_client.format_player_stats(player_details, player_stats_data)
         
-        try:
-            # Получаем полную статистику игрока
-            player_details = await faceit_client.get_player_details(player_id)
-            player_stats_data = await faceit_client.get_player_stats(player_id)
-            
-            if player_details and player_stats_data:
-                formatted_stats = faceit_client.format_player_stats(player_details, player_stats_data)
-                if formatted_stats:
-                    players_stats.append(formatted_stats)
-            
-            # Задержка между запросами для соблюдения лимитов API
-            await asyncio.sleep(0.2)
-            
-        except Exception as e:
-            print(f"Ошибка получения статистики игрока {nickname}: {e}")
-            continue
+    except Exception as e:
+        print(f"Ошибка получения статистики игрока {nickname}: {e}")
     
-    return players_stats
+    return None
 
 
-async def analyze_current_match(match_id: str) -> Optional[Dict[str, Any]]:
+async def get_team_players_stats(team_data: Dict[str, Any],
+                                 on_player: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+                                 ) -> List[Dict[str, Any]]:
+    """
+    Получить статистику всех игроков команды
+    
+    Игроки запрашиваются параллельно; on_player вызывается для каждого
+    игрока сразу после получения его статистики. Порядок результата -
+    порядок состава.
+    """
+    if not team_data or 'players' not in team_data:
+        return []
+    
+    async def fetch(player: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        stats = await get_player_match_stats(player)
+        if stats and on_player:
+            try:
+                await on_player(stats)
+            except Exception as e:
+                print(f"Ошибка обработки прогресса анализа: {e}")
+        return stats
+    
+    results = await asyncio.gather(*(fetch(player) for player in team_data['players']))
+    return [stats for stats in results if stats]
+
+
+async def analyze_current_match(match_id: str, refresh_details: bool = False,
+                                on_player: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+                                ) -> Optional[Dict[str, Any]]:
     """
     Провести полный анализ текущего матча
+    
+    refresh_details - не брать детали матча из кэша (после выбора карты
+    они меняются, статистика игроков при этом остается кэшированной);
+    on_player(team_name, player_stats) - прогресс загрузки составов.
     """
+    timings = {}
+    started = time.monotonic()
     try:
         # Получаем детали матча
-        match_details = await faceit_client.get_match_details(match_id)
+        match_details = await faceit_client.get_match_details(match_id, cache_ttl=0 if refresh_details else 300)
+        timings['match_details'] = time.monotonic() - started
         if not match_details:
             return None
         
@@ -317,11 +349,21 @@ async def analyze_current_match(match_id: str) -> Optional[Dict[str, Any]]:
         print(f"   Карта: {current_map or 'TBD'}")
         print(f"   Статус: {match_info['status']}")
         
-        # Получаем статистику игроков обеих команд
+        # Получаем статистику игроков обеих команд параллельно
         print("📊 Получение статистики команд...")
-        team1_stats = await get_team_players_stats(team1_data)
-        await asyncio.sleep(1)  # Дополнительная задержка между командами
-        team2_stats = await get_team_players_stats(team2_data)
+        stage_started = time.monotonic()
+        
+        def team_progress(team_name: str):
+            if not on_player:
+                return None
+            return lambda stats: on_player(team_name, stats)
+        
+        team1_stats, team2_stats = await asyncio.gather(
+            get_team_players_stats(team1_data, team_progress(team_names[0])),
+            get_team_players_stats(team2_data, team_progress(team_names[1]))
+        )
+        timings['players'] = time.monotonic() - stage_started
+        stage_started = time.monotonic()
         
         # Анализируем силу команд
         team1_strength = calculate_team_strength(team1_stats)
@@ -363,7 +405,14 @@ async def analyze_current_match(match_id: str) -> Optional[Dict[str, Any]]:
             'analyzed_at': datetime.now().isoformat()
         }
         
-        print("✅ Анализ матча завершен")
+        timings['analysis'] = time.monotonic() - stage_started
+        timings['total'] = time.monotonic() - started
+        print(
+            f"✅ Анализ матча завершен за {timings['total']:.2f}s "
+            f"(матч {timings['match_details']:.2f}s, "
+            f"игроки {timings['players']:.2f}s [{len(team1_stats) + len(team2_stats)}], "
+            f"расчет {timings['analysis']:.3f}s)"
+        )
         return analysis_result
         
     except Exception as e:
@@ -371,6 +420,16 @@ async def analyze_current_match(match_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+# Анализ считается заранее по событиям FACEIT и хранится под match_id
+analysis_precomputer = MatchAnalysisPrecomputer(
+    storage,
+    partial(analyze_current_match, refresh_details=True),
+    ttl_minutes=settings.match_analysis_ttl,
+    live_ttl_minutes=settings.match_analysis_live_ttl,
+    concurrency=settings.match_analysis_concurrency
+)
+
+
 def generate_match_prediction(team1_strength: Dict, team2_strength: Dict, 
                             map_analysis: Dict, team_names: List[str]) -> Dict[str, Any]:
     """
@@ -603,11 +662,39 @@ def format_match_analysis(analysis: Dict[str, Any]) -> str:
     return text
 
 
+def format_analysis_progress(loaded: Dict[str, List[Dict[str, Any]]]) -> str:
+    """
+    Текст прогресса анализа: игроки, чья статистика уже получена
+    """
+    total = sum(len(players) for players in loaded.values())
+    
+    text = "🔄 **Выполняется анализ матча...**\n\n"
+    text += f"📊 Получена статистика игроков: **{total}/10**\n"
+    
+    for team_name, players in loaded.items():
+        text += f"\n👥 **{team_name}**\n"
+        for player in players:
+            text += (f"✅ {player.get('nickname', 'Unknown')} - "
+                     f"ELO {player.get('elo', 0)}, рейтинг {player.get('hltv_rating', 0):.2f}\n")
+    
+    return text
+
+
 # ===== ОБРАБОТЧИКИ СОБЫТИЙ =====
 
 @router.callback_query(F.data == "current_match_analysis")
 async def show_current_match_menu(callback: CallbackQuery, state: FSMContext):
-    """Показать заглушку для анализа текущего матча"""
+    """Показать анализ текущего матча (если он посчитан заранее) или заглушку"""
+    saved_analysis = await analysis_precomputer.get_user_analysis(callback.from_user.id)
+    if saved_analysis:
+        await callback.message.edit_text(
+            format_match_analysis(saved_analysis),
+            reply_markup=get_match_analysis_keyboard(),
+            parse_mode="Markdown"
+        )
+        await callback.answer()
+        return
+    
     text = "🔍 **Анализ текущего матча**\n\n"
     text += "🚧 **Раздел в разработке**\n\n"
     text += "Данная функция находится в процессе разработки и будет доступна в ближайшее время.\n\n"
@@ -621,7 +708,7 @@ async def show_current_match_menu(callback: CallbackQuery, state: FSMContext):
 async def show_saved_analysis(callback: CallbackQuery):
     """Показать сохраненный анализ матча"""
     user_id = callback.from_user.id
-    saved_analysis = await storage.get_cached_data(f"current_match_analysis_{user_id}")
+    saved_analysis = await analysis_precomputer.get_user_analysis(user_id)
     
     if saved_analysis:
         text = format_match_analysis(saved_analysis)
@@ -642,7 +729,7 @@ async def enter_match_link(callback: CallbackQuery, state: FSMContext):
     text += "📝 **Поддерживаемые форматы:**\n"
     text += "• https://www.faceit.com/en/cs2/room/1-abc123-def456\n"
     text += "• https://faceit.com/ru/cs2/room/1-abc123-def456\n\n"
-    text += "⏱️ Анализ может занять 1-2 минуты из-за получения статистики всех игроков."
+    text += "⏱️ Анализ может занять до минуты из-за получения статистики всех игроков."
     
     keyboard = get_back_to_main_keyboard()
     
@@ -672,25 +759,47 @@ async def process_match_link(message: Message, state: FSMContext):
         )
         return
     
+    # Посчитанный заранее анализ отправляем сразу, без сообщения об ожидании
+    precomputed = await analysis_precomputer.get(match_id)
+    if precomputed:
+        await analysis_precomputer.set_user_match(user_id, match_id)
+        await message.answer(
+            format_match_analysis(precomputed),
+            reply_markup=get_match_analysis_keyboard(),
+            parse_mode="Markdown"
+        )
+        await state.clear()
+        return
+    
     # Отправляем сообщение о начале анализа
     analyzing_msg = await message.answer(
         "🔄 **Выполняется анализ матча...**\n\n"
         "⏱️ Получение данных матча и статистики игроков\n"
-        "📊 Это может занять 1-2 минуты",
+        "📊 Игроки появятся здесь по мере загрузки",
         parse_mode="Markdown"
     )
     
-    # Выполняем анализ
+    # Игроки показываются по мере получения статистики (не чаще раза в секунду)
+    loaded: Dict[str, List[Dict[str, Any]]] = {}
+    last_progress_at = 0.0
+    
+    async def show_progress(team_name: str, player_stats: Dict[str, Any]):
+        nonlocal last_progress_at
+        loaded.setdefault(team_name, []).append(player_stats)
+        
+        now = time.monotonic()
+        if now - last_progress_at < ANALYSIS_PROGRESS_INTERVAL:
+            return
+        last_progress_at = now
+        await analyzing_msg.edit_text(format_analysis_progress(loaded), parse_mode="Markdown")
+    
+    # Выполняем анализ (готовый результат по match_id возвращается сразу)
     try:
-        analysis_result = await analyze_current_match(match_id)
+        analysis_result = await analysis_precomputer.get_or_compute(match_id, on_player=show_progress)
         
         if analysis_result:
-            # Сохраняем анализ в кэш
-            await storage.set_cached_data(
-                f"current_match_analysis_{user_id}", 
-                analysis_result, 
-                ttl_minutes=30
-            )
+            # Анализ хранится под match_id, пользователю - только указатель на матч
+            await analysis_precomputer.set_user_match(user_id, match_id)
             
             # Форматируем и отправляем результат
             text = format_match_analysis(analysis_result)
@@ -728,7 +837,7 @@ async def process_match_link(message: Message, state: FSMContext):
 async def detailed_team_analysis(callback: CallbackQuery):
     """Показать детальный анализ команд"""
     user_id = callback.from_user.id
-    saved_analysis = await storage.get_cached_data(f"current_match_analysis_{user_id}")
+    saved_analysis = await analysis_precomputer.get_user_analysis(user_id)
     
     if not saved_analysis:
         await callback.message.edit_text(
@@ -834,7 +943,7 @@ async def detailed_team_analysis(callback: CallbackQuery):
 async def detailed_map_analysis(callback: CallbackQuery):
     """Показать детальный анализ карты"""
     user_id = callback.from_user.id
-    saved_analysis = await storage.get_cached_data(f"current_match_analysis_{user_id}")
+    saved_analysis = await analysis_precomputer.get_user_analysis(user_id)
     
     if not saved_analysis:
         await callback.message.edit_text(
@@ -956,7 +1065,7 @@ async def detailed_map_analysis(callback: CallbackQuery):
 async def refresh_current_match(callback: CallbackQuery):
     """Обновить анализ текущего матча"""
     user_id = callback.from_user.id
-    saved_analysis = await storage.get_cached_data(f"current_match_analysis_{user_id}")
+    saved_analysis = await analysis_precomputer.get_user_analysis(user_id)
     
     if not saved_analysis:
         await callback.message.edit_text(
@@ -983,17 +1092,10 @@ async def refresh_current_match(callback: CallbackQuery):
     )
     
     try:
-        # Выполняем новый анализ
-        analysis_result = await analyze_current_match(match_id)
+        # Выполняем новый анализ (свежий общий анализ матча не пересчитывается)
+        analysis_result = await analysis_precomputer.refresh(match_id)
         
         if analysis_result:
-            # Обновляем кэш
-            await storage.set_cached_data(
-                f"current_match_analysis_{user_id}",
-                analysis_result,
-                ttl_minutes=30
-            )
-            
             # Отправляем обновленный результат
             text = format_match_analysis(analysis_result)
             keyboard = get_match_analysis_keyboard()
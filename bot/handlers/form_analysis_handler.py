@@ -10,6 +10,7 @@ from datetime import datetime
 from keyboards import get_form_reply_keyboard, get_main_reply_keyboard
 from storage import storage
 from faceit_client import faceit_client
+from config import settings
 
 # Создаем роутер для обработчиков анализа формы
 router = Router(name="form_analysis_handler")
@@ -142,8 +143,7 @@ async def perform_form_analysis(callback, match_count: int):
         )
         
         # Анализируем оба периода
-        recent_stats = await analyze_matches_period(recent_matches, faceit_id, "Текущий период")
-        previous_stats = await analyze_matches_period(previous_matches, faceit_id, "Предыдущий период")
+        recent_stats, previous_stats = await analyze_form_periods(recent_matches, previous_matches, faceit_id, user_id)
         
         # Формируем сообщение с результатами
         message_text = await format_form_analysis_result(
@@ -233,8 +233,7 @@ async def perform_form_analysis_from_message(message: Message, match_count: int)
         )
         
         # Анализируем оба периода
-        recent_stats = await analyze_matches_period(recent_matches, faceit_id, "Текущий период")
-        previous_stats = await analyze_matches_period(previous_matches, faceit_id, "Предыдущий период")
+        recent_stats, previous_stats = await analyze_form_periods(recent_matches, previous_matches, faceit_id, user_id)
         
         # Формируем сообщение с результатами
         message_text = await format_form_analysis_result(
@@ -256,10 +255,45 @@ async def perform_form_analysis_from_message(message: Message, match_count: int)
             "Попробуйте позже."
         )
 
-async def analyze_matches_period(matches: List[Dict], faceit_id: str, period_name: str) -> Dict[str, Any]:
+async def analyze_form_periods(recent_matches: List[Dict], previous_matches: List[Dict],
+                               faceit_id: str, user_id: Optional[int] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Статистика двух периодов: в пуле воркеров с дедлайном, при неудаче - здесь"""
+    if settings.worker_offload_timeout > 0 and recent_matches:
+        from workers import worker_queue
+        
+        task = {
+            'type': 'form_periods',
+            'player_id': faceit_id,
+            'user_id': user_id,
+            'match_count': len(recent_matches),
+            'latest_match_id': recent_matches[0].get('match_id'),
+            'recent': recent_matches,
+            'previous': previous_matches,
+        }
+        try:
+            result = await worker_queue.run('stats', task, timeout=settings.worker_offload_timeout)
+            return result['recent'], result['previous']
+        except Exception as e:
+            # Очередь полна, дедлайн прошел, задача упала или Redis недоступен
+            logger.warning(f"Анализ формы {faceit_id} в воркерах не выполнен ({type(e).__name__}), считаем здесь")
+    
+    recent_stats = await analyze_matches_period(recent_matches, faceit_id, "Текущий период", user_id)
+    previous_stats = await analyze_matches_period(previous_matches, faceit_id, "Предыдущий период", user_id)
+    return recent_stats, previous_stats
+
+async def analyze_matches_period(matches: List[Dict], faceit_id: str, period_name: str,
+                                 user_id: Optional[int] = None) -> Dict[str, Any]:
     """Анализ статистики за определенный период матчей"""
     logger.info(f"Анализируем {period_name}: {len(matches)} матчей")
     
+    # Если все матчи периода уже есть в истории, считаем итоги одним запросом к БД
+    if user_id and matches:
+        match_ids = [match['match_id'] for match in matches if match.get('match_id')]
+        stored_stats = await storage.get_window_stats(user_id, match_ids=match_ids)
+        if match_ids and stored_stats['total_matches'] == len(match_ids):
+            logger.info(f"{period_name} - статистика взята из агрегатов БД ({len(match_ids)} матчей)")
+            return stored_stats
+    
     # Инициализируем счетчики
     stats = {
         'total_matches': len(matches),
@@ -2,16 +2,137 @@ import asyncpg
 import redis.asyncio as redis
 import json
 import logging
-from typing import Dict, List, Optional, Any
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Any, Tuple, Union
+from datetime import datetime, timedelta, timezone
+
+from bot.services.migrations import MigrationRunner
+from bot.services.user_cache import UserRecordCache
 
 logger = logging.getLogger(__name__)
 
+# Колонки истории матчей, которые используют форматтеры.
+# Все они входят в покрывающий индекс idx_match_history_user_finished
+# (см. migrations/003_match_history_keyset.sql), поэтому страница истории
+# читается index-only сканом без обращения к таблице.
+MATCH_HISTORY_COLUMNS = (
+    "match_id", "finished_at", "result",
+    "kills", "deaths", "assists", "adr", "hltv_rating",
+    "headshot_percentage", "map_name",
+    "score_team1", "score_team2", "rounds_played",
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_history_cursor(finished_at: datetime, match_id: str) -> str:
+    """Упаковать курсор пагинации в строку (помещается в callback_data)"""
+    if finished_at.tzinfo is None:
+        finished_at = finished_at.replace(tzinfo=timezone.utc)
+    micros = (finished_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}|{match_id}"
+
+
+def decode_history_cursor(cursor: str) -> Optional[Tuple[datetime, str]]:
+    """Распаковать курсор пагинации, None если строка повреждена"""
+    try:
+        micros, match_id = cursor.split("|", 1)
+        return _EPOCH + timedelta(microseconds=int(micros)), match_id
+    except (ValueError, AttributeError):
+        return None
+
+
+# Колонки match_history, из которых складываются агрегаты player_stats_daily
+AGGREGATE_SOURCE_COLUMNS = (
+    "user_id", "finished_at", "result", "map_name",
+    "kills", "deaths", "assists", "headshots", "rounds_played",
+    "adr", "hltv_rating",
+)
+
+
+# Последний обработанный матч игрока: HASH faceit_id -> "finished_at|match_id"
+# (finished_at - unix-время FACEIT). Заменяет MAX(finished_at) по match_history
+# и проверку match_notifications для каждого кандидата при опросе.
+MATCH_WATERMARK_KEY = "match:watermark"
+
+# Сдвигает отметку только вперед: KEYS[1] - хэш, ARGV - faceit_id, finished_at, match_id
+ADVANCE_WATERMARK_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if current then
+    local sep = string.find(current, '|', 1, true)
+    local finished_at = tonumber(string.sub(current, 1, sep - 1))
+    local match_id = string.sub(current, sep + 1)
+    local new_finished_at = tonumber(ARGV[2])
+    if new_finished_at < finished_at or (new_finished_at == finished_at and ARGV[3] <= match_id) then
+        return 0
+    end
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. '|' .. ARGV[3])
+return 1
+"""
+
+
+def parse_match_watermark(value: Optional[str]) -> Optional[Tuple[int, str]]:
+    """Разобрать отметку "finished_at|match_id" из Redis"""
+    if not value:
+        return None
+    finished_at, _, match_id = value.partition('|')
+    try:
+        return int(finished_at), match_id
+    except ValueError:
+        return None
+
+
+def is_after_watermark(finished_at: int, match_id: str, watermark: Optional[Tuple[int, str]]) -> bool:
+    """Матч новее отметки (отметка без match_id покрывает всю свою секунду)"""
+    if watermark is None:
+        return True
+    mark_finished_at, mark_match_id = watermark
+    if finished_at != mark_finished_at:
+        return finished_at > mark_finished_at
+    return bool(mark_match_id) and match_id > mark_match_id
+
+
+def summarize_stats_row(row) -> Dict[str, Any]:
+    """Преобразовать суммы из БД в итоговые показатели
+    
+    Ключи совпадают с результатом calculate_final_stats из
+    form_analysis_handler, чтобы форматтеры принимали оба источника.
+    """
+    row = dict(row) if row else {}
+    matches = int(row.get('matches') or 0)
+    wins = int(row.get('wins') or 0)
+    losses = int(row.get('losses') or 0)
+    kills = int(row.get('kills') or 0)
+    deaths = int(row.get('deaths') or 0)
+    headshots = int(round(float(row.get('headshots') or 0)))
+    decided = wins + losses
+    
+    return {
+        'total_matches': matches,
+        'detailed_matches': matches,
+        'wins': wins,
+        'losses': losses,
+        'winrate': (wins / decided) * 100 if decided > 0 else 0.0,
+        'kills': kills,
+        'deaths': deaths,
+        'assists': int(row.get('assists') or 0),
+        'kd_ratio': kills / deaths if deaths > 0 else float(kills),
+        'headshots': headshots,
+        'headshot_percentage': (headshots / kills) * 100 if kills > 0 else 0.0,
+        'total_rounds': int(row.get('rounds_played') or 0),
+        'adr': float(row.get('adr_sum') or 0) / matches if matches > 0 else 0.0,
+        'player_rating': float(row.get('rating_sum') or 0) / matches if matches > 0 else 0.0,
+    }
+
+
 class DatabaseStorage:
     """Система хранения данных с PostgreSQL и Redis"""
     
     def __init__(self):
-        self.postgres: Optional[asyncpg.Connection] = None
+        # Пул подключений: обработчики, мониторинг матчей и воркеры
+        # выполняют запросы параллельно
+        self.postgres: Optional[Union[asyncpg.Pool, asyncpg.Connection]] = None
         self.redis: Optional[redis.Redis] = None
         
         # Настройки подключения (будут загружаться из config)
@@ -20,93 +141,91 @@ class DatabaseStorage:
         
         # Кэш TTL настройки
         self.cache_ttl = {
-            'user_cache': 300,      # 5 минут
+            'user_cache': 21600,    # 6 часов (сбрасывается при записи)
+            'user_cache_local': 900,  # 15 минут в памяти процесса
             'match_cache': 3600,    # 1 час
             'session_cache': 1800,  # 30 минут
             'faceit_cache': 300     # 5 минут
         }
+        
+        # Таблицы с помесячными партициями (migrations/005_time_partitioning.sql)
+        self.partitioned_tables = ('match_history', 'match_notifications', 'notification_logs')
+        
+        self._advance_watermark_script = None
+        
+        # Профиль и настройки пользователя: память процесса + Redis
+        self.user_cache = UserRecordCache(
+            l1_ttl=self.cache_ttl['user_cache_local'],
+            redis_ttl=self.cache_ttl['user_cache']
+        )
     
-    async def connect(self, postgres_url: str, redis_url: str):
-        """Подключение к PostgreSQL и Redis"""
+    async def connect(self, postgres_url: str, redis_url: str, run_migrations: bool = True,
+                      pool_size: int = 10):
+        """Подключение к PostgreSQL и Redis
+        
+        run_migrations=False пропускает применение миграций на старте
+        (их применяют отдельно: python -m bot.services.migrations migrate).
+        """
         try:
             # Подключение к PostgreSQL
-            self.postgres = await asyncpg.connect(postgres_url)
-            logger.info("✅ Подключение к PostgreSQL установлено")
+            self.postgres = await asyncpg.create_pool(
+                postgres_url, min_size=min(2, pool_size), max_size=pool_size
+            )
+            logger.info(f"✅ Подключение к PostgreSQL установлено (пул до {pool_size})")
             
             # Подключение к Redis
             self.redis = redis.from_url(redis_url, decode_responses=True)
             await self.redis.ping()
             logger.info("✅ Подключение к Redis установлено")
+            await self.user_cache.start(self.redis)
+            
+            # Схема базы данных
+            await self._check_schema(run_migrations)
             
-            # Создание необходимых таблиц
-            await self._create_tables()
-            logger.info("✅ Таблицы базы данных проверены/созданы")
+            # Партиции на ближайшие месяцы
+            await self.ensure_partitions()
             
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к базам данных: {e}")
             raise
     
-    async def _create_tables(self):
-        """Создание необходимых таблиц при первом запуске"""
-        try:
-            # Таблица для кэша FACEIT API
-            await self.postgres.execute("""
-                CREATE TABLE IF NOT EXISTS faceit_cache (
-                    cache_key TEXT PRIMARY KEY,
-                    data JSONB NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
-                );
-                CREATE INDEX IF NOT EXISTS idx_faceit_cache_expires_at ON faceit_cache(expires_at);
-            """)
-            
-            # Таблица для пользователей
-            await self.postgres.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    faceit_id TEXT UNIQUE NOT NULL,
-                    nickname TEXT NOT NULL,
-                    last_seen TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-                CREATE INDEX IF NOT EXISTS idx_users_faceit_id ON users(faceit_id);
-            """)
-            
-            # Таблица для сессий пользователей
-            await self.postgres.execute("""
-                CREATE TABLE IF NOT EXISTS user_sessions (
-                    session_id TEXT PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    data JSONB NOT NULL,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
-                    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
-                );
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);
-                CREATE INDEX IF NOT EXISTS idx_user_sessions_expires_at ON user_sessions(expires_at);
-            """)
-            
-            # Таблица для уведомлений  
-            await self.postgres.execute("""
-                CREATE TABLE IF NOT EXISTS notifications (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    notification_type TEXT NOT NULL,
-                    data JSONB NOT NULL,
-                    sent BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
-                );
-                CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id);
-                CREATE INDEX IF NOT EXISTS idx_notifications_sent ON notifications(sent);
-            """)
-            
-            logger.info("✅ Схема базы данных готова (4 таблицы)")
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка создания таблиц: {e}")
-            raise
+    async def _check_schema(self, run_migrations: bool):
+        """Применить неприменённые миграции или только сообщить о них"""
+        # Advisory lock миграций держится на уровне сессии - нужно одно подключение
+        async with self.postgres.acquire() as connection:
+            runner = MigrationRunner(connection)
+            
+            if run_migrations:
+                await runner.migrate()
+            else:
+                pending = await runner.pending()
+                if pending:
+                    logger.warning(
+                        f"⚠️ Схема БД отстает на {len(pending)} миграций "
+                        f"(до версии {pending[-1].version}), примените их перед запуском"
+                    )
+            
+            logger.info(f"✅ Версия схемы базы данных: {await runner.current_version()}")
+    
+    @asynccontextmanager
+    async def transaction(self):
+        """Подключение с открытой транзакцией
+        
+        Запросы внутри транзакции должны идти через полученное подключение,
+        а не через пул.
+        """
+        if isinstance(self.postgres, asyncpg.Pool):
+            async with self.postgres.acquire() as connection:
+                async with connection.transaction():
+                    yield connection
+        else:
+            async with self.postgres.transaction():
+                yield self.postgres
 
     async def disconnect(self):
         """Закрытие подключений"""
+        await self.user_cache.stop()
+        
         if self.postgres:
             await self.postgres.close()
             logger.info("PostgreSQL connection closed")
@@ -132,15 +251,8 @@ class DatabaseStorage:
         try:
             await self.postgres.execute(query, user_id, faceit_id, nickname)
             
-            # Также кэшируем в Redis
-            user_data = {
-                'faceit_id': faceit_id,
-                'nickname': nickname,
-                'created_at': datetime.now().isoformat(),
-                'last_activity': datetime.now().isoformat()
-            }
-            await self.redis.hset(f"user:{user_id}", mapping=user_data)
-            await self.redis.expire(f"user:{user_id}", self.cache_ttl['user_cache'])
+            # Сбрасываем запись пользователя во всех репликах
+            await self.user_cache.invalidate(user_id)
             
             logger.info(f"User {user_id} ({nickname}) saved successfully")
             
@@ -150,13 +262,9 @@ class DatabaseStorage:
     
     async def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получить данные пользователя"""
-        # Сначала пробуем Redis
-        try:
-            cached_data = await self.redis.hgetall(f"user:{user_id}")
-            if cached_data:
-                return cached_data
-        except Exception as e:
-            logger.warning(f"Redis cache miss for user {user_id}: {e}")
+        found, user_data = await self.user_cache.get(user_id, 'user')
+        if found:
+            return user_data
         
         # Если нет в кэше, обращаемся к PostgreSQL
         query = """
@@ -165,20 +273,18 @@ class DatabaseStorage:
         """
         
         try:
+            version = await self.user_cache.version(user_id)
             row = await self.postgres.fetchrow(query, user_id)
+            user_data = None
             if row:
                 user_data = dict(row)
                 # Преобразуем datetime в строки для JSON
                 user_data['created_at'] = user_data['created_at'].isoformat()
                 user_data['last_activity'] = user_data['last_activity'].isoformat()
-                
-                # Кэшируем результат
-                await self.redis.hset(f"user:{user_id}", mapping=user_data)
-                await self.redis.expire(f"user:{user_id}", self.cache_ttl['user_cache'])
-                
-                return user_data
             
-            return None
+            # Кэшируем и отсутствие пользователя: save_user сбросит запись
+            await self.user_cache.set(user_id, 'user', user_data, version)
+            return user_data
             
         except Exception as e:
             logger.error(f"Error getting user {user_id}: {e}")
@@ -193,15 +299,23 @@ class DatabaseStorage:
     
     async def get_user_settings(self, user_id: int) -> Dict[str, Any]:
         """Получить настройки пользователя"""
+        found, settings = await self.user_cache.get(user_id, 'settings')
+        if found:
+            return settings
+        
         query = """
             SELECT notifications, language, subscription_type, updated_at
             FROM user_settings WHERE user_id = $1
         """
         
         try:
+            version = await self.user_cache.version(user_id)
             row = await self.postgres.fetchrow(query, user_id)
             if row:
-                return dict(row)
+                settings = dict(row)
+                settings['updated_at'] = settings['updated_at'].isoformat() if settings['updated_at'] else None
+                await self.user_cache.set(user_id, 'settings', settings, version)
+                return dict(settings)
             else:
                 # Создаем настройки по умолчанию
                 await self.update_user_settings(user_id, {
@@ -240,8 +354,8 @@ class DatabaseStorage:
                 settings.get('subscription_type')
             )
             
-            # Инвалидируем кэш настроек
-            await self.redis.delete(f"settings:{user_id}")
+            # Инвалидируем запись пользователя во всех репликах
+            await self.user_cache.invalidate(user_id)
             
         except Exception as e:
             logger.error(f"Error updating user settings {user_id}: {e}")
@@ -355,10 +469,79 @@ class DatabaseStorage:
         except Exception as e:
             logger.error(f"Error setting cached data {cache_key}: {e}")
     
+    async def get_cached_many(self, cache_keys: List[str]) -> Dict[str, Any]:
+        """Несколько записей кэша: Redis одним MGET, промахи - одним запросом к PostgreSQL"""
+        cache_keys = list(dict.fromkeys(cache_keys))
+        if not cache_keys:
+            return {}
+        
+        found = {}
+        try:
+            values = await self.redis.mget([f"faceit:{key}" for key in cache_keys])
+            for key, value in zip(cache_keys, values):
+                if value:
+                    found[key] = json.loads(value)
+        except Exception as e:
+            logger.error(f"Error getting cached data batch: {e}")
+        
+        missing = [key for key in cache_keys if key not in found]
+        if not missing:
+            return found
+        
+        query = """
+            SELECT cache_key, data FROM faceit_cache
+            WHERE cache_key = ANY($1::text[]) AND expires_at > NOW()
+        """
+        
+        try:
+            rows = await self.postgres.fetch(query, missing)
+            restored = {
+                row['cache_key']: json.loads(row['data']) if isinstance(row['data'], str) else row['data']
+                for row in rows
+            }
+            found.update(restored)
+            if restored:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, data in restored.items():
+                        pipe.setex(f"faceit:{key}", self.cache_ttl['faceit_cache'], json.dumps(data))
+                    await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error restoring cached data batch: {e}")
+        
+        return found
+    
+    async def set_cached_many(self, items: Dict[str, Any], ttl_minutes: int = 5) -> None:
+        """Сохранить несколько записей кэша: Redis одним пайплайном, PostgreSQL одним executemany"""
+        if not items:
+            return
+        
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, data in items.items():
+                    pipe.setex(f"faceit:{key}", ttl_minutes * 60, json.dumps(data))
+                await pipe.execute()
+            
+            query = """
+                INSERT INTO faceit_cache (cache_key, data, created_at, expires_at)
+                VALUES ($1, $2::jsonb, NOW(), NOW() + INTERVAL '%s minutes')
+                ON CONFLICT (cache_key)
+                DO UPDATE SET
+                    data = EXCLUDED.data,
+                    created_at = NOW(),
+                    expires_at = NOW() + INTERVAL '%s minutes'
+            """ % (ttl_minutes, ttl_minutes)
+            
+            await self.postgres.executemany(
+                query, [(key, json.dumps(data, ensure_ascii=False)) for key, data in items.items()]
+            )
+            
+        except Exception as e:
+            logger.error(f"Error setting cached data batch: {e}")
+    
     # === ИСТОРИЯ МАТЧЕЙ ===
     
     async def save_match(self, match_data: Dict[str, Any]) -> None:
-        """Сохранить матч в историю"""
+        """Сохранить матч в историю и обновить агрегаты в той же транзакции"""
         query = """
             INSERT INTO match_history (
                 match_id, user_id, finished_at, result,
@@ -366,53 +549,249 @@ class DatabaseStorage:
                 headshots, headshot_percentage, map_name,
                 score_team1, score_team2, rounds_played
             ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15)
-            ON CONFLICT (match_id) DO UPDATE SET
+            ON CONFLICT (match_id, user_id, finished_at) DO UPDATE SET
                 result = EXCLUDED.result,
                 kills = EXCLUDED.kills,
                 deaths = EXCLUDED.deaths,
                 assists = EXCLUDED.assists,
                 adr = EXCLUDED.adr,
                 hltv_rating = EXCLUDED.hltv_rating
-        """
+            RETURNING {columns}
+        """.format(columns=", ".join(AGGREGATE_SOURCE_COLUMNS))
         
         try:
-            await self.postgres.execute(
-                query,
-                match_data.get('match_id'),
-                match_data.get('user_id'),
-                match_data.get('finished_at'),
-                match_data.get('result'),
-                match_data.get('kills', 0),
-                match_data.get('deaths', 0),
-                match_data.get('assists', 0),
-                match_data.get('adr', 0.0),
-                match_data.get('hltv_rating', 0.0),
-                match_data.get('headshots', 0),
-                match_data.get('headshot_percentage', 0.0),
-                match_data.get('map_name'),
-                match_data.get('score_team1', 0),
-                match_data.get('score_team2', 0),
-                match_data.get('rounds_played', 0)
-            )
+            async with self.transaction() as connection:
+                # Одновременные первые сохранения матча игрока не видят строк друг
+                # друга (FOR UPDATE не блокирует отсутствующую строку), поэтому
+                # сохранения одного матча идут по очереди до конца транзакции
+                await connection.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext($1))", match_data.get('match_id')
+                )
+                
+                # Старая версия строки нужна, чтобы повторное сохранение матча
+                # не посчитало его в агрегатах дважды. В одном матче бывает
+                # несколько отслеживаемых игроков - у каждого своя строка
+                previous = await connection.fetchrow(
+                    "SELECT {columns} FROM match_history WHERE match_id = $1 AND user_id = $2 FOR UPDATE".format(
+                        columns=", ".join(AGGREGATE_SOURCE_COLUMNS)
+                    ),
+                    match_data.get('match_id'),
+                    match_data.get('user_id')
+                )
+                
+                # finished_at - ключ партиционирования, для уже сохраненного
+                # матча оставляем исходное значение, чтобы не создать дубликат
+                finished_at = previous['finished_at'] if previous else match_data.get('finished_at')
+                
+                saved = await connection.fetchrow(
+                    query,
+                    match_data.get('match_id'),
+                    match_data.get('user_id'),
+                    finished_at,
+                    match_data.get('result'),
+                    match_data.get('kills', 0),
+                    match_data.get('deaths', 0),
+                    match_data.get('assists', 0),
+                    match_data.get('adr', 0.0),
+                    match_data.get('hltv_rating', 0.0),
+                    match_data.get('headshots', 0),
+                    match_data.get('headshot_percentage', 0.0),
+                    match_data.get('map_name'),
+                    match_data.get('score_team1', 0),
+                    match_data.get('score_team2', 0),
+                    match_data.get('rounds_played', 0)
+                )
+                
+                if previous:
+                    await self._apply_stats_delta(connection, previous, -1)
+                await self._apply_stats_delta(connection, saved, 1)
+                
         except Exception as e:
             logger.error(f"Error saving match {match_data.get('match_id')}: {e}")
             raise
     
-    async def get_match_history(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
-        """Получить историю матчей пользователя"""
+    async def _apply_stats_delta(self, connection, row, sign: int) -> None:
+        """Прибавить (sign=1) или вычесть (sign=-1) матч из дневных агрегатов"""
         query = """
-            SELECT * FROM match_history 
-            WHERE user_id = $1 
-            ORDER BY finished_at DESC 
-            LIMIT $2
+            INSERT INTO player_stats_daily (
+                user_id, day, map_name, matches, wins, losses,
+                kills, deaths, assists, headshots, rounds_played,
+                adr_sum, rating_sum, updated_at
+            ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, NOW())
+            ON CONFLICT (user_id, day, map_name) DO UPDATE SET
+                matches = player_stats_daily.matches + EXCLUDED.matches,
+                wins = player_stats_daily.wins + EXCLUDED.wins,
+                losses = player_stats_daily.losses + EXCLUDED.losses,
+                kills = player_stats_daily.kills + EXCLUDED.kills,
+                deaths = player_stats_daily.deaths + EXCLUDED.deaths,
+                assists = player_stats_daily.assists + EXCLUDED.assists,
+                headshots = player_stats_daily.headshots + EXCLUDED.headshots,
+                rounds_played = player_stats_daily.rounds_played + EXCLUDED.rounds_played,
+                adr_sum = player_stats_daily.adr_sum + EXCLUDED.adr_sum,
+                rating_sum = player_stats_daily.rating_sum + EXCLUDED.rating_sum,
+                updated_at = NOW()
         """
         
+        finished_at = row['finished_at']
+        if finished_at.tzinfo is not None:
+            finished_at = finished_at.astimezone(timezone.utc)
+        
+        await connection.execute(
+            query,
+            row['user_id'],
+            finished_at.date(),
+            row['map_name'] or 'Unknown',
+            sign,
+            sign if row['result'] == 'win' else 0,
+            sign if row['result'] == 'loss' else 0,
+            sign * (row['kills'] or 0),
+            sign * (row['deaths'] or 0),
+            sign * (row['assists'] or 0),
+            sign * (row['headshots'] or 0),
+            sign * (row['rounds_played'] or 0),
+            sign * (row['adr'] or 0.0),
+            sign * (row['hltv_rating'] or 0.0)
+        )
+    
+    async def get_match_history(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        """Получить историю матчей пользователя (первая страница)"""
+        page = await self.get_match_history_page(user_id, limit=limit)
+        return page['matches']
+    
+    async def get_match_history_page(self, user_id: int, limit: int = 20,
+                                     cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Получить страницу истории матчей с keyset-пагинацией
+        
+        Страницы упорядочены по (finished_at, match_id) по убыванию. Курсор -
+        строка из encode_history_cursor для последнего матча предыдущей
+        страницы; стоимость запроса не зависит от глубины страницы.
+        
+        Возвращает {'matches': [...], 'next_cursor': str | None}
+        """
+        columns = ", ".join(MATCH_HISTORY_COLUMNS)
+        position = decode_history_cursor(cursor) if cursor else None
+        
         try:
-            rows = await self.postgres.fetch(query, user_id, limit)
-            return [dict(row) for row in rows]
+            # Берем на одну строку больше, чтобы понять есть ли следующая страница
+            if position:
+                query = f"""
+                    SELECT {columns} FROM match_history
+                    WHERE user_id = $1 AND (finished_at, match_id) < ($2, $3)
+                    ORDER BY finished_at DESC, match_id DESC
+                    LIMIT $4
+                """
+                rows = await self.postgres.fetch(query, user_id, position[0], position[1], limit + 1)
+            else:
+                query = f"""
+                    SELECT {columns} FROM match_history
+                    WHERE user_id = $1
+                    ORDER BY finished_at DESC, match_id DESC
+                    LIMIT $2
+                """
+                rows = await self.postgres.fetch(query, user_id, limit + 1)
+            
+            matches = [dict(row) for row in rows[:limit]]
+            next_cursor = None
+            if len(rows) > limit and matches:
+                last = matches[-1]
+                next_cursor = encode_history_cursor(last['finished_at'], last['match_id'])
+            
+            return {'matches': matches, 'next_cursor': next_cursor}
+            
         except Exception as e:
             logger.error(f"Error getting match history {user_id}: {e}")
-            return []
+            return {'matches': [], 'next_cursor': None}
+    
+    async def get_window_stats(self, user_id: int, last_n: Optional[int] = None,
+                               since: Optional[datetime] = None, offset: int = 0,
+                               match_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Суммарная статистика за окно матчей одним запросом по индексу
+        
+        Окно задается последними last_n матчами (со сдвигом offset), временем
+        начала since (например, начало сессии) или явным списком match_ids.
+        Читает только колонки покрывающего индекса idx_match_history_user_finished.
+        """
+        conditions = ["user_id = $1"]
+        params: List[Any] = [user_id]
+        
+        if since is not None:
+            params.append(since)
+            conditions.append(f"finished_at >= ${len(params)}")
+        if match_ids is not None:
+            params.append(list(match_ids))
+            conditions.append(f"match_id = ANY(${len(params)})")
+        
+        window = f"""
+            SELECT result, kills, deaths, assists, adr, hltv_rating,
+                   headshot_percentage, rounds_played
+            FROM match_history
+            WHERE {' AND '.join(conditions)}
+            ORDER BY finished_at DESC, match_id DESC
+        """
+        if last_n is not None:
+            params.extend([last_n, offset])
+            window += f" LIMIT ${len(params) - 1} OFFSET ${len(params)}"
+        
+        query = f"""
+            SELECT
+                COUNT(*) AS matches,
+                COUNT(*) FILTER (WHERE result = 'win') AS wins,
+                COUNT(*) FILTER (WHERE result = 'loss') AS losses,
+                COALESCE(SUM(kills), 0) AS kills,
+                COALESCE(SUM(deaths), 0) AS deaths,
+                COALESCE(SUM(assists), 0) AS assists,
+                COALESCE(SUM(kills * headshot_percentage / 100.0), 0) AS headshots,
+                COALESCE(SUM(rounds_played), 0) AS rounds_played,
+                COALESCE(SUM(adr), 0) AS adr_sum,
+                COALESCE(SUM(hltv_rating), 0) AS rating_sum
+            FROM ({window}) AS window_matches
+        """
+        
+        try:
+            row = await self.postgres.fetchrow(query, *params)
+            return summarize_stats_row(row)
+        except Exception as e:
+            logger.error(f"Error getting window stats {user_id}: {e}")
+            return summarize_stats_row(None)
+    
+    async def get_aggregate_stats(self, user_id: int, since_day: Optional[datetime] = None,
+                                  by_map: bool = False) -> Any:
+        """Статистика из дневных агрегатов (без чтения отдельных матчей)
+        
+        by_map=True возвращает словарь {map_name: stats}, иначе общие итоги.
+        """
+        params: List[Any] = [user_id]
+        condition = "user_id = $1"
+        if since_day is not None:
+            params.append(since_day.date() if isinstance(since_day, datetime) else since_day)
+            condition += " AND day >= $2"
+        
+        query = f"""
+            SELECT {'map_name,' if by_map else ''}
+                COALESCE(SUM(matches), 0) AS matches,
+                COALESCE(SUM(wins), 0) AS wins,
+                COALESCE(SUM(losses), 0) AS losses,
+                COALESCE(SUM(kills), 0) AS kills,
+                COALESCE(SUM(deaths), 0) AS deaths,
+                COALESCE(SUM(assists), 0) AS assists,
+                COALESCE(SUM(headshots), 0) AS headshots,
+                COALESCE(SUM(rounds_played), 0) AS rounds_played,
+                COALESCE(SUM(adr_sum), 0) AS adr_sum,
+                COALESCE(SUM(rating_sum), 0) AS rating_sum
+            FROM player_stats_daily
+            WHERE {condition}
+            {'GROUP BY map_name' if by_map else ''}
+        """
+        
+        try:
+            if by_map:
+                rows = await self.postgres.fetch(query, *params)
+                return {row['map_name']: summarize_stats_row(row) for row in rows if row['matches'] > 0}
+            row = await self.postgres.fetchrow(query, *params)
+            return summarize_stats_row(row)
+        except Exception as e:
+            logger.error(f"Error getting aggregate stats {user_id}: {e}")
+            return {} if by_map else summarize_stats_row(None)
     
     # === УТИЛИТЫ ===
     
@@ -468,6 +847,27 @@ class DatabaseStorage:
             logger.error(f"Error getting user by faceit_id {faceit_id}: {e}")
             return None
     
+    async def get_users_by_faceit_ids(self, faceit_ids: List[str]) -> List[Dict[str, Any]]:
+        """Пользователи с включенными уведомлениями среди указанных FACEIT ID"""
+        query = """
+            SELECT u.user_id, u.faceit_id, u.nickname, us.notifications
+            FROM users u
+            LEFT JOIN user_settings us ON u.user_id = us.user_id
+            WHERE u.faceit_id = ANY($1::text[])
+              AND (us.notifications = true OR us.notifications IS NULL)
+        """
+        
+        faceit_ids = [f for f in faceit_ids if f]
+        if not faceit_ids:
+            return []
+        
+        try:
+            rows = await self.postgres.fetch(query, faceit_ids)
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting users by faceit_ids: {e}")
+            return []
+    
     async def is_match_notification_sent(self, match_id: str, user_id: int) -> bool:
         """Проверить, было ли уже отправлено уведомление о матче"""
         query = """
@@ -484,15 +884,26 @@ class DatabaseStorage:
     
     async def mark_match_notification_sent(self, match_id: str, user_id: int, match_data: Dict[str, Any] = None) -> None:
         """Отметить что уведомление о матче было отправлено"""
+        # match_notifications партиционирована по sent_at, поэтому уникального
+        # ограничения на (match_id, user_id) нет. Проверка существования без
+        # блокировки пропускает одновременные вставки (webhook и мониторинг,
+        # несколько реплик), поэтому отметки одной пары идут по очереди до
+        # конца транзакции
         query = """
             INSERT INTO match_notifications (match_id, user_id, sent_at, match_data)
-            VALUES ($1, $2, NOW(), $3)
-            ON CONFLICT (match_id, user_id) DO NOTHING
+            SELECT $1, $2, NOW(), $3
+            WHERE NOT EXISTS (
+                SELECT 1 FROM match_notifications WHERE match_id = $1 AND user_id = $2
+            )
         """
         
         try:
             match_json = json.dumps(match_data) if match_data else None
-            await self.postgres.execute(query, match_id, user_id, match_json)
+            async with self.transaction() as connection:
+                await connection.execute(
+                    "SELECT pg_advisory_xact_lock(hashtext($1))", f"{match_id}:{user_id}"
+                )
+                await connection.execute(query, match_id, user_id, match_json)
         except Exception as e:
             logger.error(f"Error marking match notification {match_id} for user {user_id}: {e}")
             raise
@@ -513,6 +924,75 @@ class DatabaseStorage:
             logger.error(f"Error getting last processed match time for {faceit_id}: {e}")
             return None
     
+    async def get_match_watermarks(self, faceit_ids: List[str]) -> Dict[str, Tuple[int, str]]:
+        """Отметки последнего обработанного матча для группы игроков
+        
+        Один HMGET на всю группу. Отсутствующие в Redis отметки (первый опрос,
+        потеря Redis) восстанавливаются одним запросом к match_history.
+        """
+        faceit_ids = list(dict.fromkeys(f for f in faceit_ids if f))
+        if not faceit_ids:
+            return {}
+        
+        watermarks = {}
+        try:
+            values = await self.redis.hmget(MATCH_WATERMARK_KEY, faceit_ids)
+            for faceit_id, value in zip(faceit_ids, values):
+                watermark = parse_match_watermark(value)
+                if watermark:
+                    watermarks[faceit_id] = watermark
+        except Exception as e:
+            logger.warning(f"Error reading match watermarks: {e}")
+        
+        missing = [f for f in faceit_ids if f not in watermarks]
+        if not missing:
+            return watermarks
+        
+        query = """
+            SELECT u.faceit_id, MAX(mh.finished_at) AS last_match_time
+            FROM match_history mh
+            JOIN users u ON mh.user_id = u.user_id
+            WHERE u.faceit_id = ANY($1::text[])
+            GROUP BY u.faceit_id
+        """
+        
+        try:
+            rows = await self.postgres.fetch(query, missing)
+            seeded = {
+                row['faceit_id']: (int(row['last_match_time'].timestamp()), '')
+                for row in rows if row['last_match_time']
+            }
+            watermarks.update(seeded)
+            if seeded:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for faceit_id, (finished_at, _) in seeded.items():
+                        pipe.hsetnx(MATCH_WATERMARK_KEY, faceit_id, f"{finished_at}|")
+                    await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error restoring match watermarks: {e}")
+        
+        return watermarks
+    
+    async def get_match_watermark(self, faceit_id: str) -> Optional[Tuple[int, str]]:
+        """Отметка последнего обработанного матча игрока"""
+        return (await self.get_match_watermarks([faceit_id])).get(faceit_id)
+    
+    async def advance_match_watermark(self, faceit_id: str, finished_at: int, match_id: str) -> bool:
+        """Сдвинуть отметку вперед после отправки уведомления о матче"""
+        if not faceit_id or not finished_at:
+            return False
+        
+        try:
+            if self._advance_watermark_script is None:
+                self._advance_watermark_script = self.redis.register_script(ADVANCE_WATERMARK_SCRIPT)
+            advanced = await self._advance_watermark_script(
+                keys=[MATCH_WATERMARK_KEY], args=[faceit_id, int(finished_at), match_id]
+            )
+            return bool(advanced)
+        except Exception as e:
+            logger.error(f"Error advancing match watermark for {faceit_id}: {e}")
+            return False
+    
     async def save_notification_log(self, user_id: int, match_id: str, status: str, error_message: str = None) -> None:
         """Сохранить лог уведомления"""
         query = """
@@ -526,24 +1006,42 @@ class DatabaseStorage:
             logger.error(f"Error saving notification log: {e}")
     
     async def cleanup_old_notifications(self, days: int = 30) -> None:
-        """Очистить старые записи уведомлений"""
+        """Очистить старые записи уведомлений
+        
+        Таблицы уведомлений разбиты на помесячные партиции, поэтому очистка
+        удаляет месяцы, целиком вышедшие за срок хранения, без построчных DELETE.
+        """
         try:
-            # Удаляем старые записи о отправленных уведомлениях
-            await self.postgres.execute(
-                "DELETE FROM match_notifications WHERE sent_at < NOW() - INTERVAL '%s days'", 
-                days
-            )
+            dropped = await self.postgres.fetchval("SELECT clean_old_notifications($1)", days)
+            logger.info(f"Cleaned up notifications older than {days} days ({dropped} partitions dropped)")
             
-            # Удаляем старые логи уведомлений
-            await self.postgres.execute(
-                "DELETE FROM notification_logs WHERE created_at < NOW() - INTERVAL '%s days'", 
-                days
+        except Exception as e:
+            logger.error(f"Error cleaning up old notifications: {e}")
+    
+    async def cleanup_old_matches(self, days: int) -> None:
+        """Удалить партиции истории матчей старше days дней"""
+        try:
+            dropped = await self.postgres.fetchval(
+                "SELECT drop_expired_partitions('match_history', make_interval(days => $1))", days
             )
+            logger.info(f"Cleaned up match history older than {days} days ({dropped} partitions dropped)")
             
-            logger.info(f"Cleaned up notifications older than {days} days")
+        except Exception as e:
+            logger.error(f"Error cleaning up old match history: {e}")
+    
+    async def ensure_partitions(self, months_ahead: int = 2) -> None:
+        """Создать партиции текущего и следующих месяцев для журналируемых таблиц"""
+        try:
+            created = 0
+            for table in self.partitioned_tables:
+                created += await self.postgres.fetchval(
+                    "SELECT ensure_monthly_partitions($1, $2)", table, months_ahead
+                )
+            if created:
+                logger.info(f"Created {created} new monthly partitions")
             
         except Exception as e:
-            logger.error(f"Error cleaning up old notifications: {e}")
+            logger.error(f"Error ensuring partitions: {e}")
 
     async def get_stats(self) -> Dict[str, Any]:
         """Получить статистику базы данных"""
@@ -577,6 +1075,9 @@ class DatabaseStorage:
             stats['expired_cache_entries'] = expired_cache_count  
             stats['cache_table_size'] = total_cache_size
             
+            # Кэш профилей и настроек пользователей
+            stats['user_cache'] = self.user_cache.get_stats()
+            
             # Redis статистика
             try:
                 redis_info = await self.redis.info('memory')
@@ -0,0 +1,83 @@
+"""
+Идемпотентность обработки событий и матчей
+
+Ключ idem:{key} ставится через SET NX EX до любых запросов к FACEIT API:
+- "processing" с коротким TTL, пока обработка идет (если процесс упал,
+  ключ истечет и событие можно будет обработать снова);
+- "done" с TTL окна дедупликации после успешной обработки.
+При ошибке ключ удаляется, чтобы повтор из очереди или следующий опрос
+не был отброшен. Webhook и мониторинг используют одни и те же ключи
+match:{match_id}:finished, поэтому матч загружается один раз.
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "idem:"
+
+
+def event_key(event_id: str) -> str:
+    return f"event:{event_id}"
+
+
+def finished_match_key(match_id: str) -> str:
+    return f"match:{match_id}:finished"
+
+
+class IdempotencyStore:
+    """Окно дедупликации на Redis"""
+
+    def __init__(self, storage, ttl: int = 86400, processing_ttl: int = 300):
+        self.storage = storage
+        self.ttl = ttl
+        self.processing_ttl = processing_ttl
+        self.stats = {'acquired': 0, 'duplicates': 0}
+
+    async def begin(self, key: str) -> bool:
+        """Занять ключ на время обработки; False - уже обработан или в работе"""
+        try:
+            acquired = await self.storage.redis.set(
+                KEY_PREFIX + key, "processing", nx=True, ex=self.processing_ttl
+            )
+        except Exception as e:
+            # Без Redis лучше обработать дважды, чем потерять событие
+            logger.warning(f"Idempotency check failed for {key}: {e}")
+            return True
+
+        self.stats['acquired' if acquired else 'duplicates'] += 1
+        return bool(acquired)
+
+    async def complete(self, key: str) -> None:
+        """Отметить ключ обработанным на окно дедупликации"""
+        try:
+            await self.storage.redis.set(KEY_PREFIX + key, "done", ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to complete idempotency key {key}: {e}")
+
+    async def release(self, key: str) -> None:
+        """Освободить ключ после неудачной обработки"""
+        try:
+            await self.storage.redis.delete(KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Failed to release idempotency key {key}: {e}")
+
+    @asynccontextmanager
+    async def claim(self, key: str) -> AsyncIterator[bool]:
+        """begin + complete/release вокруг блока обработки"""
+        acquired = await self.begin(key)
+        if not acquired:
+            yield False
+            return
+
+        try:
+            yield True
+        except BaseException:
+            await self.release(key)
+            raise
+        await self.complete(key)
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
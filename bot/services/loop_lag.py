@@ -0,0 +1,58 @@
+"""
+Задержка цикла событий
+
+LoopLagMonitor измеряет, насколько позже назначенного просыпается
+asyncio.sleep. Долгие синхронные участки (форматирование, разбор ответов
+API) видны в ней сразу, независимо от того, какой обработчик их вызвал.
+
+Пула процессов для таких участков нет: расчеты бота на реальных размерах
+(пачка воркера до batch_size игроков, анализ матча, форма по 100 матчам)
+занимают от долей до единиц миллисекунд, а передача их данных в другой
+процесс через pickle стоит дороже самого расчета.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """Задержка цикла событий по опоздавшим пробуждениям"""
+
+    def __init__(self, interval: float = 0.5, window: int = 240, warn_ms: float = 200):
+        self.interval = interval
+        self.warn_ms = warn_ms
+        # Последние замеры (по умолчанию - за 2 минуты)
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.max_ms = 0.0
+        self.stalls = 0
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.record((time.monotonic() - started - self.interval) * 1000)
+
+    def record(self, lag_ms: float) -> None:
+        lag_ms = max(0.0, lag_ms)
+        self.samples.append(lag_ms)
+        self.max_ms = max(self.max_ms, lag_ms)
+        if lag_ms >= self.warn_ms:
+            self.stalls += 1
+            logger.warning(f"Event loop stalled for {lag_ms:.0f}ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        p95 = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.95) - 1)] if ordered else 0.0
+        return {
+            'last_ms': round(self.samples[-1], 1) if self.samples else 0.0,
+            'avg_ms': round(sum(ordered) / len(ordered), 1) if ordered else 0.0,
+            'p95_ms': round(p95, 1),
+            'max_ms': round(self.max_ms, 1),
+            'stalls': self.stalls,
+        }
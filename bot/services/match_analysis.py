@@ -0,0 +1,246 @@
+"""
+Анализ текущего матча: общий кэш по match_id и фоновый расчет
+
+Анализ состава (статистика десяти игроков) хранится один раз на матч
+(match_analysis_{match_id}): пока матч идет - с коротким TTL, после
+окончания - дольше, так как результат уже не меняется. Пользователю
+сохраняется только указатель current_match_{user_id} с match_id, поэтому
+десять человек, открывших один матч, читают одну запись. Недавно
+прочитанные анализы держатся в памяти процесса fresh_seconds - переходы
+между экранами анализа не перечитывают запись из Redis.
+
+Анализ считается заранее - по событиям FACEIT match_status_configuring/ready
+для матчей, в которых играют подписчики бота, и участникам сразу ставится
+указатель: ссылка на матч и меню анализа открываются без ожидания.
+
+Один матч считается одной задачей: повторные события и запросы
+пользователей, пришедшие во время расчета, ждут ту же задачу. Свежий
+анализ (моложе fresh_seconds) не пересчитывается. Между репликами расчет
+по событию делится ключом IdempotencyStore (match:{match_id}:analysis:{stage}).
+На ready анализ пересчитывается, если в нем еще нет карты.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from bot.services.idempotency import IdempotencyStore
+
+logger = logging.getLogger(__name__)
+
+# Статусы FACEIT, при которых матч еще идет и анализ может измениться
+LIVE_STATUSES = {'CHECK_IN', 'SUBSTITUTION', 'CAPTAIN_PICK', 'VOTING', 'CONFIGURING', 'READY', 'ONGOING'}
+
+
+def match_analysis_key(match_id: str) -> str:
+    return f"match_analysis_{match_id}"
+
+
+def user_match_key(user_id: int) -> str:
+    return f"current_match_{user_id}"
+
+
+def analysis_lock_key(match_id: str, stage: str) -> str:
+    return f"match:{match_id}:analysis:{stage}"
+
+
+def analysis_age(analysis: Dict[str, Any]) -> float:
+    """Возраст анализа в секундах (analyzed_at - локальное время расчета)"""
+    try:
+        return (datetime.now() - datetime.fromisoformat(analysis['analyzed_at'])).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return float('inf')
+
+
+class MatchAnalysisPrecomputer:
+    """Общий по match_id кэш анализа матчей с предварительным расчетом"""
+
+    def __init__(self, storage, analyze: Callable[..., Awaitable[Optional[Dict[str, Any]]]],
+                 ttl_minutes: int = 30, live_ttl_minutes: int = 10, fresh_seconds: int = 60,
+                 concurrency: int = 2, lock_ttl: int = 120, max_local_entries: int = 256):
+        self.storage = storage
+        self.analyze = analyze
+        self.ttl_minutes = ttl_minutes
+        self.live_ttl_minutes = live_ttl_minutes
+        self.fresh_seconds = fresh_seconds
+        self.max_local_entries = max_local_entries
+        self.idempotency = IdempotencyStore(storage, ttl=ttl_minutes * 60, processing_ttl=lock_ttl)
+
+        # Фоновые расчеты не должны занять весь лимит запросов к FACEIT API
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Этап, пришедший во время расчета предыдущего (ready во время configuring)
+        self._pending_stages: Dict[str, str] = {}
+        # Подписчики, которым нужно поставить указатель по завершении расчета
+        self._recipients: Dict[str, Set[int]] = {}
+        # match_id -> (истекает в, анализ)
+        self._local: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        self.metrics = {
+            'scheduled': 0,
+            'precomputed': 0,
+            'skipped': 0,
+            'failed': 0,
+            'local_hits': 0,
+            'cache_hits': 0,
+            'joined_in_flight': 0,
+            'computed_on_demand': 0,
+            'last_duration': 0.0,
+        }
+
+    def ttl_for(self, analysis: Dict[str, Any]) -> int:
+        """TTL анализа в минутах: короткий, пока матч идет"""
+        status = str(analysis.get('match_info', {}).get('status', '')).upper()
+        return self.live_ttl_minutes if status in LIVE_STATUSES else self.ttl_minutes
+
+    def is_fresh(self, analysis: Optional[Dict[str, Any]]) -> bool:
+        return bool(analysis) and analysis_age(analysis) < self.fresh_seconds
+
+    def schedule(self, match_id: str, user_ids: Iterable[int], stage: str = "configuring") -> None:
+        """Запустить расчет в фоне (повторный вызов во время расчета - только добавит получателей)"""
+        self._recipients.setdefault(match_id, set()).update(user_ids)
+        if match_id in self._tasks:
+            self._pending_stages[match_id] = stage
+            return
+
+        self.metrics['scheduled'] += 1
+        task = asyncio.create_task(self._precompute(match_id, stage))
+        self._tasks[match_id] = task
+        task.add_done_callback(lambda _: self._on_done(match_id, stage))
+
+    def _on_done(self, match_id: str, stage: str) -> None:
+        self._tasks.pop(match_id, None)
+        pending = self._pending_stages.pop(match_id, None)
+        if pending and pending != stage:
+            self.schedule(match_id, (), pending)
+
+    async def get(self, match_id: str) -> Optional[Dict[str, Any]]:
+        """Готовый анализ матча, если он есть"""
+        entry = self._local.get(match_id)
+        if entry and entry[0] > time.monotonic():
+            self._local.move_to_end(match_id)
+            self.metrics['local_hits'] += 1
+            return entry[1]
+
+        analysis = await self.storage.get_cached_data(match_analysis_key(match_id), max_age_minutes=self.ttl_minutes)
+        if analysis:
+            self._store_local(match_id, analysis)
+        return analysis
+
+    async def get_or_compute(self, match_id: str, **analyze_kwargs) -> Optional[Dict[str, Any]]:
+        """Анализ для пользователя: из кэша, из идущего расчета или посчитать сейчас
+
+        analyze_kwargs передаются в analyze только при расчете по запросу
+        (например, обработчик прогресса загрузки игроков).
+        """
+        analysis = await self.get(match_id)
+        if analysis:
+            self.metrics['cache_hits'] += 1
+            return analysis
+        return await self._compute(match_id, **analyze_kwargs)
+
+    async def refresh(self, match_id: str, **analyze_kwargs) -> Optional[Dict[str, Any]]:
+        """Обновить анализ по запросу пользователя (свежий общий результат не пересчитывается)"""
+        analysis = await self.get(match_id)
+        if self.is_fresh(analysis):
+            self.metrics['cache_hits'] += 1
+            return analysis
+        return await self._compute(match_id, **analyze_kwargs)
+
+    async def set_user_match(self, user_id: int, match_id: str) -> None:
+        """Запомнить, какой матч пользователь смотрел последним"""
+        await self.storage.set_cached_data(user_match_key(user_id), {'match_id': match_id}, ttl_minutes=self.ttl_minutes)
+
+    async def get_user_analysis(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Анализ последнего матча пользователя (истекший общий анализ считается заново)"""
+        pointer = await self.storage.get_cached_data(user_match_key(user_id), max_age_minutes=self.ttl_minutes)
+        if not pointer or not pointer.get('match_id'):
+            return None
+        return await self.get_or_compute(pointer['match_id'])
+
+    async def stop(self) -> None:
+        """Отменить фоновые расчеты"""
+        tasks = list(self._tasks.values())
+        self._pending_stages.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.metrics, 'in_flight': len(self._tasks), 'local_entries': len(self._local)}
+
+    async def _compute(self, match_id: str, **analyze_kwargs) -> Optional[Dict[str, Any]]:
+        task = self._tasks.get(match_id)
+        if task:
+            self.metrics['joined_in_flight'] += 1
+            # shield: отмена запроса пользователя не отменяет общий расчет
+            analysis = await asyncio.shield(task)
+            if analysis:
+                return analysis
+
+        self.metrics['computed_on_demand'] += 1
+        analysis = await self.analyze(match_id, **analyze_kwargs)
+        if analysis:
+            await self._store(match_id, analysis)
+        return analysis
+
+    async def _precompute(self, match_id: str, stage: str) -> Optional[Dict[str, Any]]:
+        cached = await self.get(match_id)
+        if self.is_fresh(cached) and (stage != 'ready' or cached.get('map_name')):
+            self.metrics['skipped'] += 1
+            await self._point_users(match_id)
+            return cached
+
+        lock = analysis_lock_key(match_id, stage)
+        if not await self.idempotency.begin(lock):
+            # Этот этап уже посчитала другая реплика - остается поставить указатели
+            self.metrics['skipped'] += 1
+            await self._point_users(match_id)
+            return await self.get(match_id)
+
+        started = time.monotonic()
+        try:
+            async with self._semaphore:
+                analysis = await self.analyze(match_id)
+        except asyncio.CancelledError:
+            await self.idempotency.release(lock)
+            raise
+        except Exception as e:
+            logger.error(f"Match analysis precompute failed for {match_id}: {e}")
+            analysis = None
+
+        if not analysis:
+            self.metrics['failed'] += 1
+            await self.idempotency.release(lock)
+            if match_id not in self._pending_stages:
+                self._recipients.pop(match_id, None)
+            return None
+
+        await self._store(match_id, analysis)
+        await self.idempotency.complete(lock)
+
+        duration = time.monotonic() - started
+        self.metrics['precomputed'] += 1
+        self.metrics['last_duration'] = round(duration, 3)
+        logger.info(f"Match analysis for {match_id} ({stage}) precomputed in {duration:.1f}s")
+        return analysis
+
+    async def _store(self, match_id: str, analysis: Dict[str, Any]) -> None:
+        ttl = self.ttl_for(analysis)
+        await self.storage.set_cached_data(match_analysis_key(match_id), analysis, ttl_minutes=ttl)
+        self._store_local(match_id, analysis)
+        await self._point_users(match_id)
+
+    async def _point_users(self, match_id: str) -> None:
+        for user_id in self._recipients.pop(match_id, set()):
+            await self.set_user_match(user_id, match_id)
+
+    def _store_local(self, match_id: str, analysis: Dict[str, Any]) -> None:
+        # Коротко: пересчет на другой реплике должен быть виден быстро
+        self._local[match_id] = (time.monotonic() + self.fresh_seconds, analysis)
+        self._local.move_to_end(match_id)
+        while len(self._local) > self.max_local_entries:
+            self._local.popitem(last=False)
@@ -0,0 +1,340 @@
+"""
+Мониторинг новых матчей подписчиков
+
+Проход (sweep) делит пользователей с включенными уведомлениями на шарды
+и проверяет каждый шард с ограниченным параллелизмом. После каждого шарда
+позиция сохраняется в Redis, поэтому после перезапуска проход продолжается
+с места остановки. Следующий проход планируется от начала предыдущего:
+если проход не уложился в интервал, следующий начинается сразу.
+
+С PollScheduler вместо полных проходов опрашиваются только игроки, чье
+время подошло по адаптивному расписанию; список подписчиков сверяется
+с расписанием раз в interval.
+
+Пачка пользователей обрабатывается в три этапа: сначала у всех собираются
+ID новых матчей, затем каждый уникальный матч загружается один раз, и
+только после этого рассылаются уведомления. Игроки одного премейда
+получают уведомления по одной загрузке матча. Матч, уже обработанный
+webhook'ом (ключ IdempotencyStore), не загружается вовсе.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bot.services.idempotency import IdempotencyStore, finished_match_key
+from bot.services.poll_scheduler import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+CURSOR_KEY = "match_monitor:cursor"
+
+
+class MatchMonitor:
+    """Периодическая проверка новых матчей пользователей"""
+
+    def __init__(self, storage, check_user: Callable[[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]],
+                 fetch_match: Optional[Callable[[str], Awaitable[Any]]] = None,
+                 notify_user: Optional[Callable[[Dict[str, Any], str, Any], Awaitable[None]]] = None,
+                 match_recipients: Optional[Callable[[str, Any], Awaitable[List[Dict[str, Any]]]]] = None,
+                 interval: int = 300, concurrency: int = 10, shard_size: int = 100,
+                 scheduler: Optional[PollScheduler] = None,
+                 idempotency: Optional[IdempotencyStore] = None):
+        """
+        check_user(user) возвращает результат проверки с new_match_ids;
+        fetch_match(match_id) загружает матч (None - пропустить);
+        notify_user(user, match_id, match) отправляет уведомление;
+        match_recipients(match_id, match) - остальные подписчики из состава
+        матча: матч, занятый по ключу идемпотентности, больше никто не
+        обработает, поэтому уведомить нужно всех его участников.
+        """
+        self.storage = storage
+        self.check_user = check_user
+        self.fetch_match = fetch_match
+        self.notify_user = notify_user
+        self.match_recipients = match_recipients
+        self.scheduler = scheduler
+        self.idempotency = idempotency
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.shard_size = max(1, shard_size)
+
+        self.metrics = {
+            'sweeps': 0,
+            'overruns': 0,
+            'errors': 0,
+            'last_sweep_started_at': None,
+            'last_sweep_duration': 0.0,
+            'last_sweep_users': 0,
+            'users_per_second': 0.0,
+            'backlog': 0,
+            'polls': 0,
+            'new_match_pairs': 0,
+            'match_fetches': 0,
+            'dedup_ratio': 0.0,
+            'already_processed_matches': 0,
+        }
+
+    async def run(self) -> None:
+        """Бесконечный цикл проходов"""
+        logger.info(
+            f"🔍 Мониторинг матчей: интервал {self.interval}s, "
+            f"параллельно {self.concurrency}, шард {self.shard_size}"
+            f"{', адаптивное расписание' if self.scheduler else ''}"
+        )
+
+        if self.scheduler:
+            await self._run_scheduled()
+            return
+
+        while True:
+            started = time.monotonic()
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in match monitoring sweep: {e}")
+
+            elapsed = time.monotonic() - started
+            if elapsed >= self.interval:
+                self.metrics['overruns'] += 1
+                logger.warning(f"⚠️ Match monitoring sweep took {elapsed:.1f}s (interval {self.interval}s)")
+
+            await asyncio.sleep(max(0.0, self.interval - elapsed))
+
+    async def sweep(self) -> None:
+        """Один проход по всем подписчикам"""
+        started = time.monotonic()
+        self.metrics['last_sweep_started_at'] = time.time()
+
+        users = await self.storage.get_users_with_notifications()
+        users = self.order_users(users, await self._load_cursor())
+        if not users:
+            logger.debug("No users with notifications enabled")
+            return
+
+        self.metrics['backlog'] = len(users)
+        for index in range(0, len(users), self.shard_size):
+            shard = users[index:index + self.shard_size]
+            await self.check_users(shard)
+
+            self.metrics['backlog'] = len(users) - index - len(shard)
+            await self._save_cursor(shard[-1]['user_id'])
+
+        # Проход завершен - следующий начнется с начала списка
+        await self._save_cursor(None)
+
+        duration = time.monotonic() - started
+        self.metrics['sweeps'] += 1
+        self.metrics['last_sweep_duration'] = round(duration, 3)
+        self.metrics['last_sweep_users'] = len(users)
+        self.metrics['users_per_second'] = round(len(users) / duration, 2) if duration > 0 else 0.0
+
+        logger.info(
+            f"Match monitoring sweep: {len(users)} users in {duration:.1f}s "
+            f"({self.metrics['users_per_second']} users/s)"
+        )
+
+    async def check_users(self, users: List[Dict[str, Any]]) -> None:
+        """Проверить пользователей и разослать уведомления о новых матчах"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        users = await self._with_watermarks(users)
+        results = await asyncio.gather(*(bounded(self._check(user)) for user in users))
+
+        if self.fetch_match and self.notify_user:
+            await self._deliver(users, results, bounded)
+
+        if self.scheduler:
+            for user, result in zip(users, results):
+                try:
+                    await self.scheduler.reschedule(user['user_id'], result)
+                except Exception as e:
+                    logger.warning(f"Failed to reschedule user {user.get('user_id')}: {e}")
+
+    async def _with_watermarks(self, users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Подставить отметки последних матчей всей пачки (один HMGET)"""
+        try:
+            watermarks = await self.storage.get_match_watermarks([user['faceit_id'] for user in users])
+        except Exception as e:
+            logger.warning(f"Failed to load match watermarks: {e}")
+            return users
+        return [{**user, 'watermark': watermarks.get(user['faceit_id'])} for user in users]
+
+    async def _check(self, user: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        self.metrics['polls'] += 1
+        try:
+            return await self.check_user(user)
+        except Exception as e:
+            self.metrics['errors'] += 1
+            logger.error(f"Error checking matches for user {user.get('user_id')}: {e}")
+            return None
+
+    async def _deliver(self, users: List[Dict[str, Any]], results: List[Optional[Dict[str, Any]]],
+                       bounded: Callable) -> None:
+        """Загрузить каждый новый матч один раз и разослать уведомления"""
+        pairs = [
+            (user, match_id)
+            for user, result in zip(users, results) if result
+            for match_id in result.get('new_match_ids', [])
+        ]
+        if not pairs:
+            return
+
+        match_ids = list(dict.fromkeys(match_id for _, match_id in pairs))
+
+        if self.idempotency:
+            # Матчи, которые уже обработал webhook или другая реплика, пропускаем до загрузки
+            claimed = await asyncio.gather(*(
+                self.idempotency.begin(finished_match_key(match_id)) for match_id in match_ids
+            ))
+            self.metrics['already_processed_matches'] += claimed.count(False)
+            match_ids = [match_id for match_id, ok in zip(match_ids, claimed) if ok]
+            pairs = [(user, match_id) for user, match_id in pairs if match_id in match_ids]
+            if not pairs:
+                return
+
+        async def fetch(match_id: str) -> Any:
+            try:
+                return await self.fetch_match(match_id)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f"Error fetching match {match_id}: {e}")
+                return None
+
+        matches = dict(zip(match_ids, await asyncio.gather(*(bounded(fetch(m)) for m in match_ids))))
+
+        if self.match_recipients:
+            pairs = await self._add_match_recipients(pairs, matches)
+
+        failed_matches = set()
+
+        async def notify(user: Dict[str, Any], match_id: str) -> None:
+            try:
+                await self.notify_user(user, match_id, matches[match_id])
+            except Exception as e:
+                self.metrics['errors'] += 1
+                failed_matches.add(match_id)
+                logger.error(f"Error notifying user {user.get('user_id')} about {match_id}: {e}")
+
+        async def notify_match(match_id: str, match_users: List[Dict[str, Any]]) -> None:
+            # Получатели одного матча сохраняют его в историю - по очереди,
+            # параллельно идут только разные матчи
+            for user in match_users:
+                await bounded(notify(user, match_id))
+
+        by_match: Dict[str, List[Dict[str, Any]]] = {}
+        for user, match_id in pairs:
+            if matches[match_id]:
+                by_match.setdefault(match_id, []).append(user)
+        await asyncio.gather(*(notify_match(match_id, match_users) for match_id, match_users in by_match.items()))
+
+        if self.idempotency:
+            # Незагруженный матч и матч, уведомление о котором кому-то не
+            # ушло, освобождаем - следующий опрос вернет его пользователям,
+            # чья отметка не сдвинулась
+            await asyncio.gather(*(
+                self.idempotency.complete(finished_match_key(match_id))
+                if matches[match_id] and match_id not in failed_matches
+                else self.idempotency.release(finished_match_key(match_id))
+                for match_id in match_ids
+            ))
+
+        self.metrics['new_match_pairs'] += len(pairs)
+        self.metrics['match_fetches'] += len(match_ids)
+        self.metrics['dedup_ratio'] = round(
+            1 - self.metrics['match_fetches'] / self.metrics['new_match_pairs'], 4
+        )
+        if len(match_ids) < len(pairs):
+            logger.info(f"Shared matches: {len(pairs)} notifications from {len(match_ids)} match fetches")
+
+    async def _add_match_recipients(self, pairs: List[tuple], matches: Dict[str, Any]) -> List[tuple]:
+        """Добавить подписчиков из состава матча, не попавших в пачку"""
+        paired = {(user['user_id'], match_id) for user, match_id in pairs}
+        pairs = list(pairs)
+
+        for match_id, match in matches.items():
+            if not match:
+                continue
+            try:
+                recipients = await self.match_recipients(match_id, match)
+            except Exception as e:
+                logger.warning(f"Failed to find recipients for match {match_id}: {e}")
+                continue
+
+            for user in recipients:
+                if (user['user_id'], match_id) not in paired:
+                    paired.add((user['user_id'], match_id))
+                    pairs.append((user, match_id))
+
+        return pairs
+
+    async def _run_scheduled(self) -> None:
+        """Опрос по адаптивному расписанию"""
+        users: Dict[int, Dict[str, Any]] = {}
+        synced_at = None
+
+        while True:
+            try:
+                if synced_at is None or time.monotonic() - synced_at >= self.interval:
+                    subscribers = self.order_users(await self.storage.get_users_with_notifications(), None)
+                    users = {user['user_id']: user for user in subscribers}
+                    await self.scheduler.sync(users)
+                    synced_at = time.monotonic()
+
+                due = await self.scheduler.claim_due(self.shard_size)
+                batch = [users[user_id] for user_id in due if user_id in users]
+                if not batch:
+                    await asyncio.sleep(1)
+                    continue
+
+                await self.check_users(batch)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in scheduled match monitoring: {e}")
+                await asyncio.sleep(5)
+
+    @staticmethod
+    def order_users(users: List[Dict[str, Any]], cursor: Optional[int]) -> List[Dict[str, Any]]:
+        """Упорядочить по user_id, начиная сразу после курсора"""
+        users = sorted((u for u in users if u.get('faceit_id')), key=lambda u: u['user_id'])
+        if cursor is None:
+            return users
+        return [u for u in users if u['user_id'] > cursor] + [u for u in users if u['user_id'] <= cursor]
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Метрики мониторинга"""
+        stats = dict(self.metrics)
+        if self.scheduler:
+            stats.update(await self.scheduler.get_stats())
+            stats['backlog'] = stats.get('due_players', 0)
+        return stats
+
+    async def _load_cursor(self) -> Optional[int]:
+        if not self.storage.redis:
+            return None
+        try:
+            cursor = await self.storage.redis.get(CURSOR_KEY)
+            return int(cursor) if cursor else None
+        except Exception as e:
+            logger.warning(f"Failed to load match monitor cursor: {e}")
+            return None
+
+    async def _save_cursor(self, user_id: Optional[int]) -> None:
+        if not self.storage.redis:
+            return
+        try:
+            if user_id is None:
+                await self.storage.redis.delete(CURSOR_KEY)
+            else:
+                await self.storage.redis.set(CURSOR_KEY, user_id)
+        except Exception as e:
+            logger.warning(f"Failed to save match monitor cursor: {e}")
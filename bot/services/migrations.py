@@ -0,0 +1,181 @@
+"""
+Версионированные миграции схемы PostgreSQL
+
+Файлы migrations/NNN_name.sql применяются по возрастанию номера, каждый
+ровно один раз и в отдельной транзакции. Примененные версии хранятся в
+таблице schema_version, поэтому на обычном старте достаточно одного
+SELECT вместо повторного выполнения DDL.
+
+Запуск вручную (например, на шаге деплоя):
+    python -m bot.services.migrations status
+    python -m bot.services.migrations migrate
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "migrations"
+)
+
+MIGRATION_FILE_PATTERN = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+
+# Ключ advisory lock, чтобы несколько реплик не применяли миграции одновременно
+MIGRATION_LOCK_ID = 727_001
+
+
+@dataclass
+class Migration:
+    """Файл миграции"""
+    version: int
+    name: str
+    path: str
+    checksum: str
+
+    def read_sql(self) -> str:
+        with open(self.path, encoding="utf-8") as f:
+            return f.read()
+
+
+class MigrationRunner:
+    """Применение миграций из каталога migrations/"""
+
+    def __init__(self, connection: asyncpg.Connection, migrations_dir: str = MIGRATIONS_DIR):
+        self.connection = connection
+        self.migrations_dir = migrations_dir
+
+    def discover(self) -> List[Migration]:
+        """Найти файлы миграций, отсортированные по версии"""
+        migrations = []
+        for filename in os.listdir(self.migrations_dir):
+            match = MIGRATION_FILE_PATTERN.match(filename)
+            if not match:
+                continue
+
+            path = os.path.join(self.migrations_dir, filename)
+            with open(path, "rb") as f:
+                checksum = hashlib.sha256(f.read()).hexdigest()
+
+            migrations.append(Migration(int(match.group(1)), match.group(2), path, checksum))
+
+        migrations.sort(key=lambda m: m.version)
+
+        versions = [m.version for m in migrations]
+        if len(versions) != len(set(versions)):
+            raise ValueError(f"Duplicate migration versions in {self.migrations_dir}")
+
+        return migrations
+
+    async def ensure_version_table(self) -> None:
+        """Создать таблицу учета версий схемы"""
+        await self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+            )
+        """)
+
+    async def applied_versions(self) -> Dict[int, str]:
+        """Примененные версии и их контрольные суммы"""
+        exists = await self.connection.fetchval("SELECT to_regclass('schema_version') IS NOT NULL")
+        if not exists:
+            return {}
+
+        rows = await self.connection.fetch("SELECT version, checksum FROM schema_version")
+        return {row['version']: row['checksum'] for row in rows}
+
+    async def current_version(self) -> int:
+        """Последняя примененная версия схемы (0 - пустая база)"""
+        applied = await self.applied_versions()
+        return max(applied) if applied else 0
+
+    async def pending(self) -> List[Migration]:
+        """Миграции, которые еще не применены"""
+        applied = await self.applied_versions()
+        migrations = self.discover()
+
+        for migration in migrations:
+            checksum = applied.get(migration.version)
+            if checksum and checksum != migration.checksum:
+                logger.warning(
+                    f"⚠️ Migration {migration.version}_{migration.name} was changed after it was applied"
+                )
+
+        return [m for m in migrations if m.version not in applied]
+
+    async def migrate(self, target: Optional[int] = None) -> List[Migration]:
+        """Применить все неприменённые миграции (до target включительно)"""
+        await self.ensure_version_table()
+
+        # Блокировка на время применения: вторая реплика дождется первой
+        # и увидит уже обновленную schema_version
+        await self.connection.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            applied = []
+            for migration in await self.pending():
+                if target is not None and migration.version > target:
+                    break
+
+                logger.info(f"🔄 Applying migration {migration.version}_{migration.name}")
+                async with self.connection.transaction():
+                    await self.connection.execute(migration.read_sql())
+                    await self.connection.execute(
+                        "INSERT INTO schema_version (version, name, checksum) VALUES ($1, $2, $3)",
+                        migration.version, migration.name, migration.checksum
+                    )
+                applied.append(migration)
+
+            if applied:
+                logger.info(f"✅ Applied {len(applied)} migrations, schema version {applied[-1].version}")
+            return applied
+
+        finally:
+            await self.connection.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def _main(command: str) -> int:
+    """CLI: status | migrate"""
+    from config import settings
+
+    if not settings.database_url:
+        print("DATABASE_URL is not configured")
+        return 1
+
+    connection = await asyncpg.connect(settings.database_url)
+    try:
+        runner = MigrationRunner(connection)
+
+        if command == "status":
+            print(f"Current schema version: {await runner.current_version()}")
+            for migration in await runner.pending():
+                print(f"  pending: {migration.version:03d}_{migration.name}")
+            return 0
+
+        if command == "migrate":
+            applied = await runner.migrate()
+            print(f"Applied {len(applied)} migrations, schema version {await runner.current_version()}")
+            return 0
+
+        print(f"Unknown command: {command}")
+        return 1
+
+    finally:
+        await connection.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "migrate")))
@@ -0,0 +1,192 @@
+"""
+Адаптивное расписание опроса игроков на новые матчи
+
+Время следующего опроса каждого подписчика хранится в Redis (ZSET
+poll:schedule, score - unix-время). Интервал зависит от активности:
+- идет матч (webhook о старте) - опрос через live_interval;
+- последний матч меньше SESSION_WINDOW назад - active_interval;
+- иначе base_interval, удваивающийся после каждого пустого опроса
+  до max_interval.
+
+Выборка готовых к опросу игроков и расход общего бюджета опросов/сек
+выполняются одним Lua-скриптом, поэтому бюджет и очередь общие для всех
+реплик, а один игрок не опрашивается двумя репликами одновременно.
+"""
+
+import logging
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_KEY = "poll:schedule"
+STATE_KEY = "poll:state"
+BUDGET_KEY = "poll:budget"
+
+# Матч, сыгранный в этом окне, считается частью текущей игровой сессии
+SESSION_WINDOW = 3 * 3600
+# Сколько ждать первого опроса после старта матча и сколько считать его идущим
+LIVE_FIRST_POLL = 20 * 60
+LIVE_WINDOW = 90 * 60
+# Взятый в работу игрок возвращается в очередь, если реплика не отчиталась
+CLAIM_LEASE = 600
+MAX_IDLE_POLLS = 16
+
+# KEYS[1] - расписание, KEYS[2] - корзина токенов
+# ARGV: now, limit, lease, rate (токенов/сек), burst
+CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[4])
+local burst = tonumber(ARGV[5])
+local tokens = tonumber(redis.call('HGET', KEYS[2], 'tokens') or burst)
+local ts = tonumber(redis.call('HGET', KEYS[2], 'ts') or now)
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local count = math.min(tonumber(ARGV[2]), math.floor(tokens))
+local due = {}
+if count > 0 then
+    due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, count)
+    for _, member in ipairs(due) do
+        redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), member)
+    end
+    tokens = tokens - #due
+end
+
+redis.call('HSET', KEYS[2], 'tokens', tostring(tokens), 'ts', tostring(now))
+return due
+"""
+
+
+class PollScheduler:
+    """Очередь опросов с приоритетом по времени и общим бюджетом"""
+
+    def __init__(self, storage, polls_per_second: float = 2.0, live_interval: int = 60,
+                 active_interval: int = 120, base_interval: int = 300, max_interval: int = 21600):
+        self.storage = storage
+        self.polls_per_second = polls_per_second
+        self.live_interval = live_interval
+        self.active_interval = active_interval
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+
+        self._claim_script = None
+
+    @property
+    def burst(self) -> int:
+        """Запас токенов: не больше 10 секунд бюджета"""
+        return max(1, int(self.polls_per_second * 10))
+
+    def next_delay(self, state: Dict[str, float], now: float) -> float:
+        """Через сколько секунд опросить игрока"""
+        if state.get('live_until', 0) > now:
+            return self.live_interval
+
+        last_match_at = state.get('last_match_at', 0)
+        if last_match_at and now - last_match_at < SESSION_WINDOW:
+            return self.active_interval
+
+        idle_polls = int(state.get('idle_polls', 0))
+        return min(self.max_interval, self.base_interval * 2 ** idle_polls)
+
+    async def sync(self, user_ids: Iterable[int]) -> None:
+        """Привести расписание к текущему списку подписчиков"""
+        redis = self.storage.redis
+        user_ids = {str(user_id) for user_id in user_ids}
+        scheduled = set(await redis.zrange(SCHEDULE_KEY, 0, -1))
+
+        now = time.time()
+        added = user_ids - scheduled
+        removed = scheduled - user_ids
+
+        async with redis.pipeline(transaction=False) as pipe:
+            if added:
+                # Новых игроков разносим по интервалу, чтобы не опросить всех разом
+                pipe.zadd(SCHEDULE_KEY, {
+                    user_id: now + random.uniform(0, self.active_interval) for user_id in added
+                }, nx=True)
+            if removed:
+                pipe.zrem(SCHEDULE_KEY, *removed)
+                pipe.hdel(STATE_KEY, *removed)
+            await pipe.execute()
+
+        if added or removed:
+            logger.info(f"Poll schedule synced: +{len(added)} / -{len(removed)}, total {len(user_ids)}")
+
+    async def claim_due(self, limit: int) -> List[int]:
+        """Забрать игроков, которых пора опросить, в пределах бюджета"""
+        if self._claim_script is None:
+            self._claim_script = self.storage.redis.register_script(CLAIM_SCRIPT)
+
+        due = await self._claim_script(
+            keys=[SCHEDULE_KEY, BUDGET_KEY],
+            args=[time.time(), limit, CLAIM_LEASE, self.polls_per_second, self.burst]
+        )
+        return [int(user_id) for user_id in due]
+
+    async def get_state(self, user_id: int) -> Dict[str, float]:
+        raw = await self.storage.redis.hget(STATE_KEY, user_id)
+        if not raw:
+            return {}
+        live_until, last_match_at, idle_polls = (float(v) for v in raw.split(':'))
+        return {'live_until': live_until, 'last_match_at': last_match_at, 'idle_polls': idle_polls}
+
+    async def reschedule(self, user_id: int, result: Optional[Dict[str, Any]]) -> float:
+        """Запланировать следующий опрос по результату проверки
+
+        result - то, что вернула проверка игрока: last_finished_at (unix-время
+        последнего матча в истории) и new_matches (сколько новых найдено).
+        """
+        now = time.time()
+        state = await self.get_state(user_id)
+        result = result or {}
+
+        last_finished_at = result.get('last_finished_at') or 0
+        state['last_match_at'] = max(state.get('last_match_at', 0), last_finished_at)
+
+        if result.get('new_matches'):
+            # Матч закончился - игрок снова "активен", ожидание живого матча снято
+            state['idle_polls'] = 0
+            state['live_until'] = 0
+        else:
+            state['idle_polls'] = min(MAX_IDLE_POLLS, state.get('idle_polls', 0) + 1)
+
+        delay = self.next_delay(state, now)
+        delay *= random.uniform(0.9, 1.1)
+
+        await self._save(user_id, state, now + delay)
+        return delay
+
+    async def mark_live(self, user_id: int) -> None:
+        """Игрок начал матч: опрашивать часто, начиная с ожидаемого конца"""
+        now = time.time()
+        state = await self.get_state(user_id)
+        state['live_until'] = now + LIVE_WINDOW
+        state['idle_polls'] = 0
+        await self._save(user_id, state, now + LIVE_FIRST_POLL)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Размер расписания и отставание"""
+        redis = self.storage.redis
+        now = time.time()
+        try:
+            scheduled = await redis.zcard(SCHEDULE_KEY)
+            due = await redis.zcount(SCHEDULE_KEY, '-inf', now)
+            oldest = await redis.zrangebyscore(SCHEDULE_KEY, '-inf', now, start=0, num=1, withscores=True)
+            return {
+                'scheduled_players': scheduled,
+                'due_players': due,
+                'max_poll_delay': round(now - oldest[0][1], 1) if oldest else 0.0,
+                'polls_per_second_budget': self.polls_per_second,
+            }
+        except Exception as e:
+            logger.warning(f"Failed to get poll scheduler stats: {e}")
+            return {}
+
+    async def _save(self, user_id: int, state: Dict[str, float], next_poll_at: float) -> None:
+        value = f"{state.get('live_until', 0):.0f}:{state.get('last_match_at', 0):.0f}:{int(state.get('idle_polls', 0))}"
+        async with self.storage.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(STATE_KEY, user_id, value)
+            # xx: отписавшийся за время проверки игрок не возвращается в расписание
+            pipe.zadd(SCHEDULE_KEY, {str(user_id): next_poll_at}, xx=True)
+            await pipe.execute()
@@ -0,0 +1,44 @@
+"""
+Роли процесса
+
+Один и тот же код запускается с разным набором ролей (ROLES или аргумент
+`python main.py <роли>`), все процессы делят Redis и PostgreSQL:
+- bot - Telegram polling и обработчики;
+- api - HTTP API FastAPI и прием webhook FACEIT (события пишутся в поток);
+- monitor - мониторинг матчей, разбор потока webhook и очистка хранилища;
+- workers - пулы воркеров и перенос отложенных повторов задач.
+
+all - все роли в одном процессе (небольшие установки). Каждую роль можно
+запускать отдельными репликами на своих ядрах и узлах. Разделение ролей
+требует общей очереди задач (WORKER_QUEUE_BACKEND=redis): очередь в
+памяти процесса не видна воркерам других процессов.
+"""
+
+from typing import Set
+
+ROLES = ('bot', 'api', 'monitor', 'workers')
+
+# Роли, отправляющие сообщения в Telegram (им нужна очередь отправки)
+SENDING_ROLES = {'bot', 'monitor'}
+
+
+def parse_roles(value: str, queue_backend: str = "redis") -> Set[str]:
+    """Роли из строки: 'all' или имена через запятую
+
+    ValueError - неизвестная роль или часть ролей при очереди задач в памяти.
+    """
+    names = {name.strip().lower() for name in (value or '').split(',') if name.strip()}
+    if not names or 'all' in names:
+        return set(ROLES)
+
+    unknown = names - set(ROLES)
+    if unknown:
+        raise ValueError(
+            f"Unknown roles: {', '.join(sorted(unknown))} (expected {', '.join(ROLES)} or all)"
+        )
+    if queue_backend == "memory" and names != set(ROLES):
+        raise ValueError(
+            f"Roles {', '.join(sorted(names))} need a shared task queue: "
+            f"set WORKER_QUEUE_BACKEND=redis or run all roles in one process"
+        )
+    return names
@@ -0,0 +1,747 @@
+"""
+Хранилища очередей задач воркеров
+
+WorkerQueue работает с любым из двух бэкендов с одинаковым интерфейсом:
+- RedisStreamTaskQueue - поток worker:{queue} и группа потребителей
+  workers: задачи переживают перезапуск и делятся между репликами;
+- MemoryTaskQueue - asyncio.Queue в памяти процесса (тесты, один процесс).
+
+Семантика у обоих одна: put при переполнении очереди бросает
+asyncio.QueueFull, полученная задача невидима для других воркеров
+visibility_timeout секунд. Подтвержденная (ack) задача удаляется, а не
+подтвержденная за это время забирается повторно через claim_stale с
+увеличенным счетчиком доставок.
+
+Задачи с каноническим ключом (put_unique) склеиваются: пока задача с тем
+же ключом ждет или выполняется, новая не ставится - запросивший
+добавляется к получателям первой. finish снимает отметку, отдает
+получателей и сохраняет результат на result_ttl секунд (get_result).
+
+Итог задачи (результат или ошибка) публикуется через publish_outcome:
+в Redis - сообщением в канал worker:done:{task_id} и ключом
+worker:outcome:{task_id} (для ждущих, подписавшихся позже). Ждущий
+обработчик получает его через TaskHandle.result(timeout).
+
+Упавшая задача подтверждается и через retry_later откладывается на delay
+секунд (в Redis - в отсортированное множество worker:delayed:{queue}),
+promote_due возвращает наступившие задачи в очередь с тем же task_id и
+счетчиком попыток. Задача, исчерпавшая попытки, уходит через quarantine
+в dead-letter (поток worker:dead:{queue}).
+
+Задачи ставятся в одну из полос приоритета (PRIORITIES): воркер берет
+задачи высокой полосы раньше обычной, обычной - раньше низкой. В Redis у
+каждой полосы свой поток (обычная - worker:{queue}, остальные -
+worker:{queue}:{priority}) и свое множество отложенных повторов.
+
+acquire_slot/release_slot считают задачи пользователя, выполняющиеся
+сейчас на всех репликах (worker:inflight:{user}); отметка истекает через
+visibility_timeout, так что слоты упавших воркеров освобождаются сами.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from bot.services.webhook_queue import stream_id_age_ms
+
+logger = logging.getLogger(__name__)
+
+GROUP_NAME = "workers"
+
+# KEYS[1] - поток; ARGV: максимальный размер, задача (JSON)
+PUT_SCRIPT = """
+if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+    return false
+end
+return redis.call('XADD', KEYS[1], '*', 'task', ARGV[2])
+"""
+
+# KEYS: поток, отметка задачи в очереди, получатели
+# ARGV: максимальный размер, задача (JSON), ключ задачи, TTL отметки, получатель
+# Возвращает {id, 1} для уже стоящей задачи, {id, 0} для новой, false - очередь полна
+PUT_UNIQUE_SCRIPT = """
+local existing = redis.call('GET', KEYS[2])
+if not existing then
+    if redis.call('XLEN', KEYS[1]) >= tonumber(ARGV[1]) then
+        return false
+    end
+    existing = redis.call('XADD', KEYS[1], '*', 'task', ARGV[2], 'key', ARGV[3])
+    redis.call('SET', KEYS[2], existing, 'EX', ARGV[4])
+    if ARGV[5] ~= '' then
+        redis.call('SADD', KEYS[3], ARGV[5])
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+    end
+    return {existing, 0}
+end
+if ARGV[5] ~= '' then
+    redis.call('SADD', KEYS[3], ARGV[5])
+    redis.call('EXPIRE', KEYS[3], ARGV[4])
+end
+return {existing, 1}
+"""
+
+# KEYS: отметка задачи в очереди, получатели, результат
+# ARGV: id задачи, результат (JSON или пустая строка), TTL результата
+FINISH_SCRIPT = """
+local requesters = {}
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    requesters = redis.call('SMEMBERS', KEYS[2])
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[3], ARGV[2], 'EX', ARGV[3])
+end
+return requesters
+"""
+
+# KEYS: отложенные задачи, поток; ARGV: текущее время, сколько перенести за раз
+# Задача возвращается в поток с исходным task_id и числом сделанных попыток
+PROMOTE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(due) do
+    local entry = cjson.decode(member)
+    redis.call('XADD', KEYS[2], '*', 'task', entry.task, 'key', entry.key,
+               'tid', entry.tid, 'attempts', entry.attempts)
+    redis.call('ZREM', KEYS[1], member)
+end
+return #due
+"""
+
+
+# KEYS[1] - выполняющиеся задачи пользователя (id -> истекает в)
+# ARGV: id задачи, предел, текущее время, время жизни отметки
+# Повторная выдача той же задачи (после падения воркера) слот не расходует
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[3]) + tonumber(ARGV[4]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[4])))
+return 1
+"""
+
+
+# Полосы приоритета в порядке выдачи воркерам
+PRIORITIES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+
+
+def stream_key(queue: str, priority: str = DEFAULT_PRIORITY) -> str:
+    if priority == DEFAULT_PRIORITY:
+        return f"worker:{queue}"
+    return f"worker:{queue}:{priority}"
+
+
+def pending_key(key: str) -> str:
+    return f"worker:pending:{key}"
+
+
+def requesters_key(key: str) -> str:
+    return f"worker:requesters:{key}"
+
+
+def result_key(key: str) -> str:
+    return f"worker:result:{key}"
+
+
+def outcome_key(task_id: str) -> str:
+    return f"worker:outcome:{task_id}"
+
+
+def delayed_key(queue: str, priority: str = DEFAULT_PRIORITY) -> str:
+    if priority == DEFAULT_PRIORITY:
+        return f"worker:delayed:{queue}"
+    return f"worker:delayed:{queue}:{priority}"
+
+
+def inflight_key(user: str) -> str:
+    return f"worker:inflight:{user}"
+
+
+def dead_letter_key(queue: str) -> str:
+    return f"worker:dead:{queue}"
+
+
+OUTCOME_CHANNEL_PREFIX = "worker:done:"
+
+
+class TaskFailed(Exception):
+    """Задача завершилась ошибкой после всех попыток"""
+
+
+@dataclass
+class TaskMessage:
+    """Задача, выданная воркеру"""
+    id: str
+    queue: str
+    task: Dict[str, Any]
+    # Сколько раз задача выдавалась воркерам (включая текущую выдачу)
+    attempts: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+    # Канонический ключ склеиваемой задачи
+    key: Optional[str] = None
+    # Логический id задачи: не меняется при повторной постановке после ошибки
+    task_id: Optional[str] = None
+    priority: str = DEFAULT_PRIORITY
+
+    def __post_init__(self):
+        if self.task_id is None:
+            self.task_id = self.id
+
+
+class TaskHandle:
+    """Поставленная задача, результат которой можно дождаться"""
+
+    def __init__(self, backend, task_id: Optional[str], status: str, value: Any = None):
+        self.backend = backend
+        self.task_id = task_id
+        # queued - новая задача, coalesced - присоединена к ждущей,
+        # done - недавний результат возвращен без выполнения
+        self.status = status
+        self._value = value
+
+    async def result(self, timeout: float) -> Any:
+        """Дождаться результата; asyncio.TimeoutError - не успели, TaskFailed - задача упала"""
+        if self.status == 'done':
+            return self._value
+        outcome = await self.backend.wait_outcome(self.task_id, timeout)
+        if not outcome.get('ok'):
+            raise TaskFailed(outcome.get('error') or "task failed")
+        return outcome.get('result')
+
+
+class MemoryTaskQueue:
+    """Очереди задач в памяти процесса"""
+
+    def __init__(self, max_size: int = 1000, visibility_timeout: float = 300, dead_letter_max: int = 1000):
+        self.max_size = max_size
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter_max = dead_letter_max
+        # queue -> (полоса приоритета, порядок постановки, задача)
+        self._queues: Dict[str, asyncio.PriorityQueue] = {}
+        self._order = itertools.count()
+        # queue -> id -> (видима снова в, задача)
+        self._in_flight: Dict[str, Dict[str, Tuple[float, TaskMessage]]] = {}
+        # queue -> [(вернуть в очередь в, задача)] и задачи в карантине
+        self._delayed: Dict[str, List[Tuple[float, TaskMessage]]] = {}
+        self._dead: Dict[str, Deque[Dict[str, Any]]] = {}
+        # ключ -> id ждущей задачи и ее получатели
+        self._pending: Dict[str, str] = {}
+        self._requesters: Dict[str, Set[str]] = {}
+        # ключ -> (истекает в, результат)
+        self._results: Dict[str, Tuple[float, Any]] = {}
+        # task_id -> (истекает в, итог) и ждущие итога
+        self._outcomes: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        # пользователь -> id выполняющейся задачи -> отметка истекает в
+        self._slots: Dict[str, Dict[str, float]] = {}
+
+    def _queue(self, queue: str) -> asyncio.PriorityQueue:
+        if queue not in self._queues:
+            self._queues[queue] = asyncio.PriorityQueue(maxsize=self.max_size)
+            self._in_flight[queue] = {}
+            self._delayed[queue] = []
+            self._dead[queue] = deque(maxlen=self.dead_letter_max)
+        return self._queues[queue]
+
+    def _enqueue(self, message: TaskMessage) -> None:
+        self._queue(message.queue).put_nowait((PRIORITIES.index(message.priority), next(self._order), message))
+
+    async def put(self, queue: str, task: Dict[str, Any], priority: str = DEFAULT_PRIORITY) -> str:
+        message = TaskMessage(id=uuid.uuid4().hex, queue=queue, task=task, priority=priority)
+        self._enqueue(message)
+        return message.id
+
+    async def put_unique(self, queue: str, task: Dict[str, Any], key: str, requester: Optional[str] = None,
+                         priority: str = DEFAULT_PRIORITY) -> Tuple[str, bool]:
+        """Поставить задачу или присоединиться к ждущей с тем же ключом; (id, склеена)"""
+        existing = self._pending.get(key)
+        coalesced = existing is not None
+        if not coalesced:
+            message = TaskMessage(id=uuid.uuid4().hex, queue=queue, task=task, key=key, priority=priority)
+            self._enqueue(message)
+            existing = self._pending[key] = message.id
+        if requester:
+            self._requesters.setdefault(key, set()).add(requester)
+        return existing, coalesced
+
+    async def get_result(self, key: str) -> Any:
+        entry = self._results.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        self._results.pop(key, None)
+        return None
+
+    async def finish(self, message: TaskMessage, result: Any = None, result_ttl: float = 0) -> List[str]:
+        """Снять отметку склеиваемой задачи и сохранить результат; получатели задачи"""
+        requesters: Set[str] = set()
+        if self._pending.get(message.key) == message.task_id:
+            del self._pending[message.key]
+            requesters = self._requesters.pop(message.key, set())
+        if result is not None and result_ttl > 0:
+            self._results[message.key] = (time.monotonic() + result_ttl, result)
+        return sorted(requesters)
+
+    async def publish_outcome(self, task_id: str, outcome: Dict[str, Any], ttl: float) -> None:
+        now = time.monotonic()
+        self._outcomes = {tid: entry for tid, entry in self._outcomes.items() if entry[0] > now}
+        self._outcomes[task_id] = (now + ttl, outcome)
+        for future in self._waiters.pop(task_id, set()):
+            if not future.done():
+                future.set_result(outcome)
+
+    async def wait_outcome(self, task_id: str, timeout: float) -> Dict[str, Any]:
+        entry = self._outcomes.get(task_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(task_id, set()).add(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self._waiters[task_id]
+
+    async def close(self) -> None:
+        for waiters in self._waiters.values():
+            for future in waiters:
+                future.cancel()
+        self._waiters.clear()
+
+    async def get(self, queue: str, consumer: str, timeout: float) -> Optional[TaskMessage]:
+        batch = await self.get_batch(queue, consumer, 1, timeout)
+        return batch[0] if batch else None
+
+    async def get_batch(self, queue: str, consumer: str, count: int, timeout: float) -> List[TaskMessage]:
+        """До count задач по приоритету: ждет первую, остальные - только уже стоящие в очереди"""
+        pending = self._queue(queue)
+        try:
+            messages = [(await asyncio.wait_for(pending.get(), timeout=timeout))[-1]]
+        except asyncio.TimeoutError:
+            return []
+        while len(messages) < count and not pending.empty():
+            messages.append(pending.get_nowait()[-1])
+
+        visible_at = time.monotonic() + self.visibility_timeout
+        for message in messages:
+            message.attempts += 1
+            self._in_flight[queue][message.id] = (visible_at, message)
+        return messages
+
+    async def ack(self, queue: str, message: TaskMessage) -> None:
+        self._in_flight.get(queue, {}).pop(message.id, None)
+
+    async def retry_later(self, queue: str, message: TaskMessage, delay: float) -> None:
+        """Снять задачу с выполнения и вернуть в очередь через delay секунд"""
+        self._queue(queue)
+        self._in_flight[queue].pop(message.id, None)
+        self._delayed[queue].append((time.monotonic() + delay, message))
+
+    async def promote_due(self, queue: str, limit: int = 100) -> int:
+        """Вернуть в очередь отложенные задачи, время которых пришло"""
+        pending = self._queue(queue)
+        now = time.monotonic()
+        promoted = 0
+        for entry in sorted(self._delayed[queue], key=lambda item: item[0]):
+            if entry[0] > now or promoted >= limit or pending.full():
+                break
+            self._enqueue(entry[1])
+            self._delayed[queue].remove(entry)
+            promoted += 1
+        return promoted
+
+    async def quarantine(self, queue: str, message: TaskMessage, error: str) -> None:
+        """Перенести задачу в dead-letter и подтвердить"""
+        self._queue(queue)
+        self._in_flight[queue].pop(message.id, None)
+        self._dead[queue].append({
+            'task': message.task,
+            'key': message.key,
+            'tid': message.task_id,
+            'attempts': message.attempts,
+            'error': error,
+            'failed_at': time.time(),
+        })
+
+    async def acquire_slot(self, user: str, task_id: str, limit: int) -> bool:
+        """Занять слот выполнения пользователя; False - у него уже limit задач в работе"""
+        now = time.monotonic()
+        slots = {tid: expires for tid, expires in self._slots.get(user, {}).items() if expires > now}
+        if task_id not in slots and len(slots) >= limit:
+            self._slots[user] = slots
+            return False
+        slots[task_id] = now + self.visibility_timeout
+        self._slots[user] = slots
+        return True
+
+    async def release_slot(self, user: str, task_id: str) -> None:
+        slots = self._slots.get(user)
+        if slots is not None:
+            slots.pop(task_id, None)
+            if not slots:
+                del self._slots[user]
+
+    async def claim_stale(self, queue: str, consumer: str, count: int = 10) -> List[TaskMessage]:
+        self._queue(queue)
+        now = time.monotonic()
+        claimed = []
+        for message_id, (visible_at, message) in list(self._in_flight[queue].items()):
+            if visible_at > now or len(claimed) >= count:
+                continue
+            message.attempts += 1
+            self._in_flight[queue][message_id] = (now + self.visibility_timeout, message)
+            claimed.append(message)
+        return claimed
+
+    async def get_stats(self, queue: str) -> Dict[str, Any]:
+        waiting = self._queue(queue).qsize()
+        in_flight = self._in_flight[queue]
+        oldest = min((message.enqueued_at for _, message in in_flight.values()), default=None)
+        return {
+            'depth': waiting + len(in_flight),
+            'pending': len(in_flight),
+            'lag': waiting,
+            'oldest_pending_ms': round((time.time() - oldest) * 1000, 1) if oldest else 0.0,
+            'delayed': len(self._delayed[queue]),
+            'dead_letter_size': len(self._dead[queue]),
+        }
+
+
+class RedisStreamTaskQueue:
+    """Очереди задач на Redis Streams с группой потребителей"""
+
+    def __init__(self, storage, max_size: int = 1000, visibility_timeout: float = 300,
+                 dead_letter_max: int = 1000):
+        self.storage = storage
+        self.max_size = max_size
+        self.visibility_timeout = visibility_timeout
+        self.dead_letter_max = dead_letter_max
+        self._groups: set = set()
+        self._put_script = None
+        self._put_unique_script = None
+        self._finish_script = None
+        self._promote_script = None
+        self._acquire_script = None
+        # Один подписчик на итоги задач на процесс: task_id -> ждущие
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._listener_lock = asyncio.Lock()
+
+    @property
+    def _idle_ms(self) -> int:
+        return int(self.visibility_timeout * 1000)
+
+    async def _ensure_group(self, queue: str, priority: str = DEFAULT_PRIORITY) -> None:
+        stream = stream_key(queue, priority)
+        if stream in self._groups:
+            return
+        try:
+            await self.storage.redis.xgroup_create(stream, GROUP_NAME, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._groups.add(stream)
+
+    async def _ensure_groups(self, queue: str) -> None:
+        for priority in PRIORITIES:
+            await self._ensure_group(queue, priority)
+
+    async def put(self, queue: str, task: Dict[str, Any], priority: str = DEFAULT_PRIORITY) -> str:
+        """Добавить задачу; проверка размера полосы и XADD - одним скриптом"""
+        await self._ensure_group(queue, priority)
+        if self._put_script is None:
+            self._put_script = self.storage.redis.register_script(PUT_SCRIPT)
+
+        message_id = await self._put_script(
+            keys=[stream_key(queue, priority)],
+            args=[self.max_size, json.dumps(task, ensure_ascii=False, default=str)]
+        )
+        if not message_id:
+            raise asyncio.QueueFull()
+        return message_id
+
+    async def put_unique(self, queue: str, task: Dict[str, Any], key: str, requester: Optional[str] = None,
+                         priority: str = DEFAULT_PRIORITY) -> Tuple[str, bool]:
+        """Поставить задачу или присоединиться к ждущей с тем же ключом; (id, склеена)"""
+        await self._ensure_group(queue, priority)
+        if self._put_unique_script is None:
+            self._put_unique_script = self.storage.redis.register_script(PUT_UNIQUE_SCRIPT)
+
+        # Отметка живет, пока задача может ждать в очереди и выполняться
+        response = await self._put_unique_script(
+            keys=[stream_key(queue, priority), pending_key(key), requesters_key(key)],
+            args=[self.max_size, json.dumps(task, ensure_ascii=False, default=str), key,
+                  int(self.visibility_timeout * 2), requester or '']
+        )
+        if not response:
+            raise asyncio.QueueFull()
+        message_id, coalesced = response
+        return message_id, bool(int(coalesced))
+
+    async def get_result(self, key: str) -> Any:
+        raw = await self.storage.redis.get(result_key(key))
+        return json.loads(raw) if raw else None
+
+    async def finish(self, message: TaskMessage, result: Any = None, result_ttl: float = 0) -> List[str]:
+        """Снять отметку склеиваемой задачи и сохранить результат; получатели задачи"""
+        if self._finish_script is None:
+            self._finish_script = self.storage.redis.register_script(FINISH_SCRIPT)
+
+        store = result is not None and result_ttl > 0
+        requesters = await self._finish_script(
+            keys=[pending_key(message.key), requesters_key(message.key), result_key(message.key)],
+            args=[message.task_id, json.dumps(result, ensure_ascii=False, default=str) if store else '',
+                  max(1, int(result_ttl))]
+        )
+        return sorted(requesters or [])
+
+    async def publish_outcome(self, task_id: str, outcome: Dict[str, Any], ttl: float) -> None:
+        """Сохранить итог задачи и оповестить ждущих на всех репликах"""
+        payload = json.dumps(outcome, ensure_ascii=False, default=str)
+        async with self.storage.redis.pipeline(transaction=True) as pipe:
+            pipe.set(outcome_key(task_id), payload, ex=max(1, int(ttl)))
+            pipe.publish(OUTCOME_CHANNEL_PREFIX + task_id, payload)
+            await pipe.execute()
+
+    async def wait_outcome(self, task_id: str, timeout: float) -> Dict[str, Any]:
+        """Дождаться итога задачи (asyncio.TimeoutError по истечении timeout)"""
+        await self._ensure_listener()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(task_id, set()).add(future)
+        try:
+            # Подписка уже есть: итог, опубликованный до этой проверки, лежит в ключе
+            raw = await self.storage.redis.get(outcome_key(task_id))
+            if raw:
+                return json.loads(raw)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self._waiters[task_id]
+
+    async def close(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _ensure_listener(self) -> None:
+        async with self._listener_lock:
+            if self._listener and not self._listener.done():
+                return
+            if self._pubsub is not None:
+                await self._pubsub.aclose()
+            self._pubsub = self.storage.redis.pubsub()
+            await self._pubsub.psubscribe(OUTCOME_CHANNEL_PREFIX + '*')
+            self._listener = asyncio.create_task(self._listen(self._pubsub))
+
+    async def _listen(self, pubsub) -> None:
+        try:
+            async for message in pubsub.listen():
+                if message.get('type') != 'pmessage':
+                    continue
+                task_id = message['channel'][len(OUTCOME_CHANNEL_PREFIX):]
+                waiters = self._waiters.pop(task_id, None)
+                if not waiters:
+                    continue
+                outcome = json.loads(message['data'])
+                for future in waiters:
+                    if not future.done():
+                        future.set_result(outcome)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Следующее ожидание переподпишется
+            logger.error(f"Task outcome listener stopped: {e}")
+
+    async def get(self, queue: str, consumer: str, timeout: float) -> Optional[TaskMessage]:
+        batch = await self.get_batch(queue, consumer, 1, timeout)
+        return batch[0] if batch else None
+
+    async def get_batch(self, queue: str, consumer: str, count: int, timeout: float) -> List[TaskMessage]:
+        """До count задач по приоритету
+        
+        Полосы читаются по очереди без ожидания; если все пусты - ждем
+        задачу в любой из них (тогда задач может прийти по одной на полосу).
+        """
+        await self._ensure_groups(queue)
+        redis = self.storage.redis
+        messages: List[TaskMessage] = []
+        for priority in PRIORITIES:
+            if len(messages) >= count:
+                break
+            response = await redis.xreadgroup(
+                GROUP_NAME, consumer, {stream_key(queue, priority): '>'}, count=count - len(messages)
+            )
+            messages.extend(self._messages(queue, response))
+        if messages:
+            return messages
+
+        response = await redis.xreadgroup(
+            GROUP_NAME, consumer, {stream_key(queue, priority): '>' for priority in PRIORITIES},
+            count=1, block=int(timeout * 1000)
+        )
+        messages = self._messages(queue, response)
+        return sorted(messages, key=lambda message: PRIORITIES.index(message.priority))
+
+    def _messages(self, queue: str, response) -> List[TaskMessage]:
+        lanes = {stream_key(queue, priority): priority for priority in PRIORITIES}
+        return [
+            self._message(queue, message_id, fields, attempts=1, priority=lanes[stream])
+            for stream, messages in response or []
+            for message_id, fields in messages
+        ]
+
+    async def ack(self, queue: str, message: TaskMessage) -> None:
+        """Подтвердить и удалить задачу: длина потока - число невыполненных задач"""
+        stream = stream_key(queue, message.priority)
+        async with self.storage.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(stream, GROUP_NAME, message.id)
+            pipe.xdel(stream, message.id)
+            await pipe.execute()
+
+    async def retry_later(self, queue: str, message: TaskMessage, delay: float) -> None:
+        """Подтвердить задачу и отложить ее повтор на delay секунд (одной транзакцией)"""
+        entry = json.dumps({
+            'task': json.dumps(message.task, ensure_ascii=False, default=str),
+            'key': message.key or '',
+            'tid': message.task_id,
+            'attempts': str(message.attempts),
+        }, ensure_ascii=False)
+        stream = stream_key(queue, message.priority)
+        async with self.storage.redis.pipeline(transaction=True) as pipe:
+            pipe.zadd(delayed_key(queue, message.priority), {entry: time.time() + delay})
+            pipe.xack(stream, GROUP_NAME, message.id)
+            pipe.xdel(stream, message.id)
+            await pipe.execute()
+
+    async def promote_due(self, queue: str, limit: int = 100) -> int:
+        """Вернуть в потоки отложенные задачи, время которых пришло"""
+        await self._ensure_groups(queue)
+        if self._promote_script is None:
+            self._promote_script = self.storage.redis.register_script(PROMOTE_SCRIPT)
+        promoted = 0
+        for priority in PRIORITIES:
+            promoted += int(await self._promote_script(
+                keys=[delayed_key(queue, priority), stream_key(queue, priority)],
+                args=[time.time(), limit]
+            ) or 0)
+        return promoted
+
+    async def quarantine(self, queue: str, message: TaskMessage, error: str) -> None:
+        """Перенести задачу в поток dead-letter и подтвердить исходную"""
+        stream = stream_key(queue, message.priority)
+        async with self.storage.redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(dead_letter_key(queue), {
+                'task': json.dumps(message.task, ensure_ascii=False, default=str),
+                'key': message.key or '',
+                'tid': message.task_id,
+                'priority': message.priority,
+                'attempts': message.attempts,
+                'error': error[:500],
+                'failed_at': round(time.time(), 3),
+            }, maxlen=self.dead_letter_max, approximate=True)
+            pipe.xack(stream, GROUP_NAME, message.id)
+            pipe.xdel(stream, message.id)
+            await pipe.execute()
+
+    async def acquire_slot(self, user: str, task_id: str, limit: int) -> bool:
+        """Занять слот выполнения пользователя (общий для реплик); False - слоты заняты"""
+        if self._acquire_script is None:
+            self._acquire_script = self.storage.redis.register_script(ACQUIRE_SCRIPT)
+        acquired = await self._acquire_script(
+            keys=[inflight_key(user)],
+            args=[task_id, limit, time.time(), self.visibility_timeout]
+        )
+        return bool(int(acquired or 0))
+
+    async def release_slot(self, user: str, task_id: str) -> None:
+        await self.storage.redis.zrem(inflight_key(user), task_id)
+
+    async def claim_stale(self, queue: str, consumer: str, count: int = 10) -> List[TaskMessage]:
+        """Забрать задачи, которые воркеры не подтвердили за visibility_timeout"""
+        await self._ensure_groups(queue)
+        messages = []
+        for priority in PRIORITIES:
+            if len(messages) >= count:
+                break
+            messages.extend(await self._claim_lane(queue, priority, consumer, count - len(messages)))
+        return messages
+
+    async def _claim_lane(self, queue: str, priority: str, consumer: str, count: int) -> List[TaskMessage]:
+        redis = self.storage.redis
+        stream = stream_key(queue, priority)
+        pending = await redis.xpending_range(
+            stream, GROUP_NAME, min='-', max='+', count=count, idle=self._idle_ms
+        )
+        if not pending:
+            return []
+
+        deliveries = {entry['message_id']: entry['times_delivered'] for entry in pending}
+        claimed = await redis.xclaim(stream, GROUP_NAME, consumer, self._idle_ms, list(deliveries))
+
+        messages = []
+        for message_id, fields in claimed:
+            if not fields:
+                # Запись уже удалена - подтверждаем, чтобы она не висела в ожидающих
+                await redis.xack(stream, GROUP_NAME, message_id)
+                continue
+            messages.append(self._message(
+                queue, message_id, fields, attempts=deliveries.get(message_id, 0) + 1, priority=priority
+            ))
+        return messages
+
+    async def get_stats(self, queue: str) -> Dict[str, Any]:
+        """Сводка по всем полосам очереди"""
+        redis = self.storage.redis
+        await self._ensure_groups(queue)
+        stats = {'depth': 0, 'pending': 0, 'lag': 0, 'oldest_pending_ms': 0.0, 'delayed': 0, 'by_priority': {}}
+        for priority in PRIORITIES:
+            stream = stream_key(queue, priority)
+            groups = await redis.xinfo_groups(stream)
+            group = next((g for g in groups if g.get('name') == GROUP_NAME), {})
+            oldest = await redis.xpending_range(stream, GROUP_NAME, min='-', max='+', count=1)
+            depth = await redis.xlen(stream)
+            stats['by_priority'][priority] = depth
+            stats['depth'] += depth
+            stats['pending'] += group.get('pending', 0)
+            # Redis < 7 не считает lag группы
+            lag = group.get('lag')
+            stats['lag'] = None if lag is None or stats['lag'] is None else stats['lag'] + lag
+            if oldest:
+                stats['oldest_pending_ms'] = max(stats['oldest_pending_ms'],
+                                                 round(stream_id_age_ms(oldest[0]['message_id']), 1))
+            stats['delayed'] += await redis.zcard(delayed_key(queue, priority))
+        stats['dead_letter_size'] = await redis.xlen(dead_letter_key(queue))
+        return stats
+
+    @staticmethod
+    def _message(queue: str, message_id: str, fields: Dict[str, str], attempts: int,
+                 priority: str = DEFAULT_PRIORITY) -> TaskMessage:
+        # Повтор после ошибки: исходный id задачи и попытки до повторной постановки
+        return TaskMessage(
+            id=message_id,
+            queue=queue,
+            task=json.loads(fields['task']),
+            attempts=int(fields.get('attempts', 0)) + attempts,
+            enqueued_at=time.time() - stream_id_age_ms(message_id) / 1000,
+            key=fields.get('key') or None,
+            task_id=fields.get('tid') or message_id,
+            priority=priority
+        )
@@ -0,0 +1,271 @@
+"""
+Планировщик исходящих сообщений Telegram
+
+Все запросы бота, отправляющие или меняющие сообщения в чате, проходят
+через middleware сессии aiogram и ставятся в общую очередь с приоритетом:
+- общий лимит - корзина токенов global_rate сообщений/сек (~30 у Telegram);
+- в один чат - не чаще раза в per_chat_interval секунд, сообщение для
+  занятого чата откладывается, не задерживая остальные чаты;
+- 429 (TelegramRetryAfter) - чат ставится на паузу на retry_after секунд,
+  запрос повторяется до max_retries раз;
+- ответы пользователю (INTERACTIVE, по умолчанию) обслуживаются раньше
+  уведомлений (NOTIFICATION), которые помечаются через delivery_priority().
+
+Для /api/stats считаются глубина очереди и задержка доставки (от постановки
+в очередь до ответа Telegram) по приоритетам.
+"""
+
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText,
+    ForwardMessage, SendDocument, SendMessage, SendPhoto
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+NOTIFICATION = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NOTIFICATION: 'notification'}
+
+# Методы, на которые распространяются лимиты Telegram на сообщения
+LIMITED_METHODS = (
+    SendMessage, SendPhoto, SendDocument, ForwardMessage, CopyMessage,
+    EditMessageText, EditMessageCaption, EditMessageReplyMarkup
+)
+
+# Сколько чатов помнить до очистки истекших пауз
+MAX_TRACKED_CHATS = 10000
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar('telegram_delivery_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def delivery_priority(priority: int) -> Iterator[None]:
+    """Отправлять сообщения внутри блока с указанным приоритетом"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@dataclass
+class _Delivery:
+    chat_id: Any
+    call: Callable[[], Awaitable[Any]]
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class TelegramSender:
+    """Очередь исходящих сообщений с общим лимитом и лимитом на чат"""
+
+    def __init__(self, global_rate: float = 30.0, per_chat_interval: float = 1.0,
+                 max_retries: int = 3, max_in_flight: int = 30):
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.max_in_flight = max_in_flight
+
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._deferred = 0
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._running = False
+
+        self._tokens = float(max(1.0, global_rate))
+        self._tokens_at = time.monotonic()
+        # chat_id -> когда в чат можно отправлять снова
+        self._chat_ready_at: Dict[Any, float] = {}
+        self._depth: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+
+        self.metrics = {
+            'sent': 0,
+            'failed': 0,
+            'retry_after': 0,
+            'deferred_for_chat': 0,
+            'latency': {
+                name: {'count': 0, 'avg_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0}
+                for name in PRIORITY_NAMES.values()
+            },
+        }
+
+    async def submit(self, chat_id: Any, call: Callable[[], Awaitable[Any]],
+                     priority: Optional[int] = None) -> Any:
+        """Поставить запрос в очередь и дождаться ответа Telegram"""
+        if not self._running:
+            # Планировщик не запущен (тесты, скрипты) - отправляем напрямую
+            return await call()
+
+        delivery = _Delivery(
+            chat_id=chat_id,
+            call=call,
+            priority=_priority.get() if priority is None else priority,
+            future=asyncio.get_running_loop().create_future()
+        )
+        self._put(delivery)
+        return await delivery.future
+
+    async def run(self) -> None:
+        """Цикл выдачи сообщений из очереди"""
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._running = True
+        logger.info(
+            f"📨 Telegram sender: {self.global_rate} msg/s, "
+            f"{self.per_chat_interval}s per chat, {self.max_retries} retries"
+        )
+
+        # Выполняемые отправки и сообщение, взятое из очереди, но ждущее
+        # токен или слот: при остановке их ожидающие получают ошибку
+        tasks: Dict[asyncio.Task, _Delivery] = {}
+        held: Optional[_Delivery] = None
+        try:
+            while True:
+                _, _, held = await self._queue.get()
+                delivery = held
+                self._depth[delivery.priority] = self._depth.get(delivery.priority, 0) - 1
+
+                wait = self._chat_ready_at.get(delivery.chat_id, 0) - time.monotonic()
+                if wait > 0:
+                    # Чат занят - сообщение вернется в очередь, остальные чаты не ждут
+                    self.metrics['deferred_for_chat'] += 1
+                    self._defer(delivery, wait)
+                    held = None
+                    continue
+
+                await self._take_token()
+                await self._in_flight.acquire()
+                self._mark_chat(delivery.chat_id, time.monotonic() + self.per_chat_interval)
+
+                task = asyncio.create_task(self._deliver(delivery))
+                tasks[task] = delivery
+                task.add_done_callback(lambda done: tasks.pop(done, None))
+                held = None
+        finally:
+            self._running = False
+            stopped = RuntimeError("Telegram sender stopped")
+            if held is not None:
+                self._finish(held, error=stopped)
+            for task, delivery in list(tasks.items()):
+                task.cancel()
+                # Задача могла не начаться - тогда ее обработчик отмены не выполнится
+                self._finish(delivery, error=stopped)
+            self._fail_pending(stopped)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Глубина очереди и задержки доставки"""
+        return {
+            **self.metrics,
+            'queue_depth': self._queue.qsize() + self._deferred,
+            'queue_depth_by_priority': {
+                PRIORITY_NAMES.get(priority, str(priority)): count for priority, count in self._depth.items()
+            },
+            'deferred': self._deferred,
+            'chats_tracked': len(self._chat_ready_at),
+        }
+
+    def _put(self, delivery: _Delivery) -> None:
+        self._depth[delivery.priority] = self._depth.get(delivery.priority, 0) + 1
+        self._queue.put_nowait((delivery.priority, next(self._sequence), delivery))
+
+    def _mark_chat(self, chat_id: Any, ready_at: float) -> None:
+        self._chat_ready_at[chat_id] = max(ready_at, self._chat_ready_at.get(chat_id, 0))
+        if len(self._chat_ready_at) > MAX_TRACKED_CHATS:
+            # Паузы, которые уже прошли, больше не нужны
+            now = time.monotonic()
+            self._chat_ready_at = {chat: at for chat, at in self._chat_ready_at.items() if at > now}
+
+    def _defer(self, delivery: _Delivery, delay: float) -> None:
+        self._deferred += 1
+
+        def requeue():
+            self._deferred -= 1
+            if self._running:
+                self._put(delivery)
+            elif not delivery.future.done():
+                delivery.future.set_exception(RuntimeError("Telegram sender stopped"))
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _take_token(self) -> None:
+        """Корзина токенов общего лимита"""
+        while True:
+            now = time.monotonic()
+            self._tokens = min(float(max(1.0, self.global_rate)),
+                               self._tokens + (now - self._tokens_at) * self.global_rate)
+            self._tokens_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.global_rate)
+
+    async def _deliver(self, delivery: _Delivery) -> None:
+        delivery.attempts += 1
+        try:
+            result = await delivery.call()
+        except TelegramRetryAfter as e:
+            self.metrics['retry_after'] += 1
+            self._mark_chat(delivery.chat_id, time.monotonic() + e.retry_after)
+            if delivery.attempts <= self.max_retries:
+                logger.warning(f"Telegram flood limit for chat {delivery.chat_id}: retry in {e.retry_after}s")
+                self._defer(delivery, e.retry_after)
+            else:
+                self._finish(delivery, error=e)
+        except asyncio.CancelledError:
+            self._finish(delivery, error=RuntimeError("Telegram sender stopped"))
+            raise
+        except Exception as e:
+            self._finish(delivery, error=e)
+        else:
+            self._finish(delivery, result=result)
+        finally:
+            self._in_flight.release()
+
+    def _finish(self, delivery: _Delivery, result: Any = None, error: Optional[BaseException] = None) -> None:
+        if delivery.future.done():
+            return
+        if error is not None:
+            self.metrics['failed'] += 1
+            delivery.future.set_exception(error)
+            return
+
+        self.metrics['sent'] += 1
+        latency_ms = (time.monotonic() - delivery.enqueued_at) * 1000
+        latency = self.metrics['latency'][PRIORITY_NAMES.get(delivery.priority, 'notification')]
+        latency['count'] += 1
+        latency['avg_ms'] = round(latency['avg_ms'] + (latency_ms - latency['avg_ms']) / latency['count'], 1)
+        latency['max_ms'] = round(max(latency['max_ms'], latency_ms), 1)
+        latency['last_ms'] = round(latency_ms, 1)
+        delivery.future.set_result(result)
+
+    def _fail_pending(self, error: BaseException) -> None:
+        while not self._queue.empty():
+            _, _, delivery = self._queue.get_nowait()
+            self._depth[delivery.priority] = self._depth.get(delivery.priority, 0) - 1
+            if not delivery.future.done():
+                delivery.future.set_exception(error)
+
+
+class TelegramSenderMiddleware(BaseRequestMiddleware):
+    """Направляет отправку сообщений бота через TelegramSender"""
+
+    def __init__(self, sender: TelegramSender):
+        self.sender = sender
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if not isinstance(method, LIMITED_METHODS) or chat_id is None:
+            return await make_request(bot, method)
+        return await self.sender.submit(chat_id, lambda: make_request(bot, method))
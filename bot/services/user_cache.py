@@ -0,0 +1,256 @@
+"""
+Двухуровневый кэш записей пользователя (профиль + настройки)
+
+L1 - словарь в памяти процесса, L2 - Redis-хэш user_record:{user_id}
+с полями user и settings. Данные меняются только при смене профиля и
+настроек, поэтому TTL длинные, а свежесть обеспечивает явная инвалидация:
+save_user и update_user_settings удаляют запись в Redis и публикуют
+user_id в канал, по которому остальные реплики сбрасывают свой L1.
+
+Инвалидация также увеличивает версию записи user_record:{user_id}:v.
+Загрузка из БД запоминает версию до запроса, и результат попадает в Redis
+только при той же версии (проверка и запись - одним скриптом). Иначе
+реплика, прочитавшая старую строку до записи на другой реплике, могла бы
+положить ее в общий кэш раньше, чем получит сообщение об инвалидации.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import redis.asyncio as redis
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "user_record:invalidate"
+
+# Маркер "пользователь не зарегистрирован" - отсутствие записи тоже кэшируется
+MISSING = "__missing__"
+
+
+# Запись поля, только если версия записи не менялась с начала загрузки
+SET_IF_VERSION_SCRIPT = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return 1
+"""
+
+
+def record_key(user_id: int) -> str:
+    return f"user_record:{user_id}"
+
+
+def version_key(user_id: int) -> str:
+    return f"user_record:{user_id}:v"
+
+
+class UserRecordCache:
+    """Кэш записей пользователей: память процесса поверх Redis"""
+
+    FIELDS = ('user', 'settings')
+
+    def __init__(self, l1_ttl: int = 900, redis_ttl: int = 21600, max_entries: int = 10000):
+        self.redis: Optional[redis.Redis] = None
+        self.l1_ttl = l1_ttl
+        self.redis_ttl = redis_ttl
+        self.max_entries = max_entries
+
+        # user_id -> (истекает в, {'user': ..., 'settings': ...})
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Поколение записи: растет при каждой инвалидации, чтобы загрузка,
+        # начатая до записи в БД, не положила в кэш устаревшие данные.
+        # Хранятся последние max_entries инвалидаций (LRU); у вытесненных
+        # пользователей поколение - максимум вытесненных, оно не меньше
+        # любого выданного им раньше
+        self._generations: "OrderedDict[int, int]" = OrderedDict()
+        self._generation_clock = 0
+        self._generation_floor = 0
+
+        self.instance_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._set_script = None
+
+        self.stats = {'l1_hits': 0, 'redis_hits': 0, 'misses': 0, 'invalidations': 0, 'stale_loads': 0}
+
+    async def start(self, redis_client: redis.Redis) -> None:
+        """Подключить Redis и подписаться на инвалидации других реплик"""
+        self.redis = redis_client
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen_invalidations())
+
+    async def stop(self) -> None:
+        """Остановить подписку"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def generation(self, user_id: int) -> int:
+        """Текущее поколение записи в этом процессе"""
+        return self._generations.get(user_id, self._generation_floor)
+
+    async def version(self, user_id: int) -> Tuple[int, str]:
+        """Поколение в процессе и версия в Redis (берутся до чтения из БД)"""
+        generation = self.generation(user_id)
+        redis_version = ''
+        if self.redis:
+            try:
+                redis_version = await self.redis.get(version_key(user_id)) or ''
+            except Exception as e:
+                logger.warning(f"Redis user record version read failed for {user_id}: {e}")
+        return generation, redis_version
+
+    async def get(self, user_id: int, field: str) -> Tuple[bool, Any]:
+        """Получить поле записи: (найдено, значение)"""
+        entry = self._entries.get(user_id)
+        if entry and entry[0] > time.monotonic() and field in entry[1]:
+            self._entries.move_to_end(user_id)
+            self.stats['l1_hits'] += 1
+            return True, self._decode(entry[1][field])
+
+        if self.redis:
+            generation = self.generation(user_id)
+            try:
+                cached = await self.redis.hgetall(record_key(user_id))
+            except Exception as e:
+                logger.warning(f"Redis user record read failed for {user_id}: {e}")
+                cached = {}
+
+            if field in cached:
+                record = {name: json.loads(value) for name, value in cached.items() if name in self.FIELDS}
+                if generation == self.generation(user_id):
+                    self._store_l1(user_id, record)
+                self.stats['redis_hits'] += 1
+                return True, self._decode(record[field])
+
+        self.stats['misses'] += 1
+        return False, None
+
+    async def set(self, user_id: int, field: str, value: Any, version: Tuple[int, str]) -> None:
+        """Положить загруженное из БД поле в оба уровня
+
+        version - значение version() до запроса к БД: если запись за это
+        время инвалидировали (здесь или на другой реплике), результат уже
+        может быть устаревшим и не кэшируется.
+        """
+        generation, redis_version = version
+        if generation != self.generation(user_id):
+            self.stats['stale_loads'] += 1
+            return
+
+        stored = MISSING if value is None else value
+
+        if self.redis:
+            try:
+                if self._set_script is None:
+                    self._set_script = self.redis.register_script(SET_IF_VERSION_SCRIPT)
+                written = await self._set_script(
+                    keys=[record_key(user_id), version_key(user_id)],
+                    args=[redis_version, field, json.dumps(stored, ensure_ascii=False, default=str), self.redis_ttl]
+                )
+                if not int(written or 0):
+                    self.stats['stale_loads'] += 1
+                    return
+            except Exception as e:
+                logger.warning(f"Redis user record write failed for {user_id}: {e}")
+
+        # Инвалидация могла прийти, пока шла запись в Redis
+        if generation != self.generation(user_id):
+            return
+        entry = self._entries.get(user_id)
+        record = dict(entry[1]) if entry and entry[0] > time.monotonic() else {}
+        record[field] = stored
+        self._store_l1(user_id, record)
+
+    async def invalidate(self, user_id: int) -> None:
+        """Сбросить запись во всех репликах (вызывается после записи в БД)"""
+        self._drop_l1(user_id)
+        self.stats['invalidations'] += 1
+
+        if self.redis:
+            try:
+                async with self.redis.pipeline(transaction=True) as pipe:
+                    # Версия переживает запись: загрузки, начатые до записи в
+                    # БД, заканчиваются задолго до истечения ключа
+                    pipe.incr(version_key(user_id))
+                    pipe.expire(version_key(user_id), self.redis_ttl)
+                    pipe.delete(record_key(user_id))
+                    pipe.publish(INVALIDATION_CHANNEL, f"{self.instance_id}:{user_id}")
+                    await pipe.execute()
+            except Exception as e:
+                logger.error(f"Error invalidating user record {user_id}: {e}")
+
+    def clear(self) -> None:
+        """Сбросить весь L1 (например, после потери подписки)"""
+        for user_id in list(self._entries):
+            self._drop_l1(user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счетчики и доли попаданий"""
+        lookups = self.stats['l1_hits'] + self.stats['redis_hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'l1_entries': len(self._entries),
+            'l1_hit_ratio': round(self.stats['l1_hits'] / lookups, 4) if lookups else 0.0,
+            'hit_ratio': round((lookups - self.stats['misses']) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _store_l1(self, user_id: int, record: Dict[str, Any]) -> None:
+        self._entries[user_id] = (time.monotonic() + self.l1_ttl, record)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _drop_l1(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+        self._generation_clock += 1
+        self._generations[user_id] = self._generation_clock
+        self._generations.move_to_end(user_id)
+        while len(self._generations) > self.max_entries:
+            _, evicted = self._generations.popitem(last=False)
+            self._generation_floor = max(self._generation_floor, evicted)
+
+    @staticmethod
+    def _decode(value: Any) -> Any:
+        # Копия, чтобы обработчики могли менять словарь настроек
+        if value == MISSING:
+            return None
+        return dict(value) if isinstance(value, dict) else value
+
+    async def _listen_invalidations(self) -> None:
+        """Подписка на инвалидации с переподключением"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Пока подписки не было, сообщения могли потеряться
+                self.clear()
+
+                async for message in pubsub.listen():
+                    if message.get('type') != 'message':
+                        continue
+                    instance_id, _, user_id = str(message['data']).partition(':')
+                    if instance_id != self.instance_id and user_id.isdigit():
+                        self._drop_l1(int(user_id))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"User record invalidation listener failed: {e}")
+                await asyncio.sleep(5)
+            finally:
+                try:
+                    await pubsub.reset()
+                except Exception:
+                    pass
@@ -0,0 +1,198 @@
+"""
+Очередь событий FACEIT webhook на Redis Streams
+
+Webhook только проверяет событие и добавляет его в поток (XADD), поэтому
+отвечает FACEIT за миллисекунды. Обработку выполняет пул потребителей
+группы webhook-consumers:
+- успешно обработанное событие подтверждается (XACK);
+- упавшее остается в списке ожидающих и после claim_idle_ms забирается
+  повторно (XPENDING + XCLAIM);
+- после max_attempts доставок событие переносится в поток dead-letter.
+"""
+
+import asyncio
+import json
+import logging
+import socket
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "faceit:webhook:events"
+DEAD_LETTER_KEY = "faceit:webhook:dead"
+GROUP_NAME = "webhook-consumers"
+
+
+def stream_id_age_ms(message_id: str) -> float:
+    """Сколько миллисекунд назад событие попало в поток (первая часть ID - время)"""
+    try:
+        return max(0.0, time.time() * 1000 - int(message_id.split('-')[0]))
+    except (ValueError, AttributeError):
+        return 0.0
+
+
+class WebhookEventQueue:
+    """Надежная очередь событий webhook с пулом потребителей"""
+
+    def __init__(self, storage, handler: Callable[[Dict[str, Any]], Awaitable[None]],
+                 consumers: int = 2, max_attempts: int = 5, claim_idle_ms: int = 60000,
+                 max_length: int = 100000):
+        self.storage = storage
+        self.handler = handler
+        self.consumers = max(1, consumers)
+        self.max_attempts = max_attempts
+        self.claim_idle_ms = claim_idle_ms
+        self.max_length = max_length
+
+        # Имена потребителей уникальны для процесса: чужие ожидающие события
+        # забираются только через XCLAIM
+        self.consumer_prefix = f"{socket.gethostname()}-{id(self):x}"
+
+        self.metrics = {
+            'published': 0,
+            'processed': 0,
+            'failed': 0,
+            'retried': 0,
+            'dead_lettered': 0,
+            'last_latency_ms': 0.0,
+            'max_latency_ms': 0.0,
+        }
+
+    async def publish(self, event: Dict[str, Any]) -> str:
+        """Добавить событие в поток"""
+        message_id = await self.storage.redis.xadd(
+            STREAM_KEY,
+            {'event': json.dumps(event, ensure_ascii=False)},
+            maxlen=self.max_length,
+            approximate=True
+        )
+        self.metrics['published'] += 1
+        return message_id
+
+    async def ensure_group(self) -> None:
+        """Создать группу потребителей (и поток), если их еще нет"""
+        try:
+            await self.storage.redis.xgroup_create(STREAM_KEY, GROUP_NAME, id='0', mkstream=True)
+        except Exception as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    async def run(self) -> None:
+        """Запустить потребителей и повторную обработку зависших событий"""
+        await self.ensure_group()
+        logger.info(f"📥 Webhook queue: {self.consumers} consumers, max attempts {self.max_attempts}")
+
+        tasks = [
+            asyncio.create_task(self._consume(f"{self.consumer_prefix}-{i}"))
+            for i in range(self.consumers)
+        ]
+        tasks.append(asyncio.create_task(self._reclaim(f"{self.consumer_prefix}-reclaim")))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _consume(self, consumer: str) -> None:
+        """Чтение новых событий группы"""
+        while True:
+            try:
+                response = await self.storage.redis.xreadgroup(
+                    GROUP_NAME, consumer, {STREAM_KEY: '>'}, count=10, block=5000
+                )
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._process(message_id, fields)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook consumer {consumer} error: {e}")
+                await asyncio.sleep(5)
+
+    async def _reclaim(self, consumer: str) -> None:
+        """Повтор событий, которые долго не подтверждались"""
+        while True:
+            try:
+                await asyncio.sleep(self.claim_idle_ms / 2000)
+                await self.reclaim_pending(consumer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook reclaim error: {e}")
+
+    async def reclaim_pending(self, consumer: str) -> None:
+        """Забрать зависшие события или перенести их в dead-letter"""
+        redis = self.storage.redis
+        pending = await redis.xpending_range(
+            STREAM_KEY, GROUP_NAME, min='-', max='+', count=50, idle=self.claim_idle_ms
+        )
+
+        for entry in pending:
+            message_id = entry['message_id']
+            if entry['times_delivered'] >= self.max_attempts:
+                await self._dead_letter(message_id, entry['times_delivered'])
+                continue
+
+            claimed = await redis.xclaim(
+                STREAM_KEY, GROUP_NAME, consumer, self.claim_idle_ms, [message_id]
+            )
+            for claimed_id, fields in claimed:
+                if fields:
+                    self.metrics['retried'] += 1
+                    await self._process(claimed_id, fields)
+
+    async def _process(self, message_id: str, fields: Dict[str, str]) -> None:
+        try:
+            event = json.loads(fields['event'])
+            await self.handler(event)
+        except Exception as e:
+            # Без XACK событие останется в ожидающих и будет повторено
+            self.metrics['failed'] += 1
+            logger.error(f"Webhook event {message_id} failed: {e}")
+            return
+
+        await self.storage.redis.xack(STREAM_KEY, GROUP_NAME, message_id)
+        self.metrics['processed'] += 1
+
+        latency = stream_id_age_ms(message_id)
+        self.metrics['last_latency_ms'] = round(latency, 1)
+        self.metrics['max_latency_ms'] = round(max(self.metrics['max_latency_ms'], latency), 1)
+
+    async def _dead_letter(self, message_id: str, attempts: int) -> None:
+        """Перенести событие в поток dead-letter и подтвердить исходное"""
+        redis = self.storage.redis
+        messages = await redis.xrange(STREAM_KEY, min=message_id, max=message_id)
+        fields = messages[0][1] if messages else {}
+
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.xadd(DEAD_LETTER_KEY, {
+                **fields,
+                'source_id': message_id,
+                'attempts': attempts,
+            }, maxlen=self.max_length, approximate=True)
+            pipe.xack(STREAM_KEY, GROUP_NAME, message_id)
+            await pipe.execute()
+
+        self.metrics['dead_lettered'] += 1
+        logger.error(f"Webhook event {message_id} moved to dead-letter after {attempts} attempts")
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Метрики очереди: счетчики, ожидающие события и отставание группы"""
+        stats = dict(self.metrics)
+        try:
+            redis = self.storage.redis
+            groups = await redis.xinfo_groups(STREAM_KEY)
+            group = next((g for g in groups if g.get('name') == GROUP_NAME), {})
+            stats['pending'] = group.get('pending', 0)
+            stats['lag'] = group.get('lag')
+            stats['dead_letter_size'] = await redis.xlen(DEAD_LETTER_KEY)
+
+            oldest = await redis.xpending_range(STREAM_KEY, GROUP_NAME, min='-', max='+', count=1)
+            stats['oldest_pending_ms'] = round(stream_id_age_ms(oldest[0]['message_id']), 1) if oldest else 0.0
+        except Exception as e:
+            logger.warning(f"Failed to get webhook queue stats: {e}")
+        return stats
@@ -0,0 +1,211 @@
+"""
+Автомасштабирование пулов воркеров
+
+Каждая очередь WorkerQueue обслуживается своим пулом воркеров, размер
+которого держится между min_size и max_size. Раз в interval секунд
+супервизор смотрит на очередь:
+- растет, если задач, еще не выданных воркерам, больше backlog_per_worker
+  на воркера или задача ждала в очереди дольше target_wait_ms - сразу до
+  числа воркеров, которое разберет очередь (не выше max_size);
+- сокращается на одного воркера, если очередь пуста и задачи ждали меньше
+  половины цели scale_down_checks проверок подряд.
+
+Лишний воркер не отменяется: ему выставляется событие остановки, он
+дорабатывает текущую задачу и выходит из цикла. Решения пишутся в лог и
+последние из них видны в /api/stats.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Фабрика воркера: (worker_id, событие остановки) -> корутина цикла воркера
+WorkerFactory = Callable[[int, asyncio.Event], Awaitable[None]]
+
+
+class WorkerPool:
+    """Воркеры одной очереди"""
+
+    def __init__(self, queue: str, factory: WorkerFactory, initial: int, min_size: int, max_size: int):
+        self.queue = queue
+        self.factory = factory
+        self.min_size = max(0, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.initial = min(max(initial, self.min_size), self.max_size)
+        # worker_id -> (задача, событие остановки)
+        self.workers: Dict[int, Tuple[asyncio.Task, asyncio.Event]] = {}
+        self.draining: Dict[int, asyncio.Task] = {}
+        # Сколько проверок подряд пул мог бы сократиться
+        self.idle_checks = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.workers)
+
+    def start_worker(self) -> int:
+        # Свободный наименьший id: имена потребителей в группе Redis не копятся
+        busy = set(self.workers) | set(self.draining)
+        worker_id = next(i for i in range(len(busy) + 1) if i not in busy)
+        stop = asyncio.Event()
+        task = asyncio.create_task(self.factory(worker_id, stop))
+        self.workers[worker_id] = (task, stop)
+        task.add_done_callback(lambda _: self._forget(worker_id, task))
+        return worker_id
+
+    def drain_worker(self) -> Optional[int]:
+        """Попросить последний запущенный воркер завершиться после текущей задачи"""
+        if not self.workers:
+            return None
+        worker_id = max(self.workers)
+        task, stop = self.workers.pop(worker_id)
+        stop.set()
+        self.draining[worker_id] = task
+        return worker_id
+
+    def tasks(self) -> Iterable[asyncio.Task]:
+        return [task for task, _ in self.workers.values()] + list(self.draining.values())
+
+    def _forget(self, worker_id: int, task: asyncio.Task) -> None:
+        if self.draining.get(worker_id) is task:
+            del self.draining[worker_id]
+        elif worker_id in self.workers and self.workers[worker_id][0] is task:
+            # Воркер завершился сам - следующая проверка доберет пул до минимума
+            del self.workers[worker_id]
+            if not task.cancelled() and task.exception():
+                logger.error(f"{self.queue} worker {worker_id} crashed: {task.exception()}")
+
+
+class WorkerSupervisor:
+    """Поддерживает размер пулов воркеров по глубине очередей и времени ожидания задач"""
+
+    def __init__(self, worker_queue, interval: float = 5.0, target_wait_ms: float = 2000,
+                 backlog_per_worker: int = 5, scale_down_checks: int = 6,
+                 autoscale: bool = True, max_decisions: int = 50):
+        self.worker_queue = worker_queue
+        self.interval = interval
+        self.target_wait_ms = target_wait_ms
+        self.backlog_per_worker = max(1, backlog_per_worker)
+        self.scale_down_checks = max(1, scale_down_checks)
+        self.autoscale = autoscale
+        self.pools: Dict[str, WorkerPool] = {}
+        self.decisions: Deque[Dict[str, Any]] = deque(maxlen=max_decisions)
+        self.metrics = {'scale_ups': 0, 'scale_downs': 0, 'restarts': 0, 'checks': 0}
+
+    def add_pool(self, queue: str, factory: WorkerFactory, initial: int, min_size: int, max_size: int) -> WorkerPool:
+        pool = WorkerPool(queue, factory, initial, min_size, max_size)
+        self.pools[queue] = pool
+        return pool
+
+    async def run(self) -> None:
+        """Запустить пулы и следить за их размером"""
+        for pool in self.pools.values():
+            for _ in range(pool.initial):
+                pool.start_worker()
+            logger.info(f"   - {pool.queue} workers: {pool.size} (min {pool.min_size}, max {pool.max_size})")
+
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.check()
+                except Exception as e:
+                    logger.error(f"Worker supervisor check failed: {e}")
+        finally:
+            await self.stop()
+
+    async def check(self) -> None:
+        """Одна проверка всех пулов"""
+        self.metrics['checks'] += 1
+        stats = await self.worker_queue.get_stats()
+        for queue, pool in self.pools.items():
+            queue_stats = stats.get(queue, {})
+            wait_ms = self.worker_queue.take_wait_ms(queue)
+            target, reason = self.decide(pool, self._backlog(queue_stats), wait_ms)
+            self._resize(pool, target, reason)
+
+    def decide(self, pool: WorkerPool, backlog: int, wait_ms: float) -> Tuple[int, str]:
+        """Нужный размер пула и причина изменения"""
+        size = pool.size
+        if size < pool.min_size:
+            pool.idle_checks = 0
+            return pool.min_size, "below minimum"
+
+        if not self.autoscale:
+            return size, ""
+
+        overloaded = backlog > size * self.backlog_per_worker or wait_ms > self.target_wait_ms
+        if overloaded and size < pool.max_size:
+            pool.idle_checks = 0
+            needed = math.ceil(backlog / self.backlog_per_worker)
+            target = min(pool.max_size, max(size + 1, needed))
+            return target, f"backlog {backlog}, wait {wait_ms:.0f}ms"
+
+        if backlog == 0 and wait_ms < self.target_wait_ms / 2 and size > pool.min_size:
+            pool.idle_checks += 1
+            if pool.idle_checks >= self.scale_down_checks:
+                pool.idle_checks = 0
+                return size - 1, f"idle for {self.scale_down_checks} checks"
+            return size, ""
+
+        pool.idle_checks = 0
+        return size, ""
+
+    async def stop(self) -> None:
+        """Отменить всех воркеров (остановка приложения)"""
+        tasks = [task for pool in self.pools.values() for task in pool.tasks()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            'autoscale': self.autoscale,
+            'pools': {
+                queue: {
+                    'workers': pool.size,
+                    'draining': len(pool.draining),
+                    'min': pool.min_size,
+                    'max': pool.max_size,
+                }
+                for queue, pool in self.pools.items()
+            },
+            'recent_decisions': list(self.decisions),
+        }
+
+    def _resize(self, pool: WorkerPool, target: int, reason: str) -> None:
+        size = pool.size
+        if target == size:
+            return
+
+        if target > size:
+            for _ in range(target - size):
+                pool.start_worker()
+            self.metrics['restarts' if reason == "below minimum" else 'scale_ups'] += 1
+        else:
+            for _ in range(size - target):
+                pool.drain_worker()
+            self.metrics['scale_downs'] += 1
+
+        self.decisions.append({
+            'at': round(time.time(), 3),
+            'queue': pool.queue,
+            'from': size,
+            'to': pool.size,
+            'reason': reason,
+        })
+        logger.info(f"⚖️ {pool.queue} workers: {size} -> {pool.size} ({reason})")
+
+    @staticmethod
+    def _backlog(queue_stats: Dict[str, Any]) -> int:
+        """Задачи, еще не выданные воркерам"""
+        lag = queue_stats.get('lag')
+        if lag is None:
+            # Redis < 7 не считает lag группы
+            lag = queue_stats.get('depth', 0) - queue_stats.get('pending', 0)
+        return max(0, int(lag or 0))
@@ -7,10 +7,14 @@ class Settings(BaseSettings):
     faceit_api_key: str
     webhook_url: Optional[str] = None
     debug: bool = False
+    # Роли процесса: all или bot,api,monitor,workers через запятую
+    roles: str = "all"
     
     # Database settings
     database_url: Optional[str] = None
     redis_url: Optional[str] = None
+    run_migrations_on_startup: bool = True
+    database_pool_size: int = 10
     
     # Worker configuration
     stats_workers: int = 3
@@ -18,11 +22,69 @@ class Settings(BaseSettings):
     comparison_workers: int = 2
     notification_workers: int = 1
     
+    # Автомасштабирование пулов воркеров (*_workers - начальный размер)
+    worker_autoscale: bool = True
+    worker_autoscale_interval: float = 5.0  # секунд между проверками очередей
+    worker_min_per_pool: int = 1
+    stats_workers_max: int = 8
+    history_workers_max: int = 4
+    comparison_workers_max: int = 4
+    notification_workers_max: int = 2
+    worker_target_wait_ms: int = 2000       # допустимое ожидание задачи в очереди
+    worker_backlog_per_worker: int = 5      # невыданных задач на воркера до роста пула
+    worker_scale_down_checks: int = 6       # проверок пустой очереди до сокращения
+    
     # Performance settings
     concurrent_requests: int = 5
     batch_size: int = 10
     max_queue_size: int = 1000
     worker_timeout: int = 30
+    worker_queue_backend: str = "redis"   # redis (Redis Streams) или memory
+    worker_visibility_timeout: int = 300  # секунд до повторной выдачи неподтвержденной задачи
+    worker_max_deliveries: int = 5        # попыток задачи до переноса в карантин (dead-letter)
+    worker_task_timeout: int = 60         # дедлайн выполнения задачи (меньше visibility timeout)
+    worker_retry_base_delay: float = 2.0  # задержка первого повтора упавшей задачи, секунд
+    worker_retry_max_delay: float = 60.0  # предел задержки повтора
+    worker_dead_letter_max: int = 1000    # задач в карантине на очередь
+    worker_user_max_in_flight: int = 2    # задач пользователя в работе одновременно (0 - без предела)
+    worker_user_defer_delay: float = 1.0  # на сколько откладывается задача сверх предела, секунд
+    worker_result_ttl: int = 60           # секунд повторного использования результата задачи
+    worker_offload_timeout: float = 20.0  # дедлайн обработчика, ждущего воркер (0 - считать на месте)
+    comparison_form_matches: int = 10     # матчей для формы игрока в расширенном сравнении
+    match_stats_cache_days: int = 30      # хранение статистики завершенных матчей (не меняется)
+    loop_lag_warn_ms: int = 200           # задержка цикла событий, о которой пишется в лог
+    
+    # Match monitoring
+    monitor_interval: int = 300      # секунд между началами проходов
+    monitor_concurrency: int = 10    # одновременно проверяемых пользователей
+    monitor_shard_size: int = 100    # пользователей в шарде (шаг сохранения курсора)
+    
+    # Адаптивный опрос (интервалы в секундах)
+    adaptive_polling: bool = True
+    poll_budget_per_second: float = 2.0  # общий бюджет опросов истории на все реплики
+    poll_live_interval: int = 60         # игрок в матче
+    poll_active_interval: int = 120      # игровая сессия (матч за последние 3 часа)
+    poll_max_interval: int = 21600       # предел отката для неактивных аккаунтов
+    
+    # Webhook queue (Redis Streams)
+    webhook_consumers: int = 2
+    webhook_max_attempts: int = 5    # после стольких доставок событие уходит в dead-letter
+    idempotency_ttl: int = 86400     # окно дедупликации событий и матчей, секунд
+    
+    # Предварительный анализ текущего матча (по событиям configuring/ready)
+    precompute_match_analysis: bool = True
+    match_analysis_ttl: int = 30          # минут хранения анализа завершенного матча
+    match_analysis_live_ttl: int = 10     # минут хранения анализа, пока матч идет
+    match_analysis_concurrency: int = 2   # одновременных фоновых расчетов
+    
+    # Лимиты отправки сообщений Telegram
+    telegram_global_rate: float = 30.0    # сообщений в секунду на бота
+    telegram_chat_interval: float = 1.0   # секунд между сообщениями в один чат
+    telegram_max_retries: int = 3         # повторов после 429 (retry_after)
+    
+    # Retention settings (дни, 0 - хранить бессрочно)
+    notification_retention_days: int = 30
+    match_history_retention_days: int = 0
     
     model_config = {"env_file": ".env", "extra": "ignore"}
 
@@ -39,11 +39,12 @@ class FaceitAPIClient:
         """Выполнить HTTP запрос к API с улучшенной обработкой ошибок и concurrent контролем"""
         cache_key = f"faceit_{endpoint}_{json.dumps(params, sort_keys=True) if params else ''}"
         
-        # Проверяем кэш с TTL
-        cached_data = await storage.get_cached_data(cache_key, max_age_minutes=cache_ttl//60)
-        if cached_data:
-            self.logger.debug(f"Cache hit for {endpoint}")
-            return cached_data
+        # Проверяем кэш с TTL (cache_ttl=0 - всегда свежий ответ)
+        if cache_ttl > 0:
+            cached_data = await storage.get_cached_data(cache_key, max_age_minutes=cache_ttl//60)
+            if cached_data:
+                self.logger.debug(f"Cache hit for {endpoint}")
+                return cached_data
         
         # Используем семафор для контроля concurrent запросов
         async with self.semaphore:
@@ -57,7 +58,8 @@ class FaceitAPIClient:
                     
                     if response.status_code == 200:
                         data = response.json()
-                        await storage.set_cached_data(cache_key, data)
+                        if cache_ttl > 0:
+                            await storage.set_cached_data(cache_key, data)
                         self.logger.debug(f"API request successful: {endpoint}")
                         return data
                         
@@ -103,6 +105,96 @@ class FaceitAPIClient:
         
         return None
     
+    async def _make_requests_bulk(self, endpoints: List[str], cache_ttl: int = 300) -> Dict[str, Optional[Dict]]:
+        """Несколько GET-запросов без параметров: кэш - одним MGET, промахи - параллельно,
+        новые ответы - в кэш одним пайплайном"""
+        endpoints = list(dict.fromkeys(endpoints))
+        cache_keys = {endpoint: f"faceit_{endpoint}_" for endpoint in endpoints}
+        
+        results: Dict[str, Optional[Dict]] = {}
+        if cache_ttl > 0:
+            cached = await storage.get_cached_many(list(cache_keys.values()))
+            for endpoint, cache_key in cache_keys.items():
+                if cached.get(cache_key):
+                    results[endpoint] = cached[cache_key]
+        
+        missing = [endpoint for endpoint in endpoints if endpoint not in results]
+        # cache_ttl=0: кэш уже проверен, ответы сохраняются ниже одной пачкой
+        responses = await asyncio.gather(*(self._make_request(endpoint, cache_ttl=0) for endpoint in missing))
+        fresh = {}
+        for endpoint, data in zip(missing, responses):
+            results[endpoint] = data
+            if data:
+                fresh[cache_keys[endpoint]] = data
+        
+        if fresh and cache_ttl > 0:
+            await storage.set_cached_many(fresh)
+        
+        self.logger.debug(f"Bulk request: {len(endpoints)} endpoints, {len(missing)} fetched")
+        return results
+    
+    async def get_players_details_and_stats(self, player_ids: List[str], game: str = "cs2"
+                                            ) -> Dict[str, Tuple[Optional[Dict], Optional[Dict]]]:
+        """Детали и статистика группы игроков (player_id -> (детали, статистика))"""
+        player_ids = list(dict.fromkeys(player_ids))
+        details_endpoints = [f"/players/{player_id}" for player_id in player_ids]
+        stats_endpoints = [f"/players/{player_id}/stats/{game}" for player_id in player_ids]
+        responses = await self._make_requests_bulk(details_endpoints + stats_endpoints, cache_ttl=1800)
+        return {
+            player_id: (responses.get(details), responses.get(stats))
+            for player_id, details, stats in zip(player_ids, details_endpoints, stats_endpoints)
+        }
+    
+    async def get_matches_player_rows(self, match_ids: List[str]) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Краткая статистика игроков завершенных матчей (match_id -> player_id -> показатели)
+        
+        Статистика завершенного матча не меняется, поэтому хранится долго
+        (match_stats_cache_days) и в сжатом виде - только нужные показатели.
+        Кэш читается одним MGET, промахи запрашиваются параллельно.
+        """
+        match_ids = list(dict.fromkeys(m for m in match_ids if m))
+        cache_keys = {match_id: f"match_player_rows_{match_id}" for match_id in match_ids}
+        cached = await storage.get_cached_many(list(cache_keys.values()))
+        rows = {match_id: cached[key] for match_id, key in cache_keys.items() if key in cached}
+        
+        missing = [match_id for match_id in match_ids if match_id not in rows]
+        responses = await asyncio.gather(
+            *(self._make_request(f"/matches/{match_id}/stats", cache_ttl=0) for match_id in missing)
+        )
+        fresh = {}
+        for match_id, match_stats in zip(missing, responses):
+            if not match_stats or not match_stats.get('rounds'):
+                continue
+            rows[match_id] = fresh[cache_keys[match_id]] = self._compact_match_rows(match_stats)
+        
+        if fresh:
+            await storage.set_cached_many(fresh, ttl_minutes=settings.match_stats_cache_days * 24 * 60)
+        return rows
+    
+    @staticmethod
+    def _compact_match_rows(match_stats: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        def safe_int(value, default=0):
+            try:
+                return int(float(str(value)))
+            except (ValueError, TypeError):
+                return default
+        
+        rows = {}
+        for round_data in match_stats.get('rounds', []):
+            rounds = safe_int(round_data.get('round_stats', {}).get('Rounds', 0))
+            for team in round_data.get('teams', []):
+                for player in team.get('players', []):
+                    player_stats = player.get('player_stats', {})
+                    rows[player.get('player_id')] = {
+                        'kills': safe_int(player_stats.get('Kills', 0)),
+                        'deaths': safe_int(player_stats.get('Deaths', 0)),
+                        'assists': safe_int(player_stats.get('Assists', 0)),
+                        'headshots': safe_int(player_stats.get('Headshots', 0)),
+                        'damage': safe_int(player_stats.get('Damage', 0)),
+                        'rounds': rounds,
+                    }
+        return rows
+    
     async def find_player_by_nickname(self, nickname: str) -> Optional[Dict[str, Any]]:
         """Найти игрока по никнейму"""
         # Кэшируем поиск игроков на 1 час (3600 секунд)
@@ -124,7 +216,8 @@ class FaceitAPIClient:
         return await self._make_request(f"/players/{player_id}/stats/{game}", cache_ttl=1800)
     
     async def get_player_history(self, player_id: str, game: str = "cs2", 
-                               limit: int = 20, offset: int = 0) -> Optional[Dict[str, Any]]:
+                               limit: int = 20, offset: int = 0,
+                               cache_ttl: int = 600) -> Optional[Dict[str, Any]]:
         """Получить историю матчей игрока (исправлен метод)"""
         params = {
             "game": game,
@@ -132,7 +225,7 @@ class FaceitAPIClient:
             "offset": offset
         }
         # Кэшируем историю матчей на 10 минут (600 секунд)
-        return await self._make_request(f"/players/{player_id}/history", params=params, cache_ttl=600)
+        return await self._make_request(f"/players/{player_id}/history", params=params, cache_ttl=cache_ttl)
     
     # Алиас для обратной совместимости
     async def get_player_matches(self, player_id: str, game: str = "cs2", 
@@ -140,9 +233,9 @@ class FaceitAPIClient:
         """Алиас для get_player_history для обратной совместимости"""
         return await self.get_player_history(player_id, game, limit, offset)
     
-    async def get_match_details(self, match_id: str) -> Optional[Dict[str, Any]]:
+    async def get_match_details(self, match_id: str, cache_ttl: int = 300) -> Optional[Dict[str, Any]]:
         """Получить детали матча"""
-        return await self._make_request(f"/matches/{match_id}")
+        return await self._make_request(f"/matches/{match_id}", cache_ttl=cache_ttl)
     
     async def get_match_stats(self, match_id: str) -> Optional[Dict[str, Any]]:
         """Получить статистику матча с кэшированием"""
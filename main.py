@@ -1,6 +1,10 @@
 import asyncio
 import logging
+import os
+import signal
+import sys
 from datetime import datetime
+from typing import Set
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from fastapi import FastAPI, Request
@@ -13,6 +17,17 @@ from contextlib import asynccontextmanager
 from config import settings
 from storage import storage, init_storage, cleanup_storage, cleanup_storage_task
 from faceit_client import faceit_client
+from bot.services.match_monitor import MatchMonitor
+from bot.services.poll_scheduler import PollScheduler
+from bot.services.webhook_queue import WebhookEventQueue
+from bot.services.idempotency import IdempotencyStore, event_key, finished_match_key
+from bot.services.database_storage import is_after_watermark
+from bot.handlers.current_match_handler import analysis_precomputer
+from bot.services.roles import SENDING_ROLES, parse_roles
+from bot.services.loop_lag import LoopLagMonitor
+from bot.services.telegram_sender import (
+    TelegramSender, TelegramSenderMiddleware, delivery_priority, NOTIFICATION
+)
 
 # Настройка логирования с маскированием чувствительных данных
 logging.basicConfig(
@@ -31,6 +46,17 @@ def mask_sensitive_data(data: str, show_chars: int = 4) -> str:
 bot = Bot(token=settings.bot_token)
 dp = Dispatcher(storage=MemoryStorage())
 
+# Все исходящие сообщения проходят через очередь с лимитами Telegram
+telegram_sender = TelegramSender(
+    global_rate=settings.telegram_global_rate,
+    per_chat_interval=settings.telegram_chat_interval,
+    max_retries=settings.telegram_max_retries
+)
+bot.session.middleware(TelegramSenderMiddleware(telegram_sender))
+
+# Задержка цикла событий: синхронные участки, держащие все обработчики
+loop_lag = LoopLagMonitor(warn_ms=settings.loop_lag_warn_ms)
+
 def setup_routers():
     """Настройка роутеров - вызывается один раз"""
     try:
@@ -62,19 +88,19 @@ def setup_routers():
         logger.error(f"❌ Ошибка при регистрации роутеров: {e}")
         raise
 
-# FastAPI приложение
 @asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Управление жизненным циклом приложения"""
+async def run_roles(roles: Set[str]):
+    """Запуск и остановка фоновых задач ролей процесса (bot/services/roles.py)"""
     # Запуск
-    logger.info("🚀 Запуск FACEIT CS2 бота...")
+    logger.info(f"🚀 Запуск FACEIT CS2 бота (роли: {', '.join(sorted(roles))})...")
     logger.info(f"🤖 Bot Token: {mask_sensitive_data(settings.bot_token)}")
     logger.info(f"🔑 FACEIT API Key: {mask_sensitive_data(settings.faceit_api_key)}")
     
     # Настройка роутеров
-    logger.info(f"🔧 Before setup_routers: {len(dp.sub_routers)} routers")
-    setup_routers()
-    logger.info(f"🔧 After setup_routers: {len(dp.sub_routers)} routers")
+    if 'bot' in roles:
+        logger.info(f"🔧 Before setup_routers: {len(dp.sub_routers)} routers")
+        setup_routers()
+        logger.info(f"🔧 After setup_routers: {len(dp.sub_routers)} routers")
     
     # Инициализация базы данных
     try:
@@ -85,66 +111,69 @@ async def lifespan(app: FastAPI):
         raise
     
     # Запуск фоновых задач
-    cleanup_task = asyncio.create_task(cleanup_storage_task())
-    polling_task = asyncio.create_task(start_polling())
-    match_monitor_task = asyncio.create_task(match_monitoring_task())
-    
-    # Запуск специализированных воркеров
-    from workers import (stats_analysis_worker, match_history_worker, 
-                        comparison_worker, notification_worker)
+    sender_task = asyncio.create_task(telegram_sender.run()) if roles & SENDING_ROLES else None
+    tasks = [asyncio.create_task(loop_lag.run())]
+    if 'bot' in roles:
+        tasks.append(asyncio.create_task(start_polling()))
+    if 'monitor' in roles:
+        tasks.append(asyncio.create_task(cleanup_storage_task()))
+        tasks.append(asyncio.create_task(match_monitoring_task()))
+        tasks.append(asyncio.create_task(webhook_queue.run()))
     
-    # Создаем воркеры согласно конфигурации
-    worker_tasks = []
-    
-    # Stats analysis workers
-    for i in range(settings.stats_workers):
-        task = asyncio.create_task(stats_analysis_worker(worker_id=i))
-        worker_tasks.append(task)
-    
-    # Match history workers
-    for i in range(settings.history_workers):
-        task = asyncio.create_task(match_history_worker(worker_id=i))
-        worker_tasks.append(task)
-    
-    # Comparison workers
-    for i in range(settings.comparison_workers):
-        task = asyncio.create_task(comparison_worker(worker_id=i))
-        worker_tasks.append(task)
-    
-    # Notification workers
-    for i in range(settings.notification_workers):
-        task = asyncio.create_task(notification_worker(worker_id=i))
-        worker_tasks.append(task)
-    
-    logger.info(f"🚀 Запущено {len(worker_tasks)} специализированных воркеров:")
-    logger.info(f"   - Stats workers: {settings.stats_workers}")
-    logger.info(f"   - History workers: {settings.history_workers}")
-    logger.info(f"   - Comparison workers: {settings.comparison_workers}")
-    logger.info(f"   - Notification workers: {settings.notification_workers}")
+    # Запуск специализированных воркеров: размер пулов держит супервизор
+    from workers import worker_queue, worker_supervisor
+    if 'workers' in roles:
+        logger.info("🚀 Запуск пулов специализированных воркеров:")
+        tasks.append(asyncio.create_task(worker_supervisor.run()))
+        tasks.append(asyncio.create_task(worker_queue.run_retry_scheduler()))
     
     try:
         yield
     finally:
         # Остановка
         logger.info("🛑 Остановка бота...")
-        cleanup_task.cancel()
-        polling_task.cancel()
-        match_monitor_task.cancel()
-        
-        # Остановка воркеров
-        logger.info(f"🛑 Остановка {len(worker_tasks)} воркеров...")
-        for task in worker_tasks:
+        for task in tasks:
             task.cancel()
+        # Предрасчет анализа запускают обработчики бота и события webhook (monitor)
+        await analysis_precomputer.stop()
         
         # Закрытие подключений к БД
         await cleanup_storage()
         
         # Ждем завершения всех задач
-        all_tasks = [cleanup_task, polling_task, match_monitor_task] + worker_tasks
-        await asyncio.gather(*all_tasks, return_exceptions=True)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await worker_queue.close()
+        
+        # Очередь сообщений останавливается последней - после задач, которые в нее пишут
+        if sender_task:
+            sender_task.cancel()
+            await asyncio.gather(sender_task, return_exceptions=True)
         
         logger.info("✅ Все задачи и воркеры остановлены")
 
+
+# Роли этого процесса (python main.py <роли> переопределяет ROLES)
+process_roles = parse_roles(settings.roles, settings.worker_queue_backend)
+
+
+# FastAPI приложение
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Управление жизненным циклом приложения"""
+    async with run_roles(process_roles):
+        yield
+
+
+async def run_headless(roles: Set[str]):
+    """Процесс без HTTP API: роли работают до SIGTERM или SIGINT"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    
+    async with run_roles(roles):
+        await stop.wait()
+
 app = FastAPI(
     title="FACEIT CS2 Bot API",
     description="API для получения статистики игроков CS2 с FACEIT",
@@ -179,7 +208,7 @@ async def health_check():
         faceit_status = "ok" if test_response or True else "error"  # Игнорируем 404 для тестового запроса
         
         # Проверяем что роутеры зарегистрированы
-        if len(dp.sub_routers) == 0:
+        if 'bot' in process_roles and len(dp.sub_routers) == 0:
             logger.warning("⚠️ No routers registered, re-running setup_routers()")
             setup_routers()
         
@@ -198,6 +227,7 @@ async def health_check():
                 "faceit_api": faceit_status
             },
             "metrics": db_stats,
+            "roles": sorted(process_roles),
             "routers": {
                 "registered_count": len(dp.sub_routers),
                 "router_names": [getattr(r, 'name', str(r)) for r in dp.sub_routers]
@@ -286,49 +316,111 @@ async def get_player_stats(player_id: str):
 @app.get("/api/stats")
 async def get_bot_stats():
     """Получить статистику бота"""
+    from workers import worker_queue, worker_supervisor
+    
     db_stats = await storage.get_stats()
     return {
         **db_stats,
+        "match_monitor": await match_monitor.get_stats(),
+        "webhook_queue": await webhook_queue.get_stats(),
+        "idempotency": idempotency.get_stats(),
+        "match_analysis": analysis_precomputer.get_stats(),
+        "telegram_sender": telegram_sender.get_stats(),
+        "worker_queues": await worker_queue.get_stats(),
+        "worker_pools": worker_supervisor.get_stats(),
+        "event_loop": loop_lag.get_stats(),
+        "roles": sorted(process_roles),
         "uptime": await storage.get_current_time(),
         "version": "2.1.4"
     }
 
+# События FACEIT, которые обрабатывает бот
+WEBHOOK_EVENTS = ("match_status_finished", "match_status_configuring", "match_status_ready")
+
+
 @app.post("/webhook/faceit")
 async def faceit_webhook(request: Request, data: dict):
-    """Webhook для уведомлений от FACEIT"""
+    """Webhook для уведомлений от FACEIT
+    
+    Событие только проверяется и ставится в очередь: обработка (запросы
+    к FACEIT API и отправка сообщений) выполняется потребителями очереди.
+    """
     try:
         # Проверка подписи webhook (базовая безопасность)
         await verify_webhook_signature(request, data)
-        logger.info(f"Received FACEIT webhook: {data.get('event', 'unknown')}")
         
-        # Обработка различных типов событий
         event_type = data.get("event")
+        match_id = (data.get("payload") or {}).get("id")
+        logger.info(f"Received FACEIT webhook: {event_type or 'unknown'}")
         
-        if event_type == "match_status_finished":
-            # Обработка завершенного матча
-            match_id = data.get("payload", {}).get("id")
-            if match_id:
-                await process_finished_match(match_id)
+        if event_type not in WEBHOOK_EVENTS or not match_id:
+            return {"status": "ignored"}
         
-        return {"status": "received"}
+        # Повторная доставка того же события не ставится в очередь второй раз
+        key = event_key(data.get("event_id") or data.get("transaction_id") or f"{event_type}:{match_id}")
+        if not await idempotency.begin(key):
+            logger.info(f"Duplicate FACEIT webhook {event_type} for match {match_id}")
+            return {"status": "duplicate"}
+        
+        try:
+            await webhook_queue.publish(data)
+        except Exception:
+            await idempotency.release(key)
+            raise
+        
+        await idempotency.complete(key)
+        return {"status": "queued"}
         
     except Exception as e:
+        # 5xx - FACEIT повторит доставку, событие не потеряется
         logger.error(f"Webhook error: {e}")
         return JSONResponse(
-            status_code=500,
-            content={"error": "Webhook processing failed"}
+            status_code=503,
+            content={"error": "Webhook queueing failed"}
         )
 
+
+async def handle_webhook_event(data: dict):
+    """Обработать событие из очереди webhook (исключение - повторить позже)"""
+    event_type = data.get("event")
+    payload = data.get("payload") or {}
+    
+    if event_type == "match_status_finished":
+        # Общий с мониторингом ключ: матч обрабатывается одним из путей
+        async with idempotency.claim(finished_match_key(payload["id"])) as acquired:
+            if not acquired:
+                logger.info(f"Match {payload['id']} already processed, skipping webhook event")
+                return
+            await process_finished_match(payload["id"])
+    
+    elif event_type in ("match_status_configuring", "match_status_ready"):
+        users = await find_roster_subscribers(payload)
+        if not users:
+            return
+        
+        if poll_scheduler:
+            # Матч начался - участников опрашиваем чаще до его окончания
+            for user in users:
+                await poll_scheduler.mark_live(user["user_id"])
+        
+        if settings.precompute_match_analysis:
+            # Анализ составов считается в фоне, к открытию меню он уже готов
+            analysis_precomputer.schedule(
+                payload["id"],
+                [user["user_id"] for user in users],
+                stage=event_type.rsplit("_", 1)[-1]
+            )
+
+
 async def process_finished_match(match_id: str):
     """Обработать завершенный матч и отправить уведомления"""
     try:
         logger.info(f"Processing finished match: {match_id}")
         
-        # Получаем детали матча
+        # Получаем детали матча (без них событие будет повторено из очереди)
         match_details = await faceit_client.get_match_details(match_id)
         if not match_details:
-            logger.warning(f"No match details found for match {match_id}")
-            return
+            raise RuntimeError(f"No match details found for match {match_id}")
         
         # Получаем статистику матча для более подробной информации
         match_stats = await faceit_client.get_match_stats(match_id)
@@ -338,6 +430,7 @@ async def process_finished_match(match_id: str):
         # Находим пользователей, которые участвовали в матче
         teams = match_details.get("teams", {})
         notified_users = 0
+        failed_users = []
         
         for team_name, team_data in teams.items():
             roster = team_data.get("roster", [])
@@ -377,6 +470,7 @@ async def process_finished_match(match_id: str):
                         "nickname": player.get("nickname"),
                         "sent_at": datetime.now().isoformat()
                     })
+                    await storage.advance_match_watermark(player_id, match_details.get("finished_at"), match_id)
                     
                     # Сохраняем матч в историю пользователя
                     if match_stats:
@@ -391,11 +485,39 @@ async def process_finished_match(match_id: str):
                     error_msg = str(notification_error)
                     logger.error(f"Failed to send notification to user {user_id}: {error_msg}")
                     await storage.save_notification_log(user_id, match_id, "failed", error_msg)
+                    failed_users.append(user_id)
+        
+        if failed_users:
+            # Матч не отмечается обработанным, событие повторяется из очереди;
+            # уже уведомленных пользователей пропустит is_match_notification_sent
+            raise RuntimeError(
+                f"Notifications for match {match_id} failed for users {failed_users} "
+                f"({notified_users} sent)"
+            )
         
         logger.info(f"Match {match_id} processing completed. Notifications sent to {notified_users} users")
         
     except Exception as e:
         logger.error(f"Error processing finished match {match_id}: {e}")
+        raise
+
+async def find_roster_subscribers(payload: dict) -> list:
+    """Подписчики бота из состава матча в событии webhook"""
+    # В webhook команды приходят списком, в API матчей - словарем faction1/faction2
+    teams = payload.get("teams", [])
+    if isinstance(teams, dict):
+        teams = list(teams.values())
+    
+    faceit_ids = [
+        player.get("id") or player.get("player_id")
+        for team_data in teams
+        for player in team_data.get("roster", [])
+    ]
+    faceit_ids = [faceit_id for faceit_id in faceit_ids if faceit_id]
+    if not faceit_ids:
+        return []
+    return await storage.get_users_by_faceit_ids(faceit_ids)
+
 
 async def send_match_notification(user_id: int, match_details: dict, match_stats: dict, user_faceit_id: str):
     """Отправить уведомление о завершенном матче"""
@@ -406,12 +528,14 @@ async def send_match_notification(user_id: int, match_details: dict, match_stats
         # Создаем клавиатуру с ссылкой на матч
         keyboard = create_match_keyboard(match_details)
         
-        await bot.send_message(
-            user_id, 
-            message_text,
-            parse_mode="HTML",
-            reply_markup=keyboard
-        )
+        # Уведомления уступают очередь ответам пользователям
+        with delivery_priority(NOTIFICATION):
+            await bot.send_message(
+                user_id, 
+                message_text,
+                parse_mode="HTML",
+                reply_markup=keyboard
+            )
         
     except Exception as e:
         logger.error(f"Error sending notification to user {user_id}: {e}")
@@ -662,31 +786,7 @@ async def verify_webhook_signature(request: Request, data: dict):
 async def match_monitoring_task():
     """Фоновая задача для периодической проверки новых матчей"""
     logger.info("🔍 Запуск задачи мониторинга матчей...")
-    
-    while True:
-        try:
-            # Ждем 5 минут между проверками
-            await asyncio.sleep(300)
-            
-            # Получаем всех пользователей с включенными уведомлениями
-            users_with_notifications = await storage.get_users_with_notifications()
-            if not users_with_notifications:
-                logger.debug("No users with notifications enabled")
-                continue
-            
-            logger.info(f"Checking matches for {len(users_with_notifications)} users")
-            
-            for user in users_with_notifications:
-                try:
-                    await check_user_new_matches(user)
-                except Exception as user_error:
-                    logger.error(f"Error checking matches for user {user.get('user_id')}: {user_error}")
-                    # Продолжаем проверку других пользователей
-                    
-        except Exception as e:
-            logger.error(f"Error in match monitoring task: {e}")
-            # При серьезной ошибке ждем дольше
-            await asyncio.sleep(600)
+    await match_monitor.run()
 
 
 async def check_user_new_matches(user: dict):
@@ -697,81 +797,150 @@ async def check_user_new_matches(user: dict):
         nickname = user.get('nickname', 'Unknown')
         
         if not faceit_id:
-            return
+            return None
         
-        # Получаем последние матчи игрока
-        history = await faceit_client.get_player_history(faceit_id, limit=5)
+        # Получаем последние матчи игрока (без кэша: частоту опроса задает расписание)
+        history = await faceit_client.get_player_history(faceit_id, limit=5, cache_ttl=0)
         if not history or not history.get('items'):
-            return
+            return None
         
-        # Получаем время последнего обработанного матча
-        last_processed_time = await storage.get_last_processed_match_time(faceit_id)
+        last_finished_at = max((m.get('finished_at') or 0 for m in history['items']), default=0)
+        
+        # Отметка последнего обработанного матча (MatchMonitor загружает
+        # отметки всей пачки одним HMGET и передает в user['watermark'])
+        if 'watermark' in user:
+            watermark = user['watermark']
+        else:
+            watermark = await storage.get_match_watermark(faceit_id)
         
         new_matches = []
-        for match in history['items']:
+        for match in sorted(history['items'], key=lambda m: (m.get('finished_at') or 0, m.get('match_id') or '')):
             match_finished_at = match.get('finished_at')
-            if not match_finished_at:
-                continue
-                
-            # Конвертируем timestamp в datetime
-            match_time = datetime.fromtimestamp(match_finished_at)
-            
-            # Если есть последнее время обработки, проверяем что матч новее
-            if last_processed_time and match_time <= last_processed_time:
-                continue
-                
-            # Проверяем что уведомление еще не отправлялось
             match_id = match.get('match_id')
-            if not match_id:
-                continue
-                
-            already_notified = await storage.is_match_notification_sent(match_id, user_id)
-            if already_notified:
+            if not match_finished_at or not match_id:
                 continue
-                
-            new_matches.append(match)
-        
-        # Обрабатываем новые матчи
-        for match in new_matches:
-            match_id = match.get('match_id')
-            logger.info(f"Processing new match {match_id} for user {nickname}")
             
-            # Получаем детали матча
-            match_details = await faceit_client.get_match_details(match_id)
-            if not match_details:
-                continue
-                
-            # Получаем статистику матча
-            match_stats = await faceit_client.get_match_stats(match_id)
-            if not match_stats:
-                logger.warning(f"No stats available for match {match_id}")
+            if watermark:
+                if not is_after_watermark(match_finished_at, match_id, watermark):
+                    continue
+            elif await storage.is_match_notification_sent(match_id, user_id):
+                # Отметки еще нет (нет сохраненных матчей) - проверяем по уведомлениям
                 continue
             
-            try:
-                # Отправляем уведомление
-                await send_match_notification(user_id, match_details, match_stats, faceit_id)
-                
-                # Отмечаем что уведомление отправлено
-                await storage.mark_match_notification_sent(match_id, user_id, {
-                    "match_id": match_id,
-                    "player_id": faceit_id,
-                    "nickname": nickname,
-                    "sent_at": datetime.now().isoformat()
-                })
-                
-                # Сохраняем матч в историю
-                await save_match_to_history(user_id, match_id, match_details, match_stats, faceit_id)
-                
-                await storage.save_notification_log(user_id, match_id, "sent")
-                logger.info(f"New match notification sent to {nickname} for match {match_id}")
-                
-            except Exception as notification_error:
-                error_msg = str(notification_error)
-                logger.error(f"Failed to send new match notification to {nickname}: {error_msg}")
-                await storage.save_notification_log(user_id, match_id, "failed", error_msg)
+            new_matches.append(match)
+        
+        # Результат для расписания опроса; сами матчи загружает и рассылает
+        # MatchMonitor - один раз на матч для всех пользователей прохода
+        return {
+            'last_finished_at': last_finished_at,
+            'new_matches': len(new_matches),
+            'new_match_ids': [match['match_id'] for match in new_matches]
+        }
     
     except Exception as e:
         logger.error(f"Error checking new matches for user {user.get('nickname', 'Unknown')}: {e}")
+        return None
+
+
+async def fetch_finished_match(match_id: str):
+    """Загрузить детали и статистику завершенного матча"""
+    match_details = await faceit_client.get_match_details(match_id)
+    if not match_details:
+        return None
+    
+    match_stats = await faceit_client.get_match_stats(match_id)
+    if not match_stats:
+        logger.warning(f"No stats available for match {match_id}")
+        return None
+    
+    return match_details, match_stats
+
+
+async def find_match_recipients(match_id: str, match: tuple) -> list:
+    """Подписчики из состава матча, которым уведомление о нем еще не отправлено"""
+    match_details, _ = match
+    faceit_ids = [
+        player.get('player_id')
+        for team_data in match_details.get('teams', {}).values()
+        for player in team_data.get('roster', [])
+    ]
+    
+    users = await storage.get_users_by_faceit_ids(faceit_ids)
+    watermarks = await storage.get_match_watermarks([user['faceit_id'] for user in users])
+    finished_at = match_details.get('finished_at') or 0
+    
+    return [
+        user for user in users
+        if is_after_watermark(finished_at, match_id, watermarks.get(user['faceit_id']))
+    ]
+
+
+async def notify_user_about_match(user: dict, match_id: str, match: tuple):
+    """Отправить пользователю уведомление о загруженном матче"""
+    user_id = user.get('user_id')
+    faceit_id = user.get('faceit_id')
+    nickname = user.get('nickname', 'Unknown')
+    match_details, match_stats = match
+    
+    logger.info(f"Processing new match {match_id} for user {nickname}")
+    
+    try:
+        # Отправляем уведомление
+        await send_match_notification(user_id, match_details, match_stats, faceit_id)
+        
+        # Отмечаем что уведомление отправлено
+        await storage.mark_match_notification_sent(match_id, user_id, {
+            "match_id": match_id,
+            "player_id": faceit_id,
+            "nickname": nickname,
+            "sent_at": datetime.now().isoformat()
+        })
+        await storage.advance_match_watermark(faceit_id, match_details.get('finished_at'), match_id)
+        
+        # Сохраняем матч в историю
+        await save_match_to_history(user_id, match_id, match_details, match_stats, faceit_id)
+        
+        await storage.save_notification_log(user_id, match_id, "sent")
+        logger.info(f"New match notification sent to {nickname} for match {match_id}")
+        
+    except Exception as notification_error:
+        error_msg = str(notification_error)
+        logger.error(f"Failed to send new match notification to {nickname}: {error_msg}")
+        await storage.save_notification_log(user_id, match_id, "failed", error_msg)
+        # Мониторинг не отметит матч обработанным и повторит его на следующем проходе
+        raise
+
+idempotency = IdempotencyStore(storage, ttl=settings.idempotency_ttl)
+
+poll_scheduler = PollScheduler(
+    storage,
+    polls_per_second=settings.poll_budget_per_second,
+    live_interval=settings.poll_live_interval,
+    active_interval=settings.poll_active_interval,
+    base_interval=settings.monitor_interval,
+    max_interval=settings.poll_max_interval
+) if settings.adaptive_polling else None
+
+match_monitor = MatchMonitor(
+    storage,
+    check_user_new_matches,
+    fetch_match=fetch_finished_match,
+    notify_user=notify_user_about_match,
+    match_recipients=find_match_recipients,
+    interval=settings.monitor_interval,
+    concurrency=settings.monitor_concurrency,
+    shard_size=settings.monitor_shard_size,
+    scheduler=poll_scheduler,
+    idempotency=idempotency
+)
+
+
+webhook_queue = WebhookEventQueue(
+    storage,
+    handle_webhook_event,
+    consumers=settings.webhook_consumers,
+    max_attempts=settings.webhook_max_attempts
+)
 
 
 async def start_polling():
@@ -796,17 +965,25 @@ async def start_polling():
     finally:
         await bot.session.close()
 
-# Точка входа
+# Точка входа: python main.py [all | bot,api,monitor,workers]
 if __name__ == "__main__":
     try:
-        uvicorn.run(
-            "main:app",
-            host="0.0.0.0",
-            port=8000,
-            reload=settings.debug,
-            log_level="info"
-        )
+        if len(sys.argv) > 1:
+            process_roles = parse_roles(sys.argv[1], settings.worker_queue_backend)
+            # uvicorn импортирует main заново (а с reload - в подпроцессе)
+            settings.roles = os.environ['ROLES'] = ','.join(sorted(process_roles))
+        
+        if 'api' in process_roles:
+            uvicorn.run(
+                "main:app",
+                host="0.0.0.0",
+                port=8000,
+                reload=settings.debug,
+                log_level="info"
+            )
+        else:
+            asyncio.run(run_headless(process_roles))
     except KeyboardInterrupt:
         logger.info("🛑 Остановка по запросу пользователя")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
\ No newline at end of file
+        logger.error(f"Критическая ошибка: {e}")
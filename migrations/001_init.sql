@@ -1,11 +1,14 @@
 -- FACEIT CS2 Bot Database Schema
 -- Инициализация базы данных PostgreSQL
+--
+-- Миграция идемпотентна: она же приводит к этой схеме базы, созданные
+-- прежним DatabaseStorage._create_tables при старте бота.
 
 -- Создание расширений
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 
 -- Таблица пользователей бота
-CREATE TABLE users (
+CREATE TABLE IF NOT EXISTS users (
     user_id BIGINT PRIMARY KEY,
     faceit_id VARCHAR(255) UNIQUE NOT NULL,
     nickname VARCHAR(255) NOT NULL,
@@ -16,13 +19,16 @@ CREATE TABLE users (
     CONSTRAINT users_faceit_id_unique UNIQUE (faceit_id)
 );
 
+-- Базы, созданные _create_tables, не имели колонки last_activity
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
 -- Индексы для таблицы users
-CREATE INDEX idx_users_faceit_id ON users(faceit_id);
-CREATE INDEX idx_users_nickname ON users(nickname);
-CREATE INDEX idx_users_last_activity ON users(last_activity);
+CREATE INDEX IF NOT EXISTS idx_users_faceit_id ON users(faceit_id);
+CREATE INDEX IF NOT EXISTS idx_users_nickname ON users(nickname);
+CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users(last_activity);
 
 -- Таблица настроек пользователей
-CREATE TABLE user_settings (
+CREATE TABLE IF NOT EXISTS user_settings (
     user_id BIGINT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
     notifications BOOLEAN DEFAULT true,
     language VARCHAR(5) DEFAULT 'ru',
@@ -31,7 +37,7 @@ CREATE TABLE user_settings (
 );
 
 -- Таблица истории матчей
-CREATE TABLE match_history (
+CREATE TABLE IF NOT EXISTS match_history (
     match_id VARCHAR(255) PRIMARY KEY,
     user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
     finished_at TIMESTAMP WITH TIME ZONE NOT NULL,
@@ -59,13 +65,13 @@ CREATE TABLE match_history (
 );
 
 -- Индексы для таблицы match_history
-CREATE INDEX idx_match_history_user_id ON match_history(user_id);
-CREATE INDEX idx_match_history_finished_at ON match_history(finished_at);
-CREATE INDEX idx_match_history_map_name ON match_history(map_name);
-CREATE INDEX idx_match_history_user_finished ON match_history(user_id, finished_at DESC);
+CREATE INDEX IF NOT EXISTS idx_match_history_user_id ON match_history(user_id);
+CREATE INDEX IF NOT EXISTS idx_match_history_finished_at ON match_history(finished_at);
+CREATE INDEX IF NOT EXISTS idx_match_history_map_name ON match_history(map_name);
+CREATE INDEX IF NOT EXISTS idx_match_history_user_finished ON match_history(user_id, finished_at DESC);
 
 -- Таблица списков сравнения игроков
-CREATE TABLE comparison_lists (
+CREATE TABLE IF NOT EXISTS comparison_lists (
     id SERIAL PRIMARY KEY,
     user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
     player_faceit_id VARCHAR(255) NOT NULL,
@@ -77,11 +83,26 @@ CREATE TABLE comparison_lists (
 );
 
 -- Индексы для таблицы comparison_lists
-CREATE INDEX idx_comparison_lists_user_id ON comparison_lists(user_id);
-CREATE INDEX idx_comparison_lists_added_at ON comparison_lists(added_at);
+CREATE INDEX IF NOT EXISTS idx_comparison_lists_user_id ON comparison_lists(user_id);
+CREATE INDEX IF NOT EXISTS idx_comparison_lists_added_at ON comparison_lists(added_at);
+
+-- _create_tables создавал user_sessions как key-value хранилище (session_id, data),
+-- которое код не использовал. Переименовываем его, чтобы создать нужную схему.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'user_sessions' AND column_name = 'session_id'
+    ) THEN
+        ALTER TABLE user_sessions RENAME TO user_sessions_legacy;
+        ALTER INDEX IF EXISTS user_sessions_pkey RENAME TO user_sessions_legacy_pkey;
+        DROP INDEX IF EXISTS idx_user_sessions_user_id;
+        DROP INDEX IF EXISTS idx_user_sessions_expires_at;
+    END IF;
+END $$;
 
 -- Таблица сессий пользователей (для анализа активности)
-CREATE TABLE user_sessions (
+CREATE TABLE IF NOT EXISTS user_sessions (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
     session_start TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -99,12 +120,12 @@ CREATE TABLE user_sessions (
 );
 
 -- Индексы для таблицы user_sessions
-CREATE INDEX idx_user_sessions_user_id ON user_sessions(user_id);
-CREATE INDEX idx_user_sessions_start ON user_sessions(session_start);
-CREATE INDEX idx_user_sessions_active ON user_sessions(user_id) WHERE session_end IS NULL;
+CREATE INDEX IF NOT EXISTS idx_user_sessions_user_id ON user_sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_start ON user_sessions(session_start);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_active ON user_sessions(user_id) WHERE session_end IS NULL;
 
 -- Таблица кэша FACEIT данных (для уменьшения нагрузки на API)
-CREATE TABLE faceit_cache (
+CREATE TABLE IF NOT EXISTS faceit_cache (
     cache_key VARCHAR(500) PRIMARY KEY,
     data JSONB NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -112,11 +133,11 @@ CREATE TABLE faceit_cache (
 );
 
 -- Индексы для таблицы faceit_cache
-CREATE INDEX idx_faceit_cache_expires ON faceit_cache(expires_at);
-CREATE INDEX idx_faceit_cache_created ON faceit_cache(created_at);
+CREATE INDEX IF NOT EXISTS idx_faceit_cache_expires ON faceit_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_faceit_cache_created ON faceit_cache(created_at);
 
 -- Таблица для отслеживания матчей (для уведомлений)
-CREATE TABLE tracked_matches (
+CREATE TABLE IF NOT EXISTS tracked_matches (
     user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
     last_match_id VARCHAR(255),
     last_check TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -142,18 +163,20 @@ END;
 $$ LANGUAGE plpgsql;
 
 -- Триггеры для автоматического обновления last_activity
+DROP TRIGGER IF EXISTS trigger_update_activity_match_history ON match_history;
 CREATE TRIGGER trigger_update_activity_match_history
     AFTER INSERT ON match_history
     FOR EACH ROW
     EXECUTE FUNCTION update_user_activity();
 
+DROP TRIGGER IF EXISTS trigger_update_activity_sessions ON user_sessions;
 CREATE TRIGGER trigger_update_activity_sessions
     AFTER INSERT OR UPDATE ON user_sessions
     FOR EACH ROW
     EXECUTE FUNCTION update_user_activity();
 
 -- Создание индекса для JSONB данных в кэше
-CREATE INDEX idx_faceit_cache_data_gin ON faceit_cache USING GIN (data);
+CREATE INDEX IF NOT EXISTS idx_faceit_cache_data_gin ON faceit_cache USING GIN (data);
 
 -- Вставка тестовых данных (можно удалить в продакшене)
 -- INSERT INTO users (user_id, faceit_id, nickname) 
@@ -0,0 +1,22 @@
+-- FACEIT CS2 Bot - Keyset pagination for match_history
+-- Покрывающий индекс для постраничного чтения истории матчей
+
+-- Расширяем idx_match_history_user_finished: match_id замыкает ключ сортировки
+-- (стабильный порядок для курсора), а INCLUDE добавляет колонки, которые
+-- читают форматтеры, чтобы страница отдавалась index-only сканом.
+DROP INDEX IF EXISTS idx_match_history_user_finished;
+
+CREATE INDEX IF NOT EXISTS idx_match_history_user_finished
+    ON match_history (user_id, finished_at DESC, match_id DESC)
+    INCLUDE (result, kills, deaths, assists, adr, hltv_rating,
+             headshot_percentage, map_name, score_team1, score_team2, rounds_played);
+
+-- Индекс по одному user_id полностью перекрывается составным
+DROP INDEX IF EXISTS idx_match_history_user_id;
+
+-- Обновляем статистику планировщика под новый индекс
+ANALYZE match_history;
+
+COMMENT ON INDEX idx_match_history_user_finished IS 'Keyset-пагинация истории: (user_id, finished_at, match_id) + колонки форматтеров';
+
+SELECT 'Match history keyset index created successfully!' as message;
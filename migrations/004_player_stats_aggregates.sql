@@ -0,0 +1,55 @@
+-- FACEIT CS2 Bot - Per-user aggregate statistics
+-- Дневные агрегаты статистики игрока по картам, обновляются в save_match
+
+CREATE TABLE IF NOT EXISTS player_stats_daily (
+    user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    map_name VARCHAR(100) NOT NULL DEFAULT 'Unknown',
+
+    -- Накопительные суммы
+    matches INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    kills INTEGER NOT NULL DEFAULT 0,
+    deaths INTEGER NOT NULL DEFAULT 0,
+    assists INTEGER NOT NULL DEFAULT 0,
+    headshots INTEGER NOT NULL DEFAULT 0,
+    rounds_played INTEGER NOT NULL DEFAULT 0,
+    adr_sum FLOAT NOT NULL DEFAULT 0.0,
+    rating_sum FLOAT NOT NULL DEFAULT 0.0,
+
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (user_id, day, map_name)
+);
+
+-- Выборки "с даты" для пользователя идут по префиксу первичного ключа,
+-- отдельный индекс нужен для итогов по карте за все время
+CREATE INDEX IF NOT EXISTS idx_player_stats_daily_user_map ON player_stats_daily(user_id, map_name);
+
+-- Заполняем агрегаты из уже сохраненной истории
+INSERT INTO player_stats_daily (
+    user_id, day, map_name, matches, wins, losses,
+    kills, deaths, assists, headshots, rounds_played, adr_sum, rating_sum
+)
+SELECT
+    user_id,
+    (finished_at AT TIME ZONE 'UTC')::date,
+    COALESCE(map_name, 'Unknown'),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE result = 'win'),
+    COUNT(*) FILTER (WHERE result = 'loss'),
+    COALESCE(SUM(kills), 0),
+    COALESCE(SUM(deaths), 0),
+    COALESCE(SUM(assists), 0),
+    COALESCE(SUM(headshots), 0),
+    COALESCE(SUM(rounds_played), 0),
+    COALESCE(SUM(adr), 0),
+    COALESCE(SUM(hltv_rating), 0)
+FROM match_history
+GROUP BY user_id, (finished_at AT TIME ZONE 'UTC')::date, COALESCE(map_name, 'Unknown')
+ON CONFLICT (user_id, day, map_name) DO NOTHING;
+
+COMMENT ON TABLE player_stats_daily IS 'Накопительная статистика игрока по дням и картам (поддерживается save_match)';
+
+SELECT 'Player stats aggregates created successfully!' as message;
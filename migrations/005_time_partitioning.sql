@@ -0,0 +1,266 @@
+-- FACEIT CS2 Bot - Monthly range partitioning
+-- match_history, match_notifications и notification_logs разбиваются на
+-- помесячные партиции. Очистка старых данных удаляет партицию целиком
+-- вместо построчных DELETE, а индексы горячего месяца остаются маленькими.
+
+-- === ФУНКЦИИ УПРАВЛЕНИЯ ПАРТИЦИЯМИ ===
+
+-- Партиции называются <таблица>_pYYYYMM и покрывают ровно один месяц (UTC)
+CREATE OR REPLACE FUNCTION create_monthly_partition(parent_table TEXT, month_start DATE)
+RETURNS BOOLEAN AS $$
+DECLARE
+    start_date DATE := date_trunc('month', month_start)::date;
+    end_date DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    partition_name TEXT := format('%s_p%s', parent_table, to_char(start_date, 'YYYYMM'));
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN FALSE;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, parent_table,
+        to_char(start_date, 'YYYY-MM-DD') || ' 00:00:00+00',
+        to_char(end_date, 'YYYY-MM-DD') || ' 00:00:00+00'
+    );
+    RETURN TRUE;
+EXCEPTION WHEN others THEN
+    -- Например, в DEFAULT-партиции уже лежат строки этого месяца
+    RAISE WARNING 'Не удалось создать партицию %: %', partition_name, SQLERRM;
+    RETURN FALSE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Создать партиции для всех месяцев диапазона, возвращает число созданных
+CREATE OR REPLACE FUNCTION create_monthly_partitions(parent_table TEXT, from_ts TIMESTAMPTZ, to_ts TIMESTAMPTZ)
+RETURNS INTEGER AS $$
+DECLARE
+    month_cursor DATE := date_trunc('month', from_ts AT TIME ZONE 'UTC')::date;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_cursor <= (to_ts AT TIME ZONE 'UTC')::date LOOP
+        IF create_monthly_partition(parent_table, month_cursor) THEN
+            created := created + 1;
+        END IF;
+        month_cursor := (month_cursor + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Текущий месяц и months_ahead следующих (вызывается периодически из бота)
+CREATE OR REPLACE FUNCTION ensure_monthly_partitions(parent_table TEXT, months_ahead INTEGER DEFAULT 2)
+RETURNS INTEGER AS $$
+BEGIN
+    RETURN create_monthly_partitions(parent_table, NOW(), NOW() + make_interval(months => months_ahead));
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удалить партиции, месяц которых целиком старше older_than
+CREATE OR REPLACE FUNCTION drop_expired_partitions(parent_table TEXT, older_than INTERVAL)
+RETURNS INTEGER AS $$
+DECLARE
+    child RECORD;
+    month_start DATE;
+    dropped INTEGER := 0;
+BEGIN
+    FOR child IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = parent_table
+          AND c.relname ~ '_p[0-9]{6}$'
+    LOOP
+        month_start := to_date(right(child.relname, 6), 'YYYYMM');
+        IF (month_start + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC' <= NOW() - older_than THEN
+            EXECUTE format('DROP TABLE %I', child.relname);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- === MATCH_HISTORY ===
+
+DO $$
+DECLARE
+    bounds RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('match_history')) = 'r' THEN
+        ALTER TABLE match_history RENAME TO match_history_legacy;
+        ALTER INDEX IF EXISTS match_history_pkey RENAME TO match_history_legacy_pkey;
+        DROP INDEX IF EXISTS idx_match_history_user_id;
+        DROP INDEX IF EXISTS idx_match_history_finished_at;
+        DROP INDEX IF EXISTS idx_match_history_map_name;
+        DROP INDEX IF EXISTS idx_match_history_user_finished;
+
+        CREATE TABLE match_history (
+            match_id VARCHAR(255) NOT NULL,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            finished_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            result VARCHAR(10) NOT NULL CHECK (result IN ('win', 'loss')),
+
+            kills INTEGER DEFAULT 0,
+            deaths INTEGER DEFAULT 0,
+            assists INTEGER DEFAULT 0,
+            adr FLOAT DEFAULT 0.0,
+            hltv_rating FLOAT DEFAULT 0.0,
+            headshots INTEGER DEFAULT 0,
+            headshot_percentage FLOAT DEFAULT 0.0,
+
+            map_name VARCHAR(100),
+            score_team1 INTEGER DEFAULT 0,
+            score_team2 INTEGER DEFAULT 0,
+            rounds_played INTEGER DEFAULT 0,
+
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+            -- Ключ партиционирования обязан входить в первичный ключ
+            PRIMARY KEY (match_id, finished_at)
+        ) PARTITION BY RANGE (finished_at);
+
+        CREATE TABLE match_history_default PARTITION OF match_history DEFAULT;
+
+        SELECT MIN(finished_at) AS min_ts, MAX(finished_at) AS max_ts INTO bounds FROM match_history_legacy;
+        IF bounds.min_ts IS NOT NULL THEN
+            PERFORM create_monthly_partitions('match_history', bounds.min_ts, bounds.max_ts);
+        END IF;
+        PERFORM ensure_monthly_partitions('match_history', 2);
+
+        INSERT INTO match_history SELECT
+            match_id, user_id, finished_at, result, kills, deaths, assists, adr, hltv_rating,
+            headshots, headshot_percentage, map_name, score_team1, score_team2, rounds_played, created_at
+        FROM match_history_legacy;
+
+        DROP TABLE match_history_legacy;
+    END IF;
+END $$;
+
+-- Индексы создаются на родителе и наследуются всеми партициями
+CREATE INDEX IF NOT EXISTS idx_match_history_user_finished
+    ON match_history (user_id, finished_at DESC, match_id DESC)
+    INCLUDE (result, kills, deaths, assists, adr, hltv_rating,
+             headshot_percentage, map_name, score_team1, score_team2, rounds_played);
+CREATE INDEX IF NOT EXISTS idx_match_history_match_id ON match_history(match_id);
+CREATE INDEX IF NOT EXISTS idx_match_history_map_name ON match_history(map_name);
+
+-- Триггер из 001_init.sql оставался на старой таблице
+DROP TRIGGER IF EXISTS trigger_update_activity_match_history ON match_history;
+CREATE TRIGGER trigger_update_activity_match_history
+    AFTER INSERT ON match_history
+    FOR EACH ROW
+    EXECUTE FUNCTION update_user_activity();
+
+
+-- === MATCH_NOTIFICATIONS ===
+
+DO $$
+DECLARE
+    bounds RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('match_notifications')) = 'r' THEN
+        ALTER TABLE match_notifications RENAME TO match_notifications_legacy;
+        ALTER INDEX IF EXISTS match_notifications_pkey RENAME TO match_notifications_legacy_pkey;
+        ALTER TABLE match_notifications_legacy DROP CONSTRAINT IF EXISTS unique_match_notification;
+        ALTER SEQUENCE IF EXISTS match_notifications_id_seq RENAME TO match_notifications_legacy_id_seq;
+        DROP INDEX IF EXISTS idx_match_notifications_match_id;
+        DROP INDEX IF EXISTS idx_match_notifications_user_id;
+        DROP INDEX IF EXISTS idx_match_notifications_sent_at;
+
+        -- Уникальность (match_id, user_id) без sent_at на партиционированной
+        -- таблице невозможна: дедупликацию обеспечивает INSERT ... WHERE NOT EXISTS
+        CREATE TABLE match_notifications (
+            id BIGSERIAL,
+            match_id VARCHAR(255) NOT NULL,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            sent_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+            match_data JSONB,
+
+            PRIMARY KEY (id, sent_at)
+        ) PARTITION BY RANGE (sent_at);
+
+        CREATE TABLE match_notifications_default PARTITION OF match_notifications DEFAULT;
+
+        SELECT MIN(sent_at) AS min_ts, MAX(sent_at) AS max_ts INTO bounds FROM match_notifications_legacy;
+        IF bounds.min_ts IS NOT NULL THEN
+            PERFORM create_monthly_partitions('match_notifications', bounds.min_ts, bounds.max_ts);
+        END IF;
+        PERFORM ensure_monthly_partitions('match_notifications', 2);
+
+        INSERT INTO match_notifications (id, match_id, user_id, sent_at, match_data)
+        SELECT id, match_id, user_id, COALESCE(sent_at, NOW()), match_data FROM match_notifications_legacy;
+        PERFORM setval(pg_get_serial_sequence('match_notifications', 'id'),
+                       COALESCE((SELECT MAX(id) FROM match_notifications), 0) + 1, false);
+
+        DROP TABLE match_notifications_legacy;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_match_notifications_match_user ON match_notifications(match_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_match_notifications_user_id ON match_notifications(user_id);
+
+
+-- === NOTIFICATION_LOGS ===
+
+DO $$
+DECLARE
+    bounds RECORD;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('notification_logs')) = 'r' THEN
+        ALTER TABLE notification_logs RENAME TO notification_logs_legacy;
+        ALTER INDEX IF EXISTS notification_logs_pkey RENAME TO notification_logs_legacy_pkey;
+        ALTER SEQUENCE IF EXISTS notification_logs_id_seq RENAME TO notification_logs_legacy_id_seq;
+        DROP INDEX IF EXISTS idx_notification_logs_user_id;
+        DROP INDEX IF EXISTS idx_notification_logs_match_id;
+        DROP INDEX IF EXISTS idx_notification_logs_status;
+        DROP INDEX IF EXISTS idx_notification_logs_created_at;
+
+        CREATE TABLE notification_logs (
+            id BIGSERIAL,
+            user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+            match_id VARCHAR(255),
+            status VARCHAR(50) NOT NULL, -- 'sent', 'failed', 'skipped'
+            error_message TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        CREATE TABLE notification_logs_default PARTITION OF notification_logs DEFAULT;
+
+        SELECT MIN(created_at) AS min_ts, MAX(created_at) AS max_ts INTO bounds FROM notification_logs_legacy;
+        IF bounds.min_ts IS NOT NULL THEN
+            PERFORM create_monthly_partitions('notification_logs', bounds.min_ts, bounds.max_ts);
+        END IF;
+        PERFORM ensure_monthly_partitions('notification_logs', 2);
+
+        INSERT INTO notification_logs (id, user_id, match_id, status, error_message, created_at)
+        SELECT id, user_id, match_id, status, error_message, COALESCE(created_at, NOW()) FROM notification_logs_legacy;
+        PERFORM setval(pg_get_serial_sequence('notification_logs', 'id'),
+                       COALESCE((SELECT MAX(id) FROM notification_logs), 0) + 1, false);
+
+        DROP TABLE notification_logs_legacy;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_notification_logs_user_id ON notification_logs(user_id);
+CREATE INDEX IF NOT EXISTS idx_notification_logs_match_id ON notification_logs(match_id);
+CREATE INDEX IF NOT EXISTS idx_notification_logs_status ON notification_logs(status);
+
+
+-- Очистка теперь удаляет партиции целиком
+CREATE OR REPLACE FUNCTION clean_old_notifications(days INTEGER DEFAULT 30)
+RETURNS INTEGER AS $$
+BEGIN
+    RETURN drop_expired_partitions('match_notifications', make_interval(days => days))
+         + drop_expired_partitions('notification_logs', make_interval(days => days));
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION ensure_monthly_partitions(TEXT, INTEGER) IS 'Создает партиции текущего и следующих месяцев';
+COMMENT ON FUNCTION drop_expired_partitions(TEXT, INTERVAL) IS 'Удаляет помесячные партиции старше заданного интервала';
+
+SELECT 'Time partitioning applied successfully!' as message;
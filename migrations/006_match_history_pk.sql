@@ -0,0 +1,9 @@
+-- FACEIT CS2 Bot - match_history primary key per player
+-- 005 создавала ключ (match_id, finished_at): второй отслеживаемый игрок
+-- того же матча перезаписывал строку первого, а save_match переносил
+-- разницу статистики в дневные агрегаты другого пользователя.
+-- У каждого игрока матча теперь своя строка.
+
+ALTER TABLE match_history
+    DROP CONSTRAINT IF EXISTS match_history_pkey,
+    ADD PRIMARY KEY (match_id, user_id, finished_at);
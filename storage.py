@@ -26,7 +26,12 @@ async def init_storage():
                 logger.info(f"🔄 Попытка подключения к БД {attempt}/{max_retries}")
                 
                 # Подключаемся к базам данных
-                await storage.connect(settings.database_url, settings.redis_url)
+                await storage.connect(
+                    settings.database_url,
+                    settings.redis_url,
+                    run_migrations=settings.run_migrations_on_startup,
+                    pool_size=settings.database_pool_size
+                )
                 
                 logger.info("✅ Storage initialized successfully")
                 return
@@ -59,7 +64,10 @@ async def cleanup_storage_task():
         try:
             await asyncio.sleep(1800)  # Каждые 30 минут
             await storage.cleanup_expired_cache()
-            await storage.cleanup_old_notifications(30)  # Очищаем уведомления старше 30 дней
+            await storage.ensure_partitions()
+            await storage.cleanup_old_notifications(settings.notification_retention_days)
+            if settings.match_history_retention_days:
+                await storage.cleanup_old_matches(settings.match_history_retention_days)
             logger.info("Cache and notifications cleanup task completed")
         except Exception as e:
             logger.error(f"Error in cleanup task: {e}")
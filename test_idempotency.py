@@ -0,0 +1,50 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.idempotency import IdempotencyStore, KEY_PREFIX, finished_match_key
+
+
+def make_store(set_result=True):
+    """Хранилище ключей с замоканным Redis"""
+    storage = MagicMock()
+    storage.redis = AsyncMock()
+    storage.redis.set.return_value = set_result
+    return IdempotencyStore(storage, ttl=3600, processing_ttl=60), storage.redis
+
+
+class TestIdempotencyStore:
+    """Тесты окна дедупликации"""
+
+    @pytest.mark.asyncio
+    async def test_begin_uses_set_nx(self):
+        """Ключ занимается атомарно с коротким TTL"""
+        store, redis = make_store()
+
+        assert await store.begin(finished_match_key("1-abc"))
+        redis.set.assert_awaited_once_with(
+            KEY_PREFIX + "match:1-abc:finished", "processing", nx=True, ex=60
+        )
+
+    @pytest.mark.asyncio
+    async def test_duplicate_is_rejected(self):
+        """Занятый ключ означает дубликат"""
+        store, _ = make_store(set_result=None)
+
+        async with store.claim("event:42") as acquired:
+            assert not acquired
+
+        assert store.get_stats() == {'acquired': 0, 'duplicates': 1}
+
+    @pytest.mark.asyncio
+    async def test_claim_completes_or_releases(self):
+        """Успех фиксирует ключ на окно, ошибка освобождает его"""
+        store, redis = make_store()
+
+        async with store.claim("event:1"):
+            pass
+        redis.set.assert_awaited_with(KEY_PREFIX + "event:1", "done", ex=3600)
+
+        with pytest.raises(RuntimeError):
+            async with store.claim("event:2"):
+                raise RuntimeError("FACEIT API error")
+        redis.delete.assert_awaited_once_with(KEY_PREFIX + "event:2")
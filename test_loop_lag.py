@@ -0,0 +1,20 @@
+import pytest
+
+from bot.services.loop_lag import LoopLagMonitor
+
+
+class TestLoopLagMonitor:
+    """Тесты замера задержки цикла событий"""
+
+    def test_stats_and_stalls(self):
+        """p95/max по окну замеров, долгие задержки считаются отдельно"""
+        monitor = LoopLagMonitor(window=20, warn_ms=200)
+        for lag in [1.0] * 18 + [50.0, 300.0]:
+            monitor.record(lag)
+        monitor.record(-0.2)
+
+        stats = monitor.get_stats()
+        assert stats['last_ms'] == 0.0
+        assert stats['p95_ms'] == 50.0
+        assert stats['max_ms'] == 300.0
+        assert stats['stalls'] == 1
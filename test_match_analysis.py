@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.match_analysis import MatchAnalysisPrecomputer, match_analysis_key, user_match_key
+
+
+def make_storage(lock_acquired=True, cached=None):
+    """Хранилище с замоканным кэшем и Redis"""
+    storage = MagicMock()
+    storage.redis = AsyncMock()
+    storage.redis.set.return_value = lock_acquired
+    storage.get_cached_data = AsyncMock(return_value=cached)
+    storage.set_cached_data = AsyncMock()
+    return storage
+
+
+def cached_keys(storage):
+    return [call.args[0] for call in storage.set_cached_data.await_args_list]
+
+
+class TestMatchAnalysisPrecomputer:
+    """Тесты фонового расчета анализа матча"""
+
+    @pytest.mark.asyncio
+    async def test_schedule_stores_under_match_and_users(self):
+        """Результат кладется под match_id и подписчикам из состава"""
+        storage = make_storage()
+        analyze = AsyncMock(return_value={'match_info': {'match_id': '1-abc'}})
+        precomputer = MatchAnalysisPrecomputer(storage, analyze)
+
+        precomputer.schedule('1-abc', [10, 20])
+        await asyncio.gather(*precomputer._tasks.values())
+
+        analyze.assert_awaited_once_with('1-abc')
+        assert sorted(cached_keys(storage)) == sorted([
+            match_analysis_key('1-abc'), user_match_key(10), user_match_key(20)
+        ])
+        assert precomputer.get_stats()['precomputed'] == 1
+
+    @pytest.mark.asyncio
+    async def test_user_request_joins_running_precompute(self):
+        """Ссылка, вставленная во время расчета, ждет ту же задачу"""
+        storage = make_storage()
+        release = asyncio.Event()
+
+        async def analyze(match_id):
+            await release.wait()
+            return {'match_id': match_id}
+
+        analyze_mock = AsyncMock(side_effect=analyze)
+        precomputer = MatchAnalysisPrecomputer(storage, analyze_mock)
+
+        precomputer.schedule('1-abc', [10])
+        waiter = asyncio.create_task(precomputer.get_or_compute('1-abc'))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert await waiter == {'match_id': '1-abc'}
+        assert analyze_mock.await_count == 1
+        assert precomputer.get_stats()['joined_in_flight'] == 1
+
+    @pytest.mark.asyncio
+    async def test_ready_during_configuring_recomputes(self):
+        """Событие ready во время расчета configuring пересчитывает анализ после него"""
+        storage = make_storage()
+        release = asyncio.Event()
+
+        async def analyze(match_id):
+            await release.wait()
+            return {'match_id': match_id}
+
+        analyze_mock = AsyncMock(side_effect=analyze)
+        precomputer = MatchAnalysisPrecomputer(storage, analyze_mock)
+
+        precomputer.schedule('1-abc', [10], stage='configuring')
+        precomputer.schedule('1-abc', [20], stage='ready')
+        release.set()
+
+        while precomputer._tasks:
+            await asyncio.gather(*precomputer._tasks.values())
+            await asyncio.sleep(0)
+
+        assert analyze_mock.await_count == 2
+        assert precomputer.get_stats()['scheduled'] == 2
+
+    @pytest.mark.asyncio
+    async def test_stage_taken_by_other_replica_is_skipped(self):
+        """Если этап посчитала другая реплика, готовый анализ только раздается"""
+        storage = make_storage(lock_acquired=None, cached={'match_id': '1-abc'})
+        analyze = AsyncMock()
+        precomputer = MatchAnalysisPrecomputer(storage, analyze)
+
+        precomputer.schedule('1-abc', [10])
+        await asyncio.gather(*precomputer._tasks.values())
+
+        analyze.assert_not_awaited()
+        assert cached_keys(storage) == [user_match_key(10)]
+        assert precomputer.get_stats()['skipped'] == 1
+
+    @pytest.mark.asyncio
+    async def test_user_pointer_resolves_shared_analysis(self):
+        """Пользователю хранится только match_id, анализ читается из общей записи"""
+        analysis = {'match_info': {'status': 'ONGOING'}, 'analyzed_at': datetime.now().isoformat()}
+        storage = make_storage()
+        storage.get_cached_data.side_effect = lambda key, **kwargs: (
+            {'match_id': '1-abc'} if key == user_match_key(10) else analysis
+        )
+        analyze = AsyncMock()
+        precomputer = MatchAnalysisPrecomputer(storage, analyze)
+
+        await precomputer.set_user_match(10, '1-abc')
+        storage.set_cached_data.assert_awaited_once_with(user_match_key(10), {'match_id': '1-abc'}, ttl_minutes=30)
+
+        assert await precomputer.get_user_analysis(10) is analysis
+        # Второй экран анализа не идет в Redis за той же записью
+        assert await precomputer.get_user_analysis(10) is analysis
+        assert precomputer.get_stats()['local_hits'] == 1
+        analyze.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_refresh_skips_fresh_and_uses_live_ttl(self):
+        """Свежий анализ не пересчитывается, анализ идущего матча хранится коротко"""
+        storage = make_storage(cached={'match_info': {'status': 'ONGOING'}, 'analyzed_at': datetime.now().isoformat()})
+        analyze = AsyncMock(return_value={'match_info': {'status': 'ONGOING'}})
+        precomputer = MatchAnalysisPrecomputer(storage, analyze, ttl_minutes=30, live_ttl_minutes=5)
+
+        await precomputer.refresh('1-abc')
+        analyze.assert_not_awaited()
+
+        storage.get_cached_data.return_value = {'match_info': {'status': 'ONGOING'}, 'analyzed_at': '2020-01-01T00:00:00'}
+        precomputer._local.clear()
+        await precomputer.refresh('1-abc')
+        analyze.assert_awaited_once()
+        storage.set_cached_data.assert_awaited_once_with(
+            match_analysis_key('1-abc'), {'match_info': {'status': 'ONGOING'}}, ttl_minutes=5
+        )
+
+
+class TestTeamRosterFetch:
+    """Тесты параллельной загрузки составов"""
+
+    @pytest.mark.asyncio
+    async def test_players_fetched_concurrently_with_progress(self, monkeypatch):
+        """Игроки команды запрашиваются параллельно, прогресс приходит по каждому"""
+        from bot.handlers import current_match_handler
+
+        async def slow_details(player_id):
+            await asyncio.sleep(0.05)
+            return {'player_id': player_id}
+
+        client = MagicMock()
+        client.get_player_details = AsyncMock(side_effect=slow_details)
+        client.get_player_stats = AsyncMock(return_value={'lifetime': {}})
+        client.format_player_stats = MagicMock(side_effect=lambda details, stats: {'nickname': details['player_id']})
+        monkeypatch.setattr(current_match_handler, 'faceit_client', client)
+
+        team = {'players': [{'player_id': f"p{i}", 'nickname': f"p{i}"} for i in range(5)]}
+        progress = AsyncMock()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        stats = await current_match_handler.get_team_players_stats(team, progress)
+
+        assert loop.time() - started < 0.2
+        assert [player['nickname'] for player in stats] == ["p0", "p1", "p2", "p3", "p4"]
+        assert progress.await_count == 5
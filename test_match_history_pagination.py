@@ -0,0 +1,58 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from unittest.mock import AsyncMock
+
+from bot.services.database_storage import (
+    DatabaseStorage, encode_history_cursor, decode_history_cursor
+)
+
+
+class TestMatchHistoryPagination:
+    """Тесты keyset-пагинации истории матчей"""
+
+    def test_cursor_roundtrip(self):
+        """Курсор восстанавливает позицию с точностью до микросекунды"""
+        finished_at = datetime(2025, 8, 24, 18, 30, 15, 123456, tzinfo=timezone.utc)
+        cursor = encode_history_cursor(finished_at, "1-abc-def")
+
+        assert len(cursor.encode()) <= 64  # Лимит callback_data в Telegram
+        assert decode_history_cursor(cursor) == (finished_at, "1-abc-def")
+
+    def test_decode_broken_cursor(self):
+        """Поврежденный курсор не ломает запрос"""
+        assert decode_history_cursor("garbage") is None
+        assert decode_history_cursor("abc|1-abc") is None
+
+    @pytest.mark.asyncio
+    async def test_page_has_next_cursor(self):
+        """Лишняя строка в выборке означает наличие следующей страницы"""
+        base = datetime(2025, 8, 24, tzinfo=timezone.utc)
+        rows = [
+            {'match_id': f"1-{i}", 'finished_at': base - timedelta(hours=i)}
+            for i in range(3)
+        ]
+        storage = DatabaseStorage()
+        storage.postgres = AsyncMock()
+        storage.postgres.fetch.return_value = rows
+
+        page = await storage.get_match_history_page(42, limit=2)
+
+        assert [m['match_id'] for m in page['matches']] == ["1-0", "1-1"]
+        assert decode_history_cursor(page['next_cursor']) == (rows[1]['finished_at'], "1-1")
+        # LIMIT запрашивается на одну строку больше страницы
+        assert storage.postgres.fetch.call_args.args[-1] == 3
+
+    @pytest.mark.asyncio
+    async def test_last_page_without_cursor(self):
+        """На последней странице курсор не возвращается"""
+        storage = DatabaseStorage()
+        storage.postgres = AsyncMock()
+        storage.postgres.fetch.return_value = [
+            {'match_id': "1-0", 'finished_at': datetime(2025, 8, 24, tzinfo=timezone.utc)}
+        ]
+
+        cursor = encode_history_cursor(datetime(2025, 8, 25, tzinfo=timezone.utc), "1-x")
+        page = await storage.get_match_history_page(42, limit=2, cursor=cursor)
+
+        assert page['next_cursor'] is None
+        assert "(finished_at, match_id) <" in storage.postgres.fetch.call_args.args[0]
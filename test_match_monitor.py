@@ -0,0 +1,217 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.match_monitor import MatchMonitor, CURSOR_KEY
+
+
+def make_storage(users, cursor=None):
+    """Хранилище с пользователями и курсором прохода в Redis"""
+    storage = MagicMock()
+    storage.get_users_with_notifications = AsyncMock(return_value=users)
+    storage.get_match_watermarks = AsyncMock(return_value={})
+    storage.redis = AsyncMock()
+    storage.redis.get.return_value = cursor
+    return storage
+
+
+def make_users(count):
+    return [{'user_id': i, 'faceit_id': f"player-{i}"} for i in range(1, count + 1)]
+
+
+class TestMatchMonitor:
+    """Тесты шардированного прохода мониторинга матчей"""
+
+    @pytest.mark.asyncio
+    async def test_sweep_respects_concurrency(self):
+        """Одновременно проверяется не больше concurrency пользователей"""
+        running = 0
+        peak = 0
+
+        async def check_user(user):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        monitor = MatchMonitor(make_storage(make_users(20)), check_user, concurrency=4, shard_size=10)
+        await monitor.sweep()
+
+        assert peak == 4
+        stats = await monitor.get_stats()
+        assert stats['last_sweep_users'] == 20
+        assert stats['backlog'] == 0
+        assert stats['users_per_second'] > 0
+
+    @pytest.mark.asyncio
+    async def test_sweep_resumes_after_cursor(self):
+        """Проход продолжается с пользователя после сохраненного курсора"""
+        checked = []
+
+        async def check_user(user):
+            checked.append(user['user_id'])
+
+        storage = make_storage(make_users(5), cursor="3")
+        monitor = MatchMonitor(storage, check_user, concurrency=1, shard_size=2)
+        await monitor.sweep()
+
+        assert checked == [4, 5, 1, 2, 3]
+        # Курсор сохраняется после каждого шарда и сбрасывается в конце
+        assert [call.args for call in storage.redis.set.await_args_list] == [
+            (CURSOR_KEY, 5), (CURSOR_KEY, 2), (CURSOR_KEY, 3)
+        ]
+        storage.redis.delete.assert_awaited_once_with(CURSOR_KEY)
+
+    @pytest.mark.asyncio
+    async def test_user_error_does_not_stop_sweep(self):
+        """Ошибка одного пользователя не прерывает проход"""
+        checked = []
+
+        async def check_user(user):
+            if user['user_id'] == 1:
+                raise RuntimeError("FACEIT API error")
+            checked.append(user['user_id'])
+
+        storage = make_storage(make_users(3) + [{'user_id': 4, 'faceit_id': None}])
+        monitor = MatchMonitor(storage, check_user)
+        await monitor.sweep()
+
+        assert sorted(checked) == [2, 3]
+        assert (await monitor.get_stats())['errors'] == 1
+
+    @pytest.mark.asyncio
+    async def test_shared_match_fetched_once(self):
+        """Общий матч премейда загружается один раз на всю пачку"""
+        async def check_user(user):
+            match_ids = ['shared'] if user['user_id'] <= 3 else ['solo']
+            return {'new_matches': len(match_ids), 'new_match_ids': match_ids}
+
+        fetch_match = AsyncMock(side_effect=lambda match_id: {'match_id': match_id})
+        notify_user = AsyncMock()
+
+        monitor = MatchMonitor(make_storage(make_users(4)), check_user,
+                               fetch_match=fetch_match, notify_user=notify_user)
+        await monitor.sweep()
+
+        assert sorted(call.args[0] for call in fetch_match.await_args_list) == ['shared', 'solo']
+        assert notify_user.await_count == 4
+        user, match_id, match = notify_user.await_args_list[0].args
+        assert match == {'match_id': match_id}
+
+        stats = await monitor.get_stats()
+        assert stats['new_match_pairs'] == 4
+        assert stats['match_fetches'] == 2
+        assert stats['dedup_ratio'] == 0.5
+
+    @pytest.mark.asyncio
+    async def test_users_of_one_match_notified_one_by_one(self):
+        """Получатели общего матча сохраняют его по очереди, разные матчи - параллельно"""
+        async def check_user(user):
+            match_ids = ['shared'] if user['user_id'] <= 3 else ['solo']
+            return {'new_matches': len(match_ids), 'new_match_ids': match_ids}
+
+        active = {'shared': 0, 'solo': 0}
+        peak = {'shared': 0, 'solo': 0}
+        started = []
+
+        async def notify_user(user, match_id, match):
+            active[match_id] += 1
+            peak[match_id] = max(peak[match_id], active[match_id])
+            started.append(match_id)
+            await asyncio.sleep(0.01)
+            active[match_id] -= 1
+
+        monitor = MatchMonitor(make_storage(make_users(4)), check_user,
+                               fetch_match=AsyncMock(side_effect=lambda match_id: {'match_id': match_id}),
+                               notify_user=notify_user)
+        await monitor.sweep()
+
+        assert sorted(started) == ['shared', 'shared', 'shared', 'solo']
+        assert peak['shared'] == 1
+        # Одиночный матч не ждет всех получателей общего
+        assert started.index('solo') < 3
+
+    @pytest.mark.asyncio
+    async def test_watermarks_loaded_once_per_batch(self):
+        """Отметки матчей загружаются одним запросом на пачку"""
+        seen = {}
+
+        async def check_user(user):
+            seen[user['user_id']] = user['watermark']
+
+        storage = make_storage(make_users(3))
+        storage.get_match_watermarks.return_value = {'player-2': (1700000000, '1-abc')}
+        await MatchMonitor(storage, check_user).sweep()
+
+        storage.get_match_watermarks.assert_awaited_once_with(['player-1', 'player-2', 'player-3'])
+        assert seen == {1: None, 2: (1700000000, '1-abc'), 3: None}
+
+    @pytest.mark.asyncio
+    async def test_processed_match_not_fetched(self):
+        """Матч, обработанный webhook'ом, не загружается повторно"""
+        async def check_user(user):
+            return {'new_matches': 1, 'new_match_ids': [f"match-{user['user_id']}"]}
+
+        idempotency = MagicMock()
+        idempotency.begin = AsyncMock(side_effect=lambda key: key != "match:match-1:finished")
+        idempotency.complete = AsyncMock()
+        idempotency.release = AsyncMock()
+        fetch_match = AsyncMock(return_value={'teams': {}})
+        recipients = AsyncMock(return_value=[{'user_id': 9, 'faceit_id': 'friend'}])
+        notify_user = AsyncMock()
+
+        monitor = MatchMonitor(make_storage(make_users(2)), check_user,
+                               fetch_match=fetch_match, notify_user=notify_user,
+                               match_recipients=recipients, idempotency=idempotency)
+        await monitor.sweep()
+
+        fetch_match.assert_awaited_once_with("match-2")
+        idempotency.complete.assert_awaited_once_with("match:match-2:finished")
+        # Уведомлены игрок из пачки и подписчик из состава матча
+        assert sorted(call.args[0]['user_id'] for call in notify_user.await_args_list) == [2, 9]
+        assert (await monitor.get_stats())['already_processed_matches'] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_recipient_retried_next_sweep(self):
+        """Матч с неотправленным уведомлением освобождается и повторяется для этого игрока"""
+        pending = {1: ['shared'], 2: ['shared']}
+
+        async def check_user(user):
+            match_ids = pending[user['user_id']]
+            return {'new_matches': len(match_ids), 'new_match_ids': match_ids}
+
+        claimed = set()
+
+        async def begin(key):
+            if key in claimed:
+                return False
+            claimed.add(key)
+            return True
+
+        idempotency = MagicMock()
+        idempotency.begin = AsyncMock(side_effect=begin)
+        idempotency.complete = AsyncMock()
+        idempotency.release = AsyncMock(side_effect=claimed.discard)
+
+        attempts = []
+
+        async def notify_user(user, match_id, match):
+            attempts.append(user['user_id'])
+            if user['user_id'] == 2 and attempts.count(2) == 1:
+                raise RuntimeError("Telegram unavailable")
+            # Отметка игрока сдвигается только после успешной отправки
+            pending[user['user_id']] = []
+
+        monitor = MatchMonitor(make_storage(make_users(2)), check_user,
+                               fetch_match=AsyncMock(return_value={'teams': {}}),
+                               notify_user=notify_user, idempotency=idempotency)
+        await monitor.sweep()
+
+        idempotency.release.assert_awaited_once_with("match:shared:finished")
+        idempotency.complete.assert_not_awaited()
+
+        await monitor.sweep()
+
+        assert sorted(attempts) == [1, 2, 2]
+        idempotency.complete.assert_awaited_once_with("match:shared:finished")
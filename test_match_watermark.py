@@ -0,0 +1,73 @@
+import pytest
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.database_storage import (
+    DatabaseStorage, MATCH_WATERMARK_KEY, is_after_watermark, parse_match_watermark
+)
+
+
+def make_storage(redis_values):
+    """Хранилище с отметками в замоканном Redis"""
+    storage = DatabaseStorage()
+    storage.postgres = AsyncMock()
+    storage.redis = MagicMock()
+    storage.redis.hmget = AsyncMock(return_value=redis_values)
+
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+
+    @asynccontextmanager
+    async def pipeline(transaction=True):
+        yield pipe
+
+    storage.redis.pipeline = pipeline
+    return storage, pipe
+
+
+class TestMatchWatermark:
+    """Тесты отметки последнего обработанного матча"""
+
+    def test_parse_watermark(self):
+        """Отметка разбирается в (finished_at, match_id)"""
+        assert parse_match_watermark("1700000000|1-abc") == (1700000000, "1-abc")
+        assert parse_match_watermark("1700000000|") == (1700000000, "")
+        assert parse_match_watermark(None) is None
+        assert parse_match_watermark("garbage") is None
+
+    def test_is_after_watermark(self):
+        """Новее отметки только более поздние матчи"""
+        watermark = (1700000000, "1-b")
+
+        assert is_after_watermark(1700000100, "1-a", watermark)
+        assert not is_after_watermark(1699999999, "1-z", watermark)
+        assert is_after_watermark(1700000000, "1-c", watermark)
+        assert not is_after_watermark(1700000000, "1-b", watermark)
+        # Отметка из БД без match_id покрывает всю секунду
+        assert not is_after_watermark(1700000000, "1-z", (1700000000, ""))
+
+    @pytest.mark.asyncio
+    async def test_shard_read_is_single_hmget(self):
+        """Отметки группы читаются одним HMGET без запросов к БД"""
+        storage, _ = make_storage(["1700000000|1-a", "1700000100|1-b"])
+
+        watermarks = await storage.get_match_watermarks(["p1", "p2"])
+
+        assert watermarks == {"p1": (1700000000, "1-a"), "p2": (1700000100, "1-b")}
+        storage.redis.hmget.assert_awaited_once_with(MATCH_WATERMARK_KEY, ["p1", "p2"])
+        storage.postgres.fetch.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_missing_watermark_restored_from_history(self):
+        """Отсутствующая отметка восстанавливается из match_history"""
+        storage, pipe = make_storage([None, None])
+        storage.postgres.fetch.return_value = [
+            {'faceit_id': "p1", 'last_match_time': datetime.fromtimestamp(1700000000, timezone.utc)}
+        ]
+
+        watermarks = await storage.get_match_watermarks(["p1", "p2"])
+
+        assert watermarks == {"p1": (1700000000, "")}
+        assert storage.postgres.fetch.await_args.args[1] == ["p1", "p2"]
+        pipe.hsetnx.assert_called_once_with(MATCH_WATERMARK_KEY, "p1", "1700000000|")
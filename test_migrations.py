@@ -0,0 +1,66 @@
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.migrations import MigrationRunner, MIGRATIONS_DIR
+
+
+def make_connection(applied=None):
+    """Замоканное подключение asyncpg с таблицей schema_version"""
+    connection = MagicMock()
+    connection.execute = AsyncMock()
+    connection.fetchval = AsyncMock(return_value=applied is not None)
+    connection.fetch = AsyncMock(return_value=[
+        {'version': version, 'checksum': checksum} for version, checksum in (applied or {}).items()
+    ])
+
+    @asynccontextmanager
+    async def transaction():
+        yield
+
+    connection.transaction = transaction
+    return connection
+
+
+class TestMigrationRunner:
+    """Тесты версионированных миграций"""
+
+    def test_repository_migrations_are_ordered(self):
+        """Миграции репозитория имеют уникальные последовательные версии"""
+        versions = [m.version for m in MigrationRunner(None).discover()]
+
+        assert versions == list(range(1, len(versions) + 1))
+
+    def test_discover_skips_unversioned_files(self, tmp_path):
+        """Файлы без номера версии не считаются миграциями"""
+        (tmp_path / "002_second.sql").write_text("SELECT 2;")
+        (tmp_path / "001_first.sql").write_text("SELECT 1;")
+        (tmp_path / "notes.sql").write_text("SELECT 0;")
+
+        migrations = MigrationRunner(None, str(tmp_path)).discover()
+
+        assert [(m.version, m.name) for m in migrations] == [(1, "first"), (2, "second")]
+
+    @pytest.mark.asyncio
+    async def test_migrate_applies_only_pending(self, tmp_path):
+        """Уже примененные версии не выполняются повторно"""
+        (tmp_path / "001_first.sql").write_text("SELECT 1;")
+        (tmp_path / "002_second.sql").write_text("SELECT 2;")
+        runner = MigrationRunner(None, str(tmp_path))
+        first = runner.discover()[0]
+        runner.connection = make_connection({1: first.checksum})
+
+        applied = await runner.migrate()
+
+        assert [m.version for m in applied] == [2]
+        executed = [call.args[0] for call in runner.connection.execute.await_args_list]
+        assert "SELECT 2;" in executed
+        assert "SELECT 1;" not in executed
+
+    @pytest.mark.asyncio
+    async def test_empty_database_has_version_zero(self):
+        """Без таблицы schema_version версия схемы равна 0"""
+        runner = MigrationRunner(make_connection(), MIGRATIONS_DIR)
+
+        assert await runner.current_version() == 0
+        assert len(await runner.pending()) == len(runner.discover())
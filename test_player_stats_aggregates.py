@@ -0,0 +1,130 @@
+import pytest
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.database_storage import DatabaseStorage, summarize_stats_row
+
+
+def make_storage():
+    """Хранилище с замоканным PostgreSQL и транзакцией"""
+    storage = DatabaseStorage()
+    storage.postgres = MagicMock()
+    storage.postgres.fetchrow = AsyncMock()
+    storage.postgres.execute = AsyncMock()
+
+    @asynccontextmanager
+    async def transaction():
+        yield
+
+    storage.postgres.transaction = transaction
+    return storage
+
+
+def aggregate_calls(storage):
+    """Аргументы обновлений player_stats_daily (без блокировок и прочих запросов)"""
+    return [
+        call.args for call in storage.postgres.execute.await_args_list
+        if 'player_stats_daily' in call.args[0]
+    ]
+
+
+def match_row(**overrides):
+    row = {
+        'user_id': 42, 'finished_at': datetime(2025, 8, 24, 21, 0, tzinfo=timezone.utc),
+        'result': 'win', 'map_name': 'de_mirage', 'kills': 20, 'deaths': 10,
+        'assists': 5, 'headshots': 10, 'rounds_played': 24, 'adr': 90.0, 'hltv_rating': 1.3
+    }
+    row.update(overrides)
+    return row
+
+
+class TestPlayerStatsAggregates:
+    """Тесты инкрементальных агрегатов статистики"""
+
+    def test_summarize_stats_row(self):
+        """Итоговые показатели считаются из сумм"""
+        stats = summarize_stats_row({
+            'matches': 4, 'wins': 3, 'losses': 1, 'kills': 80, 'deaths': 40,
+            'assists': 12, 'headshots': 40, 'rounds_played': 96,
+            'adr_sum': 360.0, 'rating_sum': 4.8
+        })
+
+        assert stats['total_matches'] == 4
+        assert stats['winrate'] == 75.0
+        assert stats['kd_ratio'] == 2.0
+        assert stats['headshot_percentage'] == 50.0
+        assert stats['adr'] == 90.0
+        assert stats['player_rating'] == pytest.approx(1.2)
+
+    def test_summarize_empty_window(self):
+        """Пустое окно не приводит к делению на ноль"""
+        stats = summarize_stats_row(None)
+
+        assert stats['total_matches'] == 0
+        assert stats['winrate'] == 0.0
+        assert stats['adr'] == 0.0
+
+    @pytest.mark.asyncio
+    async def test_save_new_match_adds_to_aggregates(self):
+        """Новый матч прибавляется к агрегатам один раз"""
+        storage = make_storage()
+        storage.postgres.fetchrow.side_effect = [None, match_row()]
+
+        await storage.save_match({'match_id': '1-abc', 'user_id': 42})
+
+        (args,) = aggregate_calls(storage)
+        assert args[1:5] == (42, datetime(2025, 8, 24).date(), 'de_mirage', 1)
+
+    @pytest.mark.asyncio
+    async def test_resave_match_replaces_previous_values(self):
+        """Повторное сохранение вычитает старую версию строки"""
+        storage = make_storage()
+        storage.postgres.fetchrow.side_effect = [match_row(result='loss', kills=5), match_row()]
+
+        await storage.save_match({'match_id': '1-abc', 'user_id': 42})
+
+        subtract, add = aggregate_calls(storage)
+        assert subtract[4] == -1 and subtract[6] == -1 and subtract[7] == -5
+        assert add[4] == 1 and add[5] == 1 and add[7] == 20
+
+    @pytest.mark.asyncio
+    async def test_two_players_of_one_match_keep_own_aggregates(self):
+        """Второй отслеживаемый игрок матча не перезаписывает строку и агрегаты первого"""
+        storage = make_storage()
+        rows = {}
+
+        async def fetchrow(query, *args):
+            if query.lstrip().startswith('SELECT'):
+                match_id, user_id = args
+                return rows.get((match_id, user_id))
+            row = match_row(user_id=args[1], kills=args[4])
+            rows[(args[0], args[1])] = row
+            return row
+
+        storage.postgres.fetchrow.side_effect = fetchrow
+
+        await storage.save_match({'match_id': '1-abc', 'user_id': 42, 'kills': 20})
+        await storage.save_match({'match_id': '1-abc', 'user_id': 7, 'kills': 11})
+
+        # Сохранения одного матча сериализуются блокировкой по match_id
+        lock = storage.postgres.execute.await_args_list[0].args
+        assert 'pg_advisory_xact_lock' in lock[0] and lock[1] == '1-abc'
+
+        added = [(args[1], args[4], args[7]) for args in aggregate_calls(storage)]
+        assert added == [(42, 1, 20), (7, 1, 11)]
+
+
+class TestMatchNotificationDedup:
+    """Тесты отметки отправленных уведомлений о матчах"""
+
+    @pytest.mark.asyncio
+    async def test_mark_sent_is_serialized_per_pair(self):
+        """Проверка и вставка отметки идут в транзакции под блокировкой пары (матч, пользователь)"""
+        storage = make_storage()
+
+        await storage.mark_match_notification_sent('1-abc', 42, {'map': 'de_mirage'})
+
+        lock, insert = [call.args for call in storage.postgres.execute.await_args_list]
+        assert 'pg_advisory_xact_lock' in lock[0] and lock[1] == '1-abc:42'
+        assert 'NOT EXISTS' in insert[0] and insert[1:3] == ('1-abc', 42)
@@ -0,0 +1,73 @@
+import time
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.poll_scheduler import PollScheduler, SCHEDULE_KEY, STATE_KEY, LIVE_FIRST_POLL
+
+
+def make_scheduler(state=None):
+    """Планировщик с замоканным Redis и записью последнего pipeline"""
+    storage = MagicMock()
+    storage.redis = MagicMock()
+    storage.redis.hget = AsyncMock(return_value=state)
+    storage.redis.zrange = AsyncMock(return_value=[])
+
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+
+    @asynccontextmanager
+    async def pipeline(transaction=True):
+        yield pipe
+
+    storage.redis.pipeline = pipeline
+    scheduler = PollScheduler(storage, live_interval=60, active_interval=120,
+                              base_interval=300, max_interval=3600)
+    return scheduler, pipe
+
+
+class TestPollScheduler:
+    """Тесты адаптивного расписания опроса"""
+
+    def test_interval_depends_on_activity(self):
+        """Игрок в матче и в сессии опрашивается чаще неактивного"""
+        scheduler, _ = make_scheduler()
+        now = time.time()
+
+        assert scheduler.next_delay({'live_until': now + 600}, now) == 60
+        assert scheduler.next_delay({'last_match_at': now - 1800}, now) == 120
+        assert scheduler.next_delay({'last_match_at': now - 86400, 'idle_polls': 2}, now) == 1200
+        assert scheduler.next_delay({'idle_polls': 10}, now) == 3600
+
+    @pytest.mark.asyncio
+    async def test_empty_poll_backs_off(self):
+        """Пустой опрос неактивного игрока увеличивает интервал"""
+        scheduler, pipe = make_scheduler(state="0:0:3")
+
+        delay = await scheduler.reschedule(42, {'last_finished_at': 0, 'new_matches': 0})
+
+        assert 3600 * 0.9 <= delay <= 3600 * 1.1
+        pipe.hset.assert_called_once_with(STATE_KEY, 42, "0:0:4")
+
+    @pytest.mark.asyncio
+    async def test_new_match_resets_backoff(self):
+        """Найденный матч возвращает игрока в частый опрос"""
+        finished_at = time.time() - 600
+        scheduler, pipe = make_scheduler(state=f"{time.time() + 600:.0f}:0:5")
+
+        delay = await scheduler.reschedule(42, {'last_finished_at': finished_at, 'new_matches': 1})
+
+        assert 120 * 0.9 <= delay <= 120 * 1.1
+        assert pipe.hset.call_args.args[2] == f"0:{finished_at:.0f}:0"
+
+    @pytest.mark.asyncio
+    async def test_mark_live_schedules_expected_end(self):
+        """После старта матча первый опрос ставится на ожидаемый конец"""
+        scheduler, pipe = make_scheduler()
+
+        await scheduler.mark_live(42)
+
+        key, mapping = pipe.zadd.call_args.args
+        assert key == SCHEDULE_KEY
+        assert mapping["42"] == pytest.approx(time.time() + LIVE_FIRST_POLL, abs=5)
+        assert pipe.zadd.call_args.kwargs == {'xx': True}
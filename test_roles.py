@@ -0,0 +1,28 @@
+import pytest
+
+from bot.services.roles import ROLES, parse_roles
+
+
+class TestParseRoles:
+    """Тесты разбора ролей процесса"""
+
+    def test_all_and_empty_mean_every_role(self):
+        """all (и пустое значение) - все роли в одном процессе"""
+        assert parse_roles("all") == set(ROLES)
+        assert parse_roles("") == set(ROLES)
+
+    def test_comma_separated_roles(self):
+        """Роли через запятую, регистр и пробелы не важны"""
+        assert parse_roles(" Bot, monitor ") == {'bot', 'monitor'}
+
+    def test_unknown_role_is_rejected(self):
+        """Опечатка в роли - ошибка при старте, а не процесс без задач"""
+        with pytest.raises(ValueError, match="worker"):
+            parse_roles("api,worker")
+
+    def test_split_roles_need_shared_queue(self):
+        """Очередь задач в памяти не видна воркерам других процессов"""
+        with pytest.raises(ValueError, match="WORKER_QUEUE_BACKEND"):
+            parse_roles("bot,api", queue_backend="memory")
+        assert parse_roles("all", queue_backend="memory") == set(ROLES)
+        assert parse_roles("bot,api,monitor,workers", queue_backend="memory") == set(ROLES)
@@ -0,0 +1,504 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.task_queue import GROUP_NAME, MemoryTaskQueue, RedisStreamTaskQueue, stream_key
+
+
+def make_redis_storage(put_result="1700000000000-0"):
+    """Хранилище с замоканным Redis для очереди на потоках"""
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+
+    @asynccontextmanager
+    async def pipeline(transaction=True):
+        yield pipe
+
+    storage = MagicMock()
+    storage.redis = MagicMock()
+    storage.redis.xgroup_create = AsyncMock()
+    storage.redis.register_script = MagicMock(return_value=AsyncMock(return_value=put_result))
+    storage.redis.pipeline = pipeline
+    return storage, pipe
+
+
+class TestMemoryTaskQueue:
+    """Тесты очереди в памяти"""
+
+    @pytest.mark.asyncio
+    async def test_put_raises_queue_full(self):
+        """Переполненная очередь отвечает QueueFull, а не блокирует вызов"""
+        backend = MemoryTaskQueue(max_size=1)
+        await backend.put('stats', {'type': 'player_stats'})
+
+        with pytest.raises(asyncio.QueueFull):
+            await backend.put('stats', {'type': 'player_stats'})
+
+    @pytest.mark.asyncio
+    async def test_unacked_task_is_reclaimed_after_visibility_timeout(self):
+        """Неподтвержденная задача снова выдается с увеличенным счетчиком доставок"""
+        backend = MemoryTaskQueue(visibility_timeout=0.05)
+        await backend.put('stats', {'type': 'player_stats'})
+
+        message = await backend.get('stats', 'w1', timeout=1)
+        assert message.attempts == 1
+        assert await backend.claim_stale('stats', 'w2') == []
+
+        await asyncio.sleep(0.06)
+        reclaimed = await backend.claim_stale('stats', 'w2')
+        assert [m.id for m in reclaimed] == [message.id]
+        assert reclaimed[0].attempts == 2
+
+        await backend.ack('stats', reclaimed[0])
+        stats = await backend.get_stats('stats')
+        assert stats['depth'] == 0 and stats['pending'] == 0
+
+    @pytest.mark.asyncio
+    async def test_high_priority_task_is_served_first(self):
+        """Задача высокой полосы выдается раньше поставленных до нее обычных"""
+        backend = MemoryTaskQueue()
+        await backend.put('history', {'type': 'match_history', 'n': 1})
+        await backend.put('history', {'type': 'session_stats'}, priority='low')
+        await backend.put('history', {'type': 'match_history', 'n': 2})
+        await backend.put('history', {'type': 'form_periods'}, priority='high')
+
+        batch = await backend.get_batch('history', 'w1', 10, timeout=0.01)
+        assert [m.task.get('n', m.task['type']) for m in batch] == ['form_periods', 1, 2, 'session_stats']
+
+
+class TestRedisStreamTaskQueue:
+    """Тесты очереди на Redis Streams"""
+
+    @pytest.mark.asyncio
+    async def test_put_checks_size_atomically(self):
+        """Размер проверяется в скрипте вместе с XADD; отказ - QueueFull"""
+        storage, _ = make_redis_storage(put_result=None)
+        backend = RedisStreamTaskQueue(storage, max_size=5)
+
+        with pytest.raises(asyncio.QueueFull):
+            await backend.put('stats', {'type': 'player_stats'})
+
+        script = storage.redis.register_script.return_value
+        script.assert_awaited_once_with(
+            keys=[stream_key('stats')],
+            args=[5, json.dumps({'type': 'player_stats'})]
+        )
+        storage.redis.xgroup_create.assert_awaited_once_with(
+            stream_key('stats'), GROUP_NAME, id='0', mkstream=True
+        )
+
+    @pytest.mark.asyncio
+    async def test_claim_stale_uses_delivery_count(self):
+        """Зависшие задачи забираются XCLAIM с числом прошлых доставок"""
+        storage, pipe = make_redis_storage()
+        # Зависшая задача есть только в обычной полосе
+        storage.redis.xpending_range = AsyncMock(side_effect=lambda stream, *args, **kwargs: [
+            {'message_id': '1700000000000-0', 'times_delivered': 2}
+        ] if stream == stream_key('stats') else [])
+        storage.redis.xclaim = AsyncMock(return_value=[
+            ('1700000000000-0', {'task': json.dumps({'type': 'form_analysis'})})
+        ])
+        backend = RedisStreamTaskQueue(storage, visibility_timeout=60)
+
+        [message] = await backend.claim_stale('stats', 'w1')
+        assert message.task == {'type': 'form_analysis'}
+        assert message.attempts == 3
+        storage.redis.xclaim.assert_awaited_once_with(
+            stream_key('stats'), GROUP_NAME, 'w1', 60000, ['1700000000000-0']
+        )
+
+        await backend.ack('stats', message)
+        pipe.xack.assert_called_once_with(stream_key('stats'), GROUP_NAME, message.id)
+        pipe.xdel.assert_called_once_with(stream_key('stats'), message.id)
+
+
+    @pytest.mark.asyncio
+    async def test_lanes_are_read_in_priority_order(self):
+        """Полосы читаются без ожидания от высокой к низкой, пока не набрана пачка"""
+        storage, _ = make_redis_storage()
+        task = json.dumps({'type': 'match_history'})
+        storage.redis.xreadgroup = AsyncMock(side_effect=[
+            [],
+            [[stream_key('history'), [('1700000000001-0', {'task': task})]]],
+            [[stream_key('history', 'low'), [('1700000000002-0', {'task': task})]]],
+        ])
+        backend = RedisStreamTaskQueue(storage)
+
+        batch = await backend.get_batch('history', 'w1', 5, timeout=1)
+
+        assert [(m.id, m.priority) for m in batch] == [('1700000000001-0', 'normal'), ('1700000000002-0', 'low')]
+        streams = [list(call.args[2]) for call in storage.redis.xreadgroup.await_args_list]
+        assert streams == [['worker:history:high'], ['worker:history'], ['worker:history:low']]
+        assert storage.redis.xreadgroup.await_args_list[1].kwargs['count'] == 5
+        assert storage.redis.xreadgroup.await_args_list[2].kwargs['count'] == 4
+
+    @pytest.mark.asyncio
+    async def test_retry_keeps_task_id_and_attempts(self):
+        """Повтор уходит в отложенные одной транзакцией и возвращается с исходным task_id"""
+        storage, pipe = make_redis_storage()
+        backend = RedisStreamTaskQueue(storage, dead_letter_max=50)
+        message = backend._message('stats', '1700000000000-0', {
+            'task': json.dumps({'type': 'player_stats', 'player_id': 'p1'}),
+            'key': 'player_stats:p1', 'tid': '1690000000000-0', 'attempts': '2'
+        }, attempts=1)
+        assert message.task_id == '1690000000000-0' and message.attempts == 3
+
+        await backend.retry_later('stats', message, delay=5)
+        key, scores = pipe.zadd.call_args.args
+        assert key == 'worker:delayed:stats'
+        entry = json.loads(next(iter(scores)))
+        assert entry['tid'] == '1690000000000-0' and entry['attempts'] == '3'
+        pipe.xack.assert_called_once_with(stream_key('stats'), GROUP_NAME, message.id)
+
+        await backend.quarantine('stats', message, "FACEIT API error")
+        args, kwargs = pipe.xadd.call_args
+        assert args[0] == 'worker:dead:stats' and args[1]['error'] == "FACEIT API error"
+        assert kwargs == {'maxlen': 50, 'approximate': True}
+
+
+class TestWorkerLoop:
+    """Тесты цикла воркера"""
+
+    @pytest.mark.asyncio
+    async def test_failed_task_is_retried_then_quarantined(self, monkeypatch):
+        """Упавшая задача повторяется с задержкой, после всех попыток - карантин"""
+        import workers
+        from bot.services.task_queue import TaskFailed
+
+        backend = MemoryTaskQueue()
+        queue = workers.WorkerQueue(backend, max_deliveries=2, retry_base_delay=0.01)
+        monkeypatch.setattr(workers, 'worker_queue', queue)
+        monkeypatch.setattr(workers.settings, 'worker_timeout', 0.01)
+
+        submitted = await queue.add_stats_task({'type': 'player_stats'})
+        handle = AsyncMock(side_effect=RuntimeError("FACEIT API error"))
+
+        loop_task = asyncio.create_task(workers.run_worker_loop('stats', 'w1', handle))
+        scheduler_task = asyncio.create_task(queue.run_retry_scheduler(interval=0.01))
+        try:
+            with pytest.raises(TaskFailed, match="FACEIT API error"):
+                await submitted.result(timeout=1)
+        finally:
+            loop_task.cancel()
+            scheduler_task.cancel()
+            await asyncio.gather(loop_task, scheduler_task, return_exceptions=True)
+
+        assert handle.await_count == 2
+        assert queue.metrics['stats']['retried'] == 1
+        assert queue.metrics['stats']['quarantined'] == 1
+        stats = await backend.get_stats('stats')
+        assert stats['depth'] == 0 and stats['delayed'] == 0 and stats['dead_letter_size'] == 1
+
+    @pytest.mark.asyncio
+    async def test_hung_task_is_cancelled_at_deadline(self, monkeypatch):
+        """Зависшая задача отменяется по дедлайну и учитывается в timeouts"""
+        import workers
+
+        queue = workers.WorkerQueue(MemoryTaskQueue(), task_timeout=0.05, max_deliveries=1)
+        monkeypatch.setattr(workers, 'worker_queue', queue)
+        monkeypatch.setattr(workers.settings, 'worker_timeout', 0.01)
+        cancelled = asyncio.Event()
+
+        async def handle(task):
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        loop_task = asyncio.create_task(workers.run_worker_loop('stats', 'w1', handle))
+        try:
+            submitted = await queue.add_stats_task({'type': 'custom'})
+            with pytest.raises(Exception, match="deadline"):
+                await submitted.result(timeout=1)
+        finally:
+            loop_task.cancel()
+            await asyncio.gather(loop_task, return_exceptions=True)
+
+        assert cancelled.is_set()
+        assert queue.metrics['stats']['timeouts'] == 1
+        assert queue.metrics['stats']['quarantined'] == 1
+
+    @pytest.mark.asyncio
+    async def test_task_lost_by_workers_is_quarantined_on_reclaim(self):
+        """Задача, раз за разом теряемая воркерами, не выдается больше max_deliveries раз"""
+        import workers
+
+        backend = MemoryTaskQueue(visibility_timeout=0)
+        queue = workers.WorkerQueue(backend, max_deliveries=1)
+        queue.reclaim_interval = 0
+        await queue.add_stats_task({'type': 'custom'})
+
+        assert len(await queue.get_batch('stats', 'w1', 1, timeout=0.01)) == 1
+        assert await queue.get_batch('stats', 'w2', 1, timeout=0.01) == []
+        assert queue.metrics['stats']['quarantined'] == 1
+        assert (await backend.get_stats('stats'))['dead_letter_size'] == 1
+
+
+class TestUserFairness:
+    """Тесты справедливой выдачи задач пользователям"""
+
+    @pytest.mark.asyncio
+    async def test_heavy_user_is_capped_and_light_user_goes_first(self):
+        """Задачи сверх предела пользователя откладываются, чужие задачи идут без очереди"""
+        import workers
+
+        backend = MemoryTaskQueue()
+        queue = workers.WorkerQueue(backend, user_max_in_flight=1, defer_delay=0.01)
+        for n in range(3):
+            await queue.add_history_task({'type': 'session_stats', 'user_id': 1, 'n': n})
+        await queue.add_history_task({'type': 'session_stats', 'user_id': 2, 'n': 0})
+
+        first = await queue.get_batch('history', 'w1', 10, timeout=0.01)
+        assert [(m.task['user_id'], m.task['n']) for m in first] == [(1, 0), (2, 0)]
+        assert queue.metrics['history']['deferred'] == 2
+
+        # Слот освобождается после выполнения - следующая задача тяжелого пользователя проходит
+        await queue.ack('history', first[0])
+        await asyncio.sleep(0.02)
+        await queue.promote_due()
+        second = await queue.get_batch('history', 'w1', 10, timeout=0.01)
+        # Отложенные задачи возвращаются с разбросом, порядок между ними не задан
+        assert len(second) == 1
+        assert second[0].task['user_id'] == 1 and second[0].task['n'] in (1, 2)
+        assert second[0].attempts == 1
+
+    def test_batch_is_interleaved_between_users(self):
+        """Внутри полосы пачка обрабатывается по кругу между пользователями"""
+        import workers
+        from bot.services.task_queue import TaskMessage
+
+        def message(user, n, priority='normal'):
+            return TaskMessage(id=f"{user}-{n}", queue='stats', task={'user_id': user}, priority=priority)
+
+        ordered = workers.WorkerQueue.fair_order([
+            message(1, 0), message(1, 1), message(1, 2), message(2, 0), message(3, 0, 'high'), message(2, 1)
+        ])
+        assert [m.id for m in ordered] == ['3-0', '1-0', '2-0', '1-1', '2-1', '1-2']
+
+
+class TestTaskCoalescing:
+    """Тесты склеивания одинаковых задач"""
+
+    @pytest.mark.asyncio
+    async def test_duplicate_attaches_to_pending_task(self):
+        """Повтор задачи до ее выполнения не ставится, запросивший становится получателем"""
+        import workers
+
+        queue = workers.WorkerQueue(MemoryTaskQueue(), result_ttl=60)
+        first = await queue.add_stats_task({'type': 'player_stats', 'player_id': 'p1', 'user_id': 1})
+        second = await queue.add_stats_task({'type': 'player_stats', 'player_id': 'p1', 'user_id': 2})
+
+        assert first.status == 'queued'
+        assert second.status == 'coalesced' and second.task_id == first.task_id
+        assert (await queue.backend.get_stats('stats'))['depth'] == 1
+
+        message = await queue.get('stats', 'w1', timeout=1)
+        requesters = await queue.ack('stats', message, {'nickname': 'p1'})
+        assert requesters == ['1', '2']
+
+        # Готовый результат отдается без новой задачи
+        reused = await queue.add_stats_task({'type': 'player_stats', 'player_id': 'p1', 'user_id': 3})
+        assert reused.status == 'done'
+        assert await reused.result(timeout=0) == {'nickname': 'p1'}
+        assert queue.metrics['stats']['coalesced'] == 1
+        assert queue.metrics['stats']['result_reused'] == 1
+
+    @pytest.mark.asyncio
+    async def test_user_specific_tasks_are_not_coalesced(self):
+        """Задачи без канонического ключа (сессия, уведомления) ставятся каждый раз"""
+        import workers
+
+        queue = workers.WorkerQueue(MemoryTaskQueue())
+        task = {'type': 'session_stats', 'player_id': 'p1', 'user_id': 1}
+
+        assert workers.WorkerQueue.task_key(task) is None
+        assert (await queue.add_history_task(task)).status == 'queued'
+        assert (await queue.add_history_task(task)).status == 'queued'
+        assert workers.WorkerQueue.task_key({'type': 'match_history', 'player_id': 'p1', 'limit': 20}) == 'match_history:p1:20'
+
+    @pytest.mark.asyncio
+    async def test_redis_put_unique_reports_coalesced(self):
+        """Скрипт отвечает id ждущей задачи и флагом склеивания"""
+        storage, _ = make_redis_storage(put_result=['1700000000000-0', 1])
+        backend = RedisStreamTaskQueue(storage, max_size=5, visibility_timeout=60)
+
+        task_id, coalesced = await backend.put_unique('stats', {'type': 'player_stats'}, 'player_stats:p1', '42')
+
+        assert task_id == '1700000000000-0' and coalesced
+        script = storage.redis.register_script.return_value
+        assert script.await_args.kwargs['keys'] == [
+            stream_key('stats'), 'worker:pending:player_stats:p1', 'worker:requesters:player_stats:p1'
+        ]
+        assert script.await_args.kwargs['args'][3:] == [120, '42']
+
+
+class TestTaskResults:
+    """Тесты ожидания результата задачи"""
+
+    @pytest.mark.asyncio
+    async def test_run_returns_worker_result(self, monkeypatch):
+        """Обработчик получает результат задачи, выполненной воркером"""
+        import workers
+
+        queue = workers.WorkerQueue(MemoryTaskQueue())
+        monkeypatch.setattr(workers, 'worker_queue', queue)
+        monkeypatch.setattr(workers.settings, 'worker_timeout', 0.01)
+
+        async def handle(task):
+            return {'doubled': task['value'] * 2}
+
+        loop_task = asyncio.create_task(workers.run_worker_loop('stats', 'w1', handle))
+        try:
+            first, second = await asyncio.gather(
+                queue.run('stats', {'type': 'custom', 'value': 2}, timeout=1),
+                queue.run('stats', {'type': 'custom', 'value': 5}, timeout=1),
+            )
+        finally:
+            loop_task.cancel()
+            await asyncio.gather(loop_task, return_exceptions=True)
+
+        assert first == {'doubled': 4} and second == {'doubled': 10}
+
+    @pytest.mark.asyncio
+    async def test_failed_task_raises_and_deadline_times_out(self, monkeypatch):
+        """Упавшая задача - TaskFailed; задача без воркеров - таймаут"""
+        import workers
+        from bot.services.task_queue import TaskFailed
+
+        queue = workers.WorkerQueue(MemoryTaskQueue(), max_deliveries=1)
+        monkeypatch.setattr(workers, 'worker_queue', queue)
+        monkeypatch.setattr(workers.settings, 'worker_timeout', 0.01)
+
+        with pytest.raises(asyncio.TimeoutError):
+            await queue.run('history', {'type': 'custom'}, timeout=0.05)
+
+        handle = AsyncMock(side_effect=RuntimeError("FACEIT API error"))
+        loop_task = asyncio.create_task(workers.run_worker_loop('stats', 'w1', handle))
+        try:
+            with pytest.raises(TaskFailed, match="FACEIT API error"):
+                await queue.run('stats', {'type': 'custom'}, timeout=1)
+        finally:
+            loop_task.cancel()
+            await asyncio.gather(loop_task, return_exceptions=True)
+
+    @pytest.mark.asyncio
+    async def test_redis_outcome_published_before_wait(self):
+        """Итог, опубликованный до подписки ждущего, берется из ключа"""
+        storage, _ = make_redis_storage()
+        pubsub = MagicMock()
+        pubsub.psubscribe = AsyncMock()
+        pubsub.aclose = AsyncMock()
+
+        async def listen():
+            await asyncio.Event().wait()
+            yield
+
+        pubsub.listen = listen
+        storage.redis.pubsub = MagicMock(return_value=pubsub)
+        storage.redis.get = AsyncMock(return_value=json.dumps({'ok': True, 'result': [1, 2]}))
+        backend = RedisStreamTaskQueue(storage)
+
+        outcome = await backend.wait_outcome('1700000000000-0', timeout=1)
+        await backend.close()
+
+        assert outcome == {'ok': True, 'result': [1, 2]}
+        pubsub.psubscribe.assert_awaited_once_with('worker:done:*')
+        storage.redis.get.assert_awaited_once_with('worker:outcome:1700000000000-0')
+
+
+class TestBatchWorkers:
+    """Тесты пакетной обработки задач"""
+
+    @pytest.mark.asyncio
+    async def test_compatible_tasks_are_drained_as_one_batch(self, monkeypatch):
+        """Задачи одного типа с обработчиком пачек уходят в него одним вызовом"""
+        import workers
+
+        queue = workers.WorkerQueue(MemoryTaskQueue())
+        monkeypatch.setattr(workers, 'worker_queue', queue)
+        monkeypatch.setattr(workers.settings, 'worker_timeout', 0.01)
+        monkeypatch.setattr(workers.settings, 'batch_size', 10)
+
+        handles = [await queue.add_stats_task({'type': 'player_stats', 'player_id': f"p{i}"}) for i in range(3)]
+        single = await queue.add_stats_task({'type': 'form_analysis', 'player_id': 'p0'})
+
+        batch_handler = AsyncMock(side_effect=lambda tasks: [task['player_id'] for task in tasks])
+        handle = AsyncMock(return_value={'form': 'ok'})
+        loop_task = asyncio.create_task(
+            workers.run_worker_loop('stats', 'w1', handle, batch_handlers={'player_stats': batch_handler})
+        )
+        try:
+            results = await asyncio.gather(*(h.result(timeout=1) for h in handles + [single]))
+        finally:
+            loop_task.cancel()
+            await asyncio.gather(loop_task, return_exceptions=True)
+
+        assert results == ['p0', 'p1', 'p2', {'form': 'ok'}]
+        batch_handler.assert_awaited_once()
+        assert len(batch_handler.await_args.args[0]) == 3
+        assert queue.metrics['stats']['processed'] == 4
+
+    @pytest.mark.asyncio
+    async def test_player_stats_batch_uses_multi_get_and_bulk_fetch(self, monkeypatch):
+        """Кэш читается одним MGET, промахи - одним пакетным запросом, запись - одной пачкой"""
+        import workers
+
+        storage = MagicMock()
+        storage.get_cached_many = AsyncMock(return_value={'player_stats_p1': {'nickname': 'cached'}})
+        storage.set_cached_many = AsyncMock()
+        monkeypatch.setattr(workers, 'storage', storage)
+
+        client = MagicMock()
+        client.get_players_details_and_stats = AsyncMock(return_value={
+            'p2': ({'nickname': 'fresh'}, {'lifetime': {}}),
+            'p3': (None, None),
+        })
+        client.format_player_stats = MagicMock(side_effect=lambda details, stats: {'nickname': details['nickname']})
+
+        tasks = [{'type': 'player_stats', 'player_id': pid} for pid in ('p1', 'p2', 'p3', 'p2')]
+        results = await workers.process_player_stats_batch(client, tasks)
+
+        assert results == [{'nickname': 'cached'}, {'nickname': 'fresh'}, None, {'nickname': 'fresh'}]
+        storage.get_cached_many.assert_awaited_once_with(['player_stats_p1', 'player_stats_p2', 'player_stats_p3'])
+        client.get_players_details_and_stats.assert_awaited_once_with(['p2', 'p3'])
+        storage.set_cached_many.assert_awaited_once_with({'player_stats_p2': {'nickname': 'fresh'}}, ttl_minutes=15)
+
+
+class TestComparisonPipeline:
+    """Тесты конвейера сравнения игроков"""
+
+    @pytest.mark.asyncio
+    async def test_n_way_comparison_with_form_from_match_rows(self):
+        """Три игрока: профили и истории - одной волной, общий матч запрашивается один раз"""
+        import workers
+
+        history = {
+            'p1': {'items': [{'match_id': 'm1'}, {'match_id': 'm2'}]},
+            'p2': {'items': [{'match_id': 'm1'}]},
+            'p3': {'items': []},
+        }
+        client = MagicMock()
+        client.get_players_details_and_stats = AsyncMock(return_value={
+            pid: ({'nickname': pid}, {'lifetime': {}}) for pid in ('p1', 'p2', 'p3')
+        })
+        client.get_player_history = AsyncMock(side_effect=lambda pid, limit: history[pid])
+        client.get_matches_player_rows = AsyncMock(return_value={
+            'm1': {'p1': {'kills': 20, 'deaths': 10}, 'p2': {'kills': 10, 'deaths': 20}},
+            'm2': {'p1': {'kills': 15, 'deaths': 15}},
+        })
+        client.format_player_stats = MagicMock(side_effect=lambda details, stats: {'nickname': details['nickname']})
+        client._determine_player_result = MagicMock(side_effect=lambda match, pid: pid == 'p1')
+        client.analyze_player_form = AsyncMock(side_effect=lambda matches: {'matches_analyzed': len(matches)})
+        client.create_enhanced_comparison = AsyncMock(side_effect=lambda data: {'players': data})
+
+        comparison = await workers.build_comparison(client, ['p1', 'p2', 'p3'], with_form=True)
+
+        client.get_matches_player_rows.assert_awaited_once_with(['m1', 'm2', 'm1'])
+        forms = [entry['form'] for entry in comparison['players']]
+        assert forms == [{'matches_analyzed': 2}, {'matches_analyzed': 1}, None]
+        assert comparison['players'][0]['recent_matches'][0]['result'] == 'win'
+        assert set(comparison['timings_ms']) == {'profiles', 'match_stats', 'analysis', 'total'}
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from bot.services.telegram_sender import (
+    NOTIFICATION, TelegramSender, TelegramSenderMiddleware, delivery_priority
+)
+
+
+async def started(sender):
+    """Запустить цикл очереди и дождаться его старта"""
+    task = asyncio.create_task(sender.run())
+    await asyncio.sleep(0)
+    return task
+
+
+async def stop(task):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+class TestTelegramSender:
+    """Тесты очереди исходящих сообщений"""
+
+    @pytest.mark.asyncio
+    async def test_interactive_before_notifications(self):
+        """Ответ пользователю обгоняет уже стоящие в очереди уведомления"""
+        sender = TelegramSender(global_rate=1000, per_chat_interval=0)
+        order = []
+
+        def call(name):
+            async def send():
+                order.append(name)
+            return send
+
+        # Очередь наполняется до запуска цикла - порядок определяет только приоритет
+        sender._running = True
+        sends = [asyncio.create_task(sender.submit(chat, call(f"n{chat}"), NOTIFICATION)) for chat in range(3)]
+        sends.append(asyncio.create_task(sender.submit(99, call("reply"))))
+        await asyncio.sleep(0)
+
+        task = await started(sender)
+        await asyncio.gather(*sends)
+        await stop(task)
+
+        assert order[0] == "reply"
+        assert sender.get_stats()['latency']['interactive']['count'] == 1
+
+    @pytest.mark.asyncio
+    async def test_per_chat_pacing_does_not_block_other_chats(self):
+        """Второе сообщение в чат ждет интервал, другие чаты не ждут"""
+        sender = TelegramSender(global_rate=1000, per_chat_interval=0.2)
+        task = await started(sender)
+        loop = asyncio.get_running_loop()
+        sent_at = {}
+
+        def call(name):
+            async def send():
+                sent_at[name] = loop.time()
+            return send
+
+        begin = loop.time()
+        await asyncio.gather(
+            sender.submit(1, call("first")),
+            sender.submit(1, call("second")),
+            sender.submit(2, call("other")),
+        )
+        await stop(task)
+
+        assert sent_at["second"] - sent_at["first"] >= 0.19
+        assert sent_at["other"] - begin < 0.1
+        assert sender.get_stats()['deferred_for_chat'] >= 1
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_retried(self):
+        """429 откладывает запрос на retry_after и повторяет его"""
+        sender = TelegramSender(global_rate=1000, per_chat_interval=0)
+        task = await started(sender)
+        flood = TelegramRetryAfter(method=SendMessage(chat_id=1, text="hi"), message="Flood", retry_after=0)
+        call = AsyncMock(side_effect=[flood, "ok"])
+
+        with delivery_priority(NOTIFICATION):
+            assert await sender.submit(1, call) == "ok"
+        await stop(task)
+
+        stats = sender.get_stats()
+        assert stats['retry_after'] == 1
+        assert stats['sent'] == 1
+        assert stats['latency']['notification']['count'] == 1
+
+    @pytest.mark.asyncio
+    async def test_stop_fails_in_flight_and_held_deliveries(self):
+        """Остановка не оставляет ожидающих без ответа: ни отправку в процессе, ни ждущую слот"""
+        sender = TelegramSender(global_rate=1000, per_chat_interval=0, max_in_flight=1)
+        task = await started(sender)
+
+        async def hang():
+            await asyncio.Event().wait()
+
+        in_flight = asyncio.create_task(sender.submit(1, hang))
+        held = asyncio.create_task(sender.submit(2, hang))
+        await asyncio.sleep(0.01)
+        await stop(task)
+
+        for send in (in_flight, held):
+            with pytest.raises(RuntimeError, match="stopped"):
+                await asyncio.wait_for(send, timeout=1)
+
+    @pytest.mark.asyncio
+    async def test_middleware_routes_only_chat_messages(self):
+        """Через очередь идут только сообщения в чат; без запущенного цикла - напрямую"""
+        sender = TelegramSender()
+        sender.submit = AsyncMock(return_value="queued")
+        middleware = TelegramSenderMiddleware(sender)
+        make_request = AsyncMock(return_value="direct")
+
+        assert await middleware(make_request, None, GetMe()) == "direct"
+        assert await middleware(make_request, None, SendMessage(chat_id=1, text="hi")) == "queued"
+
+        assert await TelegramSender().submit(1, AsyncMock(return_value="direct")) == "direct"
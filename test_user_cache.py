@@ -0,0 +1,158 @@
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock
+
+from bot.services.database_storage import DatabaseStorage
+from bot.services.user_cache import UserRecordCache
+
+
+class SharedRedis:
+    """Общий для реплик Redis: строки, хэши и скрипт записи по версии"""
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def register_script(self, script):
+        async def set_if_version(keys, args):
+            if (self.values.get(keys[1]) or '') != args[0]:
+                return 0
+            self.hashes.setdefault(keys[0], {})[args[1]] = args[2]
+            return 1
+        return set_if_version
+
+    def pipeline(self, transaction=True):
+        redis = self
+
+        class Pipeline:
+            def __init__(self):
+                self.commands = []
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            def incr(self, key):
+                self.commands.append(lambda: redis.values.__setitem__(key, str(int(redis.values.get(key) or 0) + 1)))
+
+            def delete(self, key):
+                self.commands.append(lambda: redis.hashes.pop(key, None))
+
+            def expire(self, key, ttl):
+                pass
+
+            def publish(self, channel, message):
+                pass
+
+            async def execute(self):
+                for command in self.commands:
+                    command()
+
+        return Pipeline()
+
+
+def make_storage():
+    """Хранилище без Redis: работает только L1 кэш"""
+    storage = DatabaseStorage()
+    storage.postgres = AsyncMock()
+    return storage
+
+
+class TestUserRecordCache:
+    """Тесты кэша профилей и настроек пользователей"""
+
+    @pytest.mark.asyncio
+    async def test_repeated_get_user_hits_memory(self):
+        """Повторные запросы пользователя не ходят в PostgreSQL"""
+        storage = make_storage()
+        storage.postgres.fetchrow.return_value = {
+            'user_id': 42, 'faceit_id': 'abc', 'nickname': 'player',
+            'created_at': datetime(2025, 8, 1), 'last_activity': datetime(2025, 8, 2)
+        }
+
+        for _ in range(3):
+            assert await storage.get_user_faceit_id(42) == 'abc'
+
+        assert storage.postgres.fetchrow.await_count == 1
+        assert storage.user_cache.get_stats()['l1_hits'] == 2
+
+    @pytest.mark.asyncio
+    async def test_save_user_invalidates_record(self):
+        """Смена профиля сбрасывает закэшированную запись"""
+        storage = make_storage()
+        storage.postgres.fetchrow.return_value = None
+
+        assert await storage.get_user(42) is None
+        await storage.save_user(42, 'new-id', 'player')
+        await storage.get_user(42)
+
+        assert storage.postgres.fetchrow.await_count == 2
+
+    @pytest.mark.asyncio
+    async def test_settings_copy_is_mutable(self):
+        """Изменение полученных настроек не портит кэш"""
+        storage = make_storage()
+        storage.postgres.fetchrow.return_value = {
+            'notifications': True, 'language': 'ru',
+            'subscription_type': 'standard', 'updated_at': datetime(2025, 8, 1)
+        }
+
+        settings = await storage.get_user_settings(42)
+        settings['notifications'] = False
+
+        assert (await storage.get_user_settings(42))['notifications'] is True
+        assert storage.postgres.fetchrow.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_load_is_not_cached(self):
+        """Загрузка, начатая до инвалидации, не попадает в кэш"""
+        cache = UserRecordCache()
+        version = await cache.version(42)
+
+        await cache.invalidate(42)
+        await cache.set(42, 'user', {'faceit_id': 'old'}, version)
+
+        assert await cache.get(42, 'user') == (False, None)
+
+    @pytest.mark.asyncio
+    async def test_generations_are_bounded(self):
+        """Поколения не копятся по всем пользователям, вытеснение не пропускает устаревшую загрузку"""
+        cache = UserRecordCache(max_entries=2)
+        version = await cache.version(1)
+
+        for user_id in (1, 2, 3, 4):
+            await cache.invalidate(user_id)
+        await cache.set(1, 'user', {'faceit_id': 'old'}, version)
+
+        assert len(cache._generations) == 2
+        assert await cache.get(1, 'user') == (False, None)
+
+    @pytest.mark.asyncio
+    async def test_stale_load_from_other_replica_not_shared(self):
+        """Реплика, прочитавшая старую строку до записи на другой реплике, не кладет ее в Redis"""
+        shared = SharedRedis()
+        replica_a, replica_b = UserRecordCache(), UserRecordCache()
+        replica_a.redis = replica_b.redis = shared
+
+        # A начинает загрузку, B записывает в БД и инвалидирует запись,
+        # сообщение об инвалидации до A еще не дошло
+        version = await replica_a.version(42)
+        await replica_b.invalidate(42)
+        await replica_a.set(42, 'user', {'faceit_id': 'old'}, version)
+
+        assert shared.hashes.get('user_record:42') is None
+        assert await replica_b.get(42, 'user') == (False, None)
+        assert replica_a.get_stats()['stale_loads'] == 1
+
+        # Загрузка после записи кэшируется как обычно
+        version = await replica_a.version(42)
+        await replica_a.set(42, 'user', {'faceit_id': 'new'}, version)
+        assert await replica_b.get(42, 'user') == (True, {'faceit_id': 'new'})
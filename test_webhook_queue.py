@@ -0,0 +1,84 @@
+import json
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.webhook_queue import (
+    WebhookEventQueue, STREAM_KEY, DEAD_LETTER_KEY, GROUP_NAME
+)
+
+EVENT = {'event': 'match_status_finished', 'payload': {'id': '1-abc'}}
+
+
+def make_queue(handler=None):
+    """Очередь с замоканным Redis"""
+    storage = MagicMock()
+    storage.redis = AsyncMock()
+
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+
+    @asynccontextmanager
+    async def pipeline(transaction=True):
+        yield pipe
+
+    storage.redis.pipeline = pipeline
+    queue = WebhookEventQueue(storage, handler or AsyncMock(), max_attempts=3)
+    return queue, storage.redis, pipe
+
+
+class TestWebhookEventQueue:
+    """Тесты очереди событий webhook"""
+
+    @pytest.mark.asyncio
+    async def test_publish_appends_to_stream(self):
+        """Webhook только добавляет событие в поток"""
+        queue, redis, _ = make_queue()
+
+        await queue.publish(EVENT)
+
+        key, fields = redis.xadd.await_args.args
+        assert key == STREAM_KEY
+        assert json.loads(fields['event']) == EVENT
+
+    @pytest.mark.asyncio
+    async def test_processed_event_is_acked(self):
+        """Успешно обработанное событие подтверждается"""
+        handler = AsyncMock()
+        queue, redis, _ = make_queue(handler)
+
+        await queue._process('1700000000000-0', {'event': json.dumps(EVENT)})
+
+        handler.assert_awaited_once_with(EVENT)
+        redis.xack.assert_awaited_once_with(STREAM_KEY, GROUP_NAME, '1700000000000-0')
+        assert queue.metrics['processed'] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_event_stays_pending(self):
+        """Упавшее событие не подтверждается и будет повторено"""
+        queue, redis, _ = make_queue(AsyncMock(side_effect=RuntimeError("FACEIT API timeout")))
+
+        await queue._process('1700000000000-0', {'event': json.dumps(EVENT)})
+
+        redis.xack.assert_not_awaited()
+        assert queue.metrics['failed'] == 1
+
+    @pytest.mark.asyncio
+    async def test_reclaim_retries_or_dead_letters(self):
+        """Зависшее событие повторяется, исчерпавшее попытки - в dead-letter"""
+        handler = AsyncMock()
+        queue, redis, pipe = make_queue(handler)
+        redis.xpending_range.return_value = [
+            {'message_id': '1-0', 'times_delivered': 1},
+            {'message_id': '2-0', 'times_delivered': 3},
+        ]
+        redis.xclaim.return_value = [('1-0', {'event': json.dumps(EVENT)})]
+        redis.xrange.return_value = [('2-0', {'event': json.dumps(EVENT)})]
+
+        await queue.reclaim_pending('consumer')
+
+        handler.assert_awaited_once_with(EVENT)
+        assert queue.metrics['retried'] == 1
+        assert pipe.xadd.call_args.args[0] == DEAD_LETTER_KEY
+        pipe.xack.assert_called_once_with(STREAM_KEY, GROUP_NAME, '2-0')
+        assert queue.metrics['dead_lettered'] == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.services.worker_supervisor import WorkerSupervisor
+
+
+def make_supervisor(stats, wait_ms=0.0, **kwargs):
+    """Супервизор над замоканной очередью"""
+    queue = MagicMock()
+    queue.get_stats = AsyncMock(return_value=stats)
+    queue.take_wait_ms = MagicMock(return_value=wait_ms)
+    return WorkerSupervisor(queue, **kwargs)
+
+
+async def idle_worker(worker_id, stop):
+    """Воркер, который ждет события остановки"""
+    await stop.wait()
+
+
+class TestWorkerSupervisor:
+    """Тесты автомасштабирования пулов воркеров"""
+
+    @pytest.mark.asyncio
+    async def test_scales_up_to_clear_backlog(self):
+        """Очередь растет - пул сразу расширяется до нужного размера, но не выше предела"""
+        supervisor = make_supervisor({'stats': {'depth': 40, 'pending': 2, 'lag': 38}}, backlog_per_worker=5)
+        pool = supervisor.add_pool('stats', idle_worker, initial=1, min_size=1, max_size=6)
+        pool.start_worker()
+
+        await supervisor.check()
+
+        assert pool.size == 6
+        assert supervisor.metrics['scale_ups'] == 1
+        assert supervisor.decisions[-1]['from'] == 1 and supervisor.decisions[-1]['to'] == 6
+        await supervisor.stop()
+
+    @pytest.mark.asyncio
+    async def test_scales_up_on_wait_latency(self):
+        """Даже короткая очередь расширяет пул, если задачи ждут дольше цели"""
+        supervisor = make_supervisor({'comparison': {'depth': 1, 'pending': 0, 'lag': None}},
+                                     wait_ms=5000, target_wait_ms=2000)
+        pool = supervisor.add_pool('comparison', idle_worker, initial=1, min_size=1, max_size=4)
+        pool.start_worker()
+
+        await supervisor.check()
+
+        assert pool.size == 2
+        await supervisor.stop()
+
+    @pytest.mark.asyncio
+    async def test_idle_pool_drains_gracefully(self):
+        """Пустая очередь сокращает пул после нескольких проверок, воркер завершается сам"""
+        supervisor = make_supervisor({'history': {'depth': 0, 'pending': 0, 'lag': 0}}, scale_down_checks=2)
+        pool = supervisor.add_pool('history', idle_worker, initial=2, min_size=1, max_size=4)
+        pool.start_worker()
+        pool.start_worker()
+        drained_task, _ = pool.workers[1]
+
+        await supervisor.check()
+        assert pool.size == 2
+
+        await supervisor.check()
+        assert pool.size == 1
+        assert supervisor.metrics['scale_downs'] == 1
+
+        await asyncio.gather(drained_task)
+        await asyncio.sleep(0)
+        assert not drained_task.cancelled()
+        assert not pool.draining
+
+        # Ниже минимума пул не опускается
+        for _ in range(4):
+            await supervisor.check()
+        assert pool.size == 1
+        await supervisor.stop()
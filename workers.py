@@ -4,197 +4,581 @@
 
 import asyncio
 import logging
-from typing import Dict, Any, List, Optional
+import os
+import random
+import socket
+import time
+from typing import Dict, Any, List, Optional, Callable, Awaitable
 from datetime import datetime
 from config import settings
 from storage import storage
 from faceit_client import FaceitAPIClient
+from bot.services.task_queue import (
+    DEFAULT_PRIORITY, PRIORITIES, MemoryTaskQueue, RedisStreamTaskQueue, TaskHandle, TaskMessage
+)
+from bot.services.worker_supervisor import WorkerSupervisor
 
 
 logger = logging.getLogger(__name__)
 
+# Обработчик пачки задач одного типа: задачи -> результаты в том же порядке
+BatchHandler = Callable[[List[Dict[str, Any]]], Awaitable[List[Any]]]
+
 
 class WorkerQueue:
-    """Система очередей для распределения задач между воркерами"""
+    """Система очередей для распределения задач между воркерами
     
-    def __init__(self, max_size: int = 1000):
-        self.stats_queue = asyncio.Queue(maxsize=max_size)
-        self.history_queue = asyncio.Queue(maxsize=max_size)
-        self.comparison_queue = asyncio.Queue(maxsize=max_size)
-        self.notification_queue = asyncio.Queue(maxsize=max_size)
-        
-    async def add_stats_task(self, task: Dict[str, Any]):
-        """Добавить задачу анализа статистики"""
+    Задачи хранятся в бэкенде (Redis Streams или память процесса, см.
+    bot/services/task_queue.py). Воркер подтверждает задачу после
+    обработки; задача упавшего воркера возвращается в очередь через
+    visibility_timeout и забирается другим воркером.
+    
+    Задачи чтения данных (типы из COALESCE_FIELDS) склеиваются по ключу
+    тип + параметры: повтор, пока первая задача ждет или выполняется, не
+    ставится в очередь, а результат, готовый менее result_ttl секунд
+    назад, возвращается сразу.
+    
+    add_*_task возвращает TaskHandle: обработчик может дождаться
+    результата задачи (run - поставить и дождаться с дедлайном).
+    
+    Выполнение задачи ограничено дедлайном ее типа (TASK_DEADLINES, иначе
+    task_timeout) и отменяется по его истечении. Упавшая задача
+    повторяется через экспоненциально растущую задержку со случайным
+    разбросом, после max_deliveries попыток - уходит в карантин
+    (dead-letter), а ждущие получают ошибку.
+    
+    Задача ставится в полосу приоритета (поле priority, иначе
+    TASK_PRIORITIES по типу; run - высокий: результата ждет обработчик).
+    У пользователя (поле user_id) выполняется не больше user_max_in_flight
+    задач на всех репликах: лишняя откладывается на defer_delay и
+    встает в конец полосы, пропуская вперед задачи других пользователей.
+    Выданная пачка упорядочивается по приоритету, внутри полосы - по кругу
+    между пользователями.
+    """
+    
+    QUEUES = ('stats', 'history', 'comparison', 'notification')
+    
+    # Тип задачи -> поля, определяющие ее результат (кто запросил - не важно)
+    COALESCE_FIELDS = {
+        'player_stats': ('player_id',),
+        'current_match': ('player_id',),
+        'form_analysis': ('player_id',),
+        'match_history': ('player_id', 'limit'),
+        'last_matches': ('player_id',),
+        'player_comparison': ('players',),
+        'enhanced_comparison': ('players',),
+        'form_periods': ('player_id', 'match_count', 'latest_match_id'),
+    }
+    
+    # Тип задачи -> дедлайн выполнения в секундах (остальные - task_timeout)
+    TASK_DEADLINES = {
+        'form_periods': 15,
+        'session_stats': 90,
+        'player_comparison': 90,
+        'enhanced_comparison': 150,
+    }
+    
+    # Тип задачи -> полоса приоритета (остальные - обычная)
+    TASK_PRIORITIES = {
+        'form_periods': 'high',
+        'session_stats': 'low',
+    }
+    
+    def __init__(self, backend, result_ttl: float = 60, outcome_ttl: float = 300,
+                 task_timeout: float = 60, max_deliveries: int = 5,
+                 retry_base_delay: float = 2.0, retry_max_delay: float = 60.0,
+                 user_max_in_flight: int = 0, defer_delay: float = 1.0):
+        self.backend = backend
+        self.result_ttl = result_ttl
+        # Сколько итог задачи доступен ждущим, опоздавшим к публикации
+        self.outcome_ttl = outcome_ttl
+        self.task_timeout = task_timeout
+        self.max_deliveries = max_deliveries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        # 0 - без ограничения задач пользователя
+        self.user_max_in_flight = user_max_in_flight
+        self.defer_delay = defer_delay
+        # Как часто воркер проверяет зависшие задачи своей очереди
+        self.reclaim_interval = max(1.0, backend.visibility_timeout / 2)
+        self._reclaimed_at: Dict[str, float] = {}
+        # Наибольшее ожидание задачи в очереди с последнего чтения супервизором
+        self._peak_wait_ms: Dict[str, float] = {}
+        self.metrics = {
+            queue: {'enqueued': 0, 'rejected': 0, 'coalesced': 0, 'result_reused': 0,
+                    'processed': 0, 'failed': 0, 'timeouts': 0, 'retried': 0, 'redelivered': 0,
+                    'quarantined': 0, 'deferred': 0, 'last_wait_ms': 0.0}
+            for queue in self.QUEUES
+        }
+    
+    @classmethod
+    def task_key(cls, task: Dict[str, Any]) -> Optional[str]:
+        """Канонический ключ задачи или None, если задачу склеивать нельзя"""
+        fields = cls.COALESCE_FIELDS.get(task.get('type'))
+        if not fields or any(task.get(name) is None for name in fields):
+            return None
+        
+        parts = [task['type']]
+        for name in fields:
+            value = task[name]
+            # Порядок игроков важен: он определяет вид сравнения
+            parts.append(','.join(map(str, value)) if isinstance(value, (list, tuple)) else str(value))
+        return ':'.join(parts)
+    
+    @classmethod
+    def priority_of(cls, task: Dict[str, Any]) -> str:
+        """Полоса приоритета задачи"""
+        priority = task.get('priority') or cls.TASK_PRIORITIES.get(task.get('type'), DEFAULT_PRIORITY)
+        return priority if priority in PRIORITIES else DEFAULT_PRIORITY
+    
+    async def _add(self, queue: str, task: Dict[str, Any], priority: Optional[str] = None) -> Optional[TaskHandle]:
+        key = self.task_key(task)
+        priority = priority or self.priority_of(task)
         try:
-            await self.stats_queue.put(task)
-            logger.debug(f"Added stats task: {task.get('type', 'unknown')}")
+            if key is None:
+                handle = TaskHandle(self.backend, await self.backend.put(queue, task, priority), 'queued')
+            else:
+                handle = await self._add_unique(queue, task, key, priority)
         except asyncio.QueueFull:
-            logger.warning("Stats queue is full, dropping task")
+            self.metrics[queue]['rejected'] += 1
+            logger.warning(f"{queue.capitalize()} queue is full, dropping task")
+            return None
+        
+        self.metrics[queue][{'queued': 'enqueued', 'coalesced': 'coalesced', 'done': 'result_reused'}[handle.status]] += 1
+        logger.debug(f"Added {queue} task: {task.get('type', 'unknown')} ({handle.status})")
+        return handle
     
-    async def add_history_task(self, task: Dict[str, Any]):
+    async def _add_unique(self, queue: str, task: Dict[str, Any], key: str, priority: str) -> TaskHandle:
+        result = await self.backend.get_result(key)
+        if result is not None:
+            return TaskHandle(self.backend, None, 'done', result)
+        
+        requester = task.get('user_id')
+        task_id, coalesced = await self.backend.put_unique(
+            queue, task, key, str(requester) if requester is not None else None, priority
+        )
+        return TaskHandle(self.backend, task_id, 'coalesced' if coalesced else 'queued')
+    
+    async def add_stats_task(self, task: Dict[str, Any]) -> Optional[TaskHandle]:
+        """Добавить задачу анализа статистики"""
+        return await self._add('stats', task)
+    
+    async def add_history_task(self, task: Dict[str, Any]) -> Optional[TaskHandle]:
         """Добавить задачу анализа истории матчей"""
-        try:
-            await self.history_queue.put(task)
-            logger.debug(f"Added history task: {task.get('type', 'unknown')}")
-        except asyncio.QueueFull:
-            logger.warning("History queue is full, dropping task")
+        return await self._add('history', task)
     
-    async def add_comparison_task(self, task: Dict[str, Any]):
+    async def add_comparison_task(self, task: Dict[str, Any]) -> Optional[TaskHandle]:
         """Добавить задачу сравнения игроков"""
-        try:
-            await self.comparison_queue.put(task)
-            logger.debug(f"Added comparison task: {task.get('type', 'unknown')}")
-        except asyncio.QueueFull:
-            logger.warning("Comparison queue is full, dropping task")
+        return await self._add('comparison', task)
     
-    async def add_notification_task(self, task: Dict[str, Any]):
+    async def add_notification_task(self, task: Dict[str, Any]) -> Optional[TaskHandle]:
         """Добавить задачу уведомления"""
+        return await self._add('notification', task)
+    
+    async def run(self, queue: str, task: Dict[str, Any], timeout: float, priority: str = 'high') -> Any:
+        """Выполнить задачу в пуле воркеров и дождаться результата
+        
+        asyncio.QueueFull - очередь переполнена, asyncio.TimeoutError - результата
+        нет за timeout секунд, TaskFailed - задача упала после всех попыток.
+        """
+        handle = await self._add(queue, task, priority)
+        if handle is None:
+            raise asyncio.QueueFull()
+        return await handle.result(timeout)
+    
+    async def get(self, queue: str, consumer: str, timeout: float) -> Optional[TaskMessage]:
+        """Получить одну задачу"""
+        batch = await self.get_batch(queue, consumer, 1, timeout)
+        return batch[0] if batch else None
+    
+    async def get_batch(self, queue: str, consumer: str, count: int, timeout: float) -> List[TaskMessage]:
+        """Получить до count задач: сначала зависшие у других воркеров, затем новые"""
+        now = time.monotonic()
+        if now - self._reclaimed_at.get(queue, 0) >= self.reclaim_interval:
+            self._reclaimed_at[queue] = now
+            stale = await self.backend.claim_stale(queue, consumer, count=count)
+            if stale:
+                self.metrics[queue]['redelivered'] += len(stale)
+                # Остальные зависшие заберем на следующих итерациях
+                self._reclaimed_at[queue] = 0
+                alive = []
+                for message in stale:
+                    if message.attempts > self.max_deliveries:
+                        # Задача раз за разом теряется вместе с воркером
+                        await self.quarantine(queue, message, f"lost by workers {message.attempts - 1} times")
+                    else:
+                        alive.append(message)
+                if alive:
+                    return await self._admit(queue, alive)
+        
+        return await self._admit(queue, await self.backend.get_batch(queue, consumer, count, timeout))
+    
+    async def _admit(self, queue: str, messages: List[TaskMessage]) -> List[TaskMessage]:
+        """Занять слоты пользователей; задачи сверх предела отложить"""
+        if self.user_max_in_flight <= 0:
+            return self.fair_order(messages)
+        
+        admitted = []
+        for message in messages:
+            user = message.task.get('user_id')
+            if user is None or await self.backend.acquire_slot(str(user), message.task_id, self.user_max_in_flight):
+                admitted.append(message)
+                continue
+            # Эта выдача не считается попыткой выполнения
+            message.attempts -= 1
+            await self.backend.retry_later(queue, message, self.defer_delay * random.uniform(0.5, 1.5))
+            self.metrics[queue]['deferred'] += 1
+            logger.debug(f"Deferred {queue} task {message.task_id}: user {user} has "
+                         f"{self.user_max_in_flight} tasks in flight")
+        return self.fair_order(admitted)
+    
+    @staticmethod
+    def fair_order(messages: List[TaskMessage]) -> List[TaskMessage]:
+        """Порядок обработки пачки: по приоритету, внутри полосы - по кругу между пользователями"""
+        lanes: Dict[str, Dict[str, List[TaskMessage]]] = {}
+        for message in messages:
+            user = str(message.task.get('user_id'))
+            lanes.setdefault(message.priority, {}).setdefault(user, []).append(message)
+        
+        ordered = []
+        for priority in PRIORITIES:
+            users = list(lanes.get(priority, {}).values())
+            while users:
+                ordered.extend(user_messages.pop(0) for user_messages in users)
+                users = [user_messages for user_messages in users if user_messages]
+        return ordered
+    
+    async def _release(self, message: TaskMessage) -> None:
+        user = message.task.get('user_id')
+        if user is None or self.user_max_in_flight <= 0:
+            return
         try:
-            await self.notification_queue.put(task)
-            logger.debug(f"Added notification task: {task.get('type', 'unknown')}")
-        except asyncio.QueueFull:
-            logger.warning("Notification queue is full, dropping task")
+            await self.backend.release_slot(str(user), message.task_id)
+        except Exception as e:
+            # Слот освободится сам через visibility timeout
+            logger.warning(f"Failed to release slot of task {message.task_id}: {e}")
+    
+    def deadline(self, task_type: Optional[str]) -> float:
+        """Дедлайн выполнения задачи: меньше visibility timeout, чтобы задачу
+        не забрал другой воркер, пока эта попытка еще идет"""
+        deadline = self.TASK_DEADLINES.get(task_type, self.task_timeout)
+        return min(deadline, self.backend.visibility_timeout * 0.9)
+    
+    def retry_delay(self, attempts: int) -> float:
+        """Задержка перед повтором: экспоненциальный рост и случайный разброс,
+        чтобы повторы упавших вместе задач не приходили одной волной"""
+        delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** max(0, attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+    
+    async def retry(self, queue: str, message: TaskMessage) -> float:
+        """Отложить повтор упавшей задачи; задержка в секундах"""
+        delay = self.retry_delay(message.attempts)
+        await self.backend.retry_later(queue, message, delay)
+        await self._release(message)
+        self.metrics[queue]['retried'] += 1
+        return delay
+    
+    async def quarantine(self, queue: str, message: TaskMessage, error: str) -> None:
+        """Перенести задачу в dead-letter и сообщить ждущим об ошибке"""
+        await self.backend.quarantine(queue, message, error)
+        await self._release(message)
+        self.metrics[queue]['quarantined'] += 1
+        logger.error(f"Task {message.task_id} in {queue} queue quarantined after {message.attempts} attempts: {error}")
+        await self._complete(message, None, error)
+    
+    async def promote_due(self) -> int:
+        """Вернуть в очереди отложенные повторы, время которых пришло"""
+        promoted = 0
+        for queue in self.QUEUES:
+            promoted += await self.backend.promote_due(queue)
+        return promoted
+    
+    async def run_retry_scheduler(self, interval: float = 1.0) -> None:
+        """Фоновый перенос отложенных повторов в очереди"""
+        while True:
+            try:
+                await self.promote_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to promote delayed worker tasks: {e}")
+            await asyncio.sleep(interval)
+    
+    async def ack(self, queue: str, message: TaskMessage, result: Any = None,
+                  error: Optional[str] = None) -> List[str]:
+        """Подтвердить задачу и опубликовать ее итог ждущим
+        
+        Для склеенной задачи результат сохраняется на result_ttl и
+        возвращаются ее получатели.
+        """
+        await self.backend.ack(queue, message)
+        await self._release(message)
+        return await self._complete(message, result, error)
+    
+    async def _complete(self, message: TaskMessage, result: Any, error: Optional[str]) -> List[str]:
+        requesters = []
+        if message.key is not None:
+            requesters = await self.backend.finish(message, result if error is None else None, self.result_ttl)
+        
+        outcome = {'ok': True, 'result': result} if error is None else {'ok': False, 'error': error}
+        try:
+            await self.backend.publish_outcome(message.task_id, outcome, self.outcome_ttl)
+        except Exception as e:
+            logger.warning(f"Failed to publish outcome of task {message.task_id}: {e}")
+        return requesters
+    
+    async def close(self) -> None:
+        """Остановить ожидание итогов задач"""
+        await self.backend.close()
+    
+    def record_wait(self, queue: str, message: TaskMessage) -> None:
+        """Учесть, сколько задача ждала в очереди до выдачи воркеру"""
+        wait_ms = max(0.0, (time.time() - message.enqueued_at) * 1000)
+        self._peak_wait_ms[queue] = max(wait_ms, self._peak_wait_ms.get(queue, 0.0))
+        self.metrics[queue]['last_wait_ms'] = round(wait_ms, 1)
+    
+    def take_wait_ms(self, queue: str) -> float:
+        """Наибольшее ожидание с прошлого вызова (для автомасштабирования)"""
+        return self._peak_wait_ms.pop(queue, 0.0)
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        """Глубина, выданные задачи и отставание по очередям"""
+        stats = {}
+        for queue in self.QUEUES:
+            stats[queue] = dict(self.metrics[queue])
+            try:
+                stats[queue].update(await self.backend.get_stats(queue))
+            except Exception as e:
+                logger.warning(f"Failed to get {queue} queue stats: {e}")
+        return stats
+
+
+def create_task_backend():
+    """Бэкенд очередей по настройке worker_queue_backend"""
+    if settings.worker_queue_backend == "memory":
+        return MemoryTaskQueue(settings.max_queue_size, settings.worker_visibility_timeout,
+                               settings.worker_dead_letter_max)
+    return RedisStreamTaskQueue(storage, settings.max_queue_size, settings.worker_visibility_timeout,
+                                settings.worker_dead_letter_max)
 
 
 # Глобальная очередь задач
-worker_queue = WorkerQueue(max_size=settings.max_queue_size)
-
-
-async def stats_analysis_worker(worker_id: int):
-    """Воркер для анализа статистики игроков"""
-    logger.info(f"🔍 Stats analysis worker {worker_id} started")
-    client = FaceitAPIClient()
+worker_queue = WorkerQueue(
+    create_task_backend(),
+    result_ttl=settings.worker_result_ttl,
+    outcome_ttl=settings.worker_visibility_timeout,
+    task_timeout=settings.worker_task_timeout,
+    max_deliveries=settings.worker_max_deliveries,
+    retry_base_delay=settings.worker_retry_base_delay,
+    retry_max_delay=settings.worker_retry_max_delay,
+    user_max_in_flight=settings.worker_user_max_in_flight,
+    defer_delay=settings.worker_user_defer_delay
+)
+
+
+def consumer_name(queue: str, worker_id: int) -> str:
+    """Имя потребителя, уникальное для процесса"""
+    return f"{socket.gethostname()}-{os.getpid()}-{queue}-{worker_id}"
+
+
+async def run_worker_loop(queue: str, consumer: str, handle: Callable[[Dict[str, Any]], Awaitable[Any]],
+                          stop: Optional[asyncio.Event] = None,
+                          batch_handlers: Optional[Dict[str, BatchHandler]] = None):
+    """Цикл воркера: получить задачи, обработать, подтвердить
     
-    while True:
+    handle возвращает результат задачи (None - результата нет, повторно не
+    используется). stop - событие плавной остановки: воркер дорабатывает
+    текущие задачи и выходит. batch_handlers - обработчики пачек по типу
+    задачи: воркер забирает до settings.batch_size задач и задачи одного
+    такого типа обрабатывает одним вызовом. Обработка отменяется по
+    истечении дедлайна типа задачи (WorkerQueue.deadline).
+    """
+    batch_size = max(1, settings.batch_size) if batch_handlers else 1
+    while stop is None or not stop.is_set():
         try:
-            # Ждем задачу из очереди
-            task = await asyncio.wait_for(
-                worker_queue.stats_queue.get(),
-                timeout=settings.worker_timeout
-            )
+            messages = await worker_queue.get_batch(queue, consumer, batch_size, timeout=settings.worker_timeout)
+            if not messages:
+                # Нет задач, продолжаем ожидание
+                continue
             
-            logger.debug(f"Worker {worker_id} processing stats task: {task.get('type')}")
-            
-            # Обработка разных типов задач
-            task_type = task.get('type')
-            if task_type == 'player_stats':
-                await process_player_stats(client, task)
-            elif task_type == 'current_match':
-                await process_current_match(client, task)
-            elif task_type == 'form_analysis':
-                await process_form_analysis(client, task)
-            else:
-                logger.warning(f"Unknown stats task type: {task_type}")
+            groups: Dict[str, List[TaskMessage]] = {}
+            for message in messages:
+                worker_queue.record_wait(queue, message)
+                task_type = message.task.get('type')
+                groups.setdefault(task_type if batch_handlers and task_type in batch_handlers else '', []).append(message)
             
-            # Отмечаем задачу как выполненную
-            worker_queue.stats_queue.task_done()
+            for task_type, group in groups.items():
+                if task_type:
+                    try:
+                        results = await asyncio.wait_for(
+                            batch_handlers[task_type]([message.task for message in group]),
+                            worker_queue.deadline(task_type)
+                        )
+                    except Exception as e:
+                        results = [e] * len(group)
+                    for message, result in zip(group, results):
+                        await settle_task(queue, message, result)
+                    continue
+                
+                for message in group:
+                    try:
+                        result = await asyncio.wait_for(
+                            handle(message.task), worker_queue.deadline(message.task.get('type'))
+                        )
+                    except Exception as e:
+                        result = e
+                    await settle_task(queue, message, result)
             
-        except asyncio.TimeoutError:
-            # Нет задач, продолжаем ожидание
-            continue
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Error in stats worker {worker_id}: {e}")
+            logger.error(f"Error in {consumer}: {e}")
             await asyncio.sleep(1)
     
-    await client.close()
+    logger.info(f"{consumer} stopped")
+
+
+async def settle_task(queue: str, message: TaskMessage, result: Any):
+    """Подтвердить обработанную задачу; упавшую (result - исключение) отложить
+    для повтора, а исчерпавшую попытки - перенести в карантин"""
+    if not isinstance(result, Exception):
+        worker_queue.metrics[queue]['processed'] += 1
+        await worker_queue.ack(queue, message, result)
+        return
+    
+    worker_queue.metrics[queue]['failed'] += 1
+    if isinstance(result, asyncio.TimeoutError):
+        worker_queue.metrics[queue]['timeouts'] += 1
+        error = f"deadline {worker_queue.deadline(message.task.get('type')):.0f}s exceeded"
+    else:
+        error = str(result) or type(result).__name__
+    
+    if message.attempts < worker_queue.max_deliveries:
+        delay = await worker_queue.retry(queue, message)
+        logger.warning(f"Task {message.task_id} in {queue} queue failed (attempt {message.attempts}): "
+                       f"{error}; retry in {delay:.1f}s")
+        return
+    await worker_queue.quarantine(queue, message, error)
+
+
+async def stats_analysis_worker(worker_id: int, stop: Optional[asyncio.Event] = None):
+    """Воркер для анализа статистики игроков"""
+    logger.info(f"🔍 Stats analysis worker {worker_id} started")
+    client = FaceitAPIClient()
+    
+    async def handle(task: Dict[str, Any]):
+        logger.debug(f"Worker {worker_id} processing stats task: {task.get('type')}")
+        
+        # Обработка разных типов задач
+        task_type = task.get('type')
+        if task_type == 'player_stats':
+            return await process_player_stats(client, task)
+        elif task_type == 'current_match':
+            return await process_current_match(client, task)
+        elif task_type == 'form_analysis':
+            return await process_form_analysis(client, task)
+        elif task_type == 'form_periods':
+            return await process_form_periods(task)
+        else:
+            logger.warning(f"Unknown stats task type: {task_type}")
+    
+    batch_handlers = {
+        'player_stats': lambda tasks: process_player_stats_batch(client, tasks),
+    }
+    
+    try:
+        await run_worker_loop('stats', consumer_name('stats', worker_id), handle, stop, batch_handlers)
+    finally:
+        await client.close()
 
 
-async def match_history_worker(worker_id: int):
+async def match_history_worker(worker_id: int, stop: Optional[asyncio.Event] = None):
     """Воркер для анализа истории матчей"""
     logger.info(f"📊 Match history worker {worker_id} started")
     client = FaceitAPIClient()
     
-    while True:
-        try:
-            task = await asyncio.wait_for(
-                worker_queue.history_queue.get(),
-                timeout=settings.worker_timeout
-            )
-            
-            logger.debug(f"Worker {worker_id} processing history task: {task.get('type')}")
-            
-            task_type = task.get('type')
-            if task_type == 'match_history':
-                await process_match_history(client, task)
-            elif task_type == 'last_matches':
-                await process_last_matches(client, task)
-            elif task_type == 'session_stats':
-                await process_session_stats(client, task)
-            else:
-                logger.warning(f"Unknown history task type: {task_type}")
-            
-            worker_queue.history_queue.task_done()
-            
-        except asyncio.TimeoutError:
-            continue
-        except Exception as e:
-            logger.error(f"Error in history worker {worker_id}: {e}")
-            await asyncio.sleep(1)
+    async def handle(task: Dict[str, Any]):
+        logger.debug(f"Worker {worker_id} processing history task: {task.get('type')}")
+        
+        task_type = task.get('type')
+        if task_type == 'match_history':
+            return await process_match_history(client, task)
+        elif task_type == 'last_matches':
+            return await process_last_matches(client, task)
+        elif task_type == 'session_stats':
+            return await process_session_stats(client, task)
+        else:
+            logger.warning(f"Unknown history task type: {task_type}")
     
-    await client.close()
+    try:
+        await run_worker_loop('history', consumer_name('history', worker_id), handle, stop)
+    finally:
+        await client.close()
 
 
-async def comparison_worker(worker_id: int):
+async def comparison_worker(worker_id: int, stop: Optional[asyncio.Event] = None):
     """Воркер для сравнения игроков"""
     logger.info(f"⚖️ Comparison worker {worker_id} started")
     client = FaceitAPIClient()
     
-    while True:
-        try:
-            task = await asyncio.wait_for(
-                worker_queue.comparison_queue.get(),
-                timeout=settings.worker_timeout
-            )
-            
-            logger.debug(f"Worker {worker_id} processing comparison task: {task.get('type')}")
-            
-            task_type = task.get('type')
-            if task_type == 'player_comparison':
-                await process_player_comparison(client, task)
-            elif task_type == 'enhanced_comparison':
-                await process_enhanced_comparison(client, task)
-            else:
-                logger.warning(f"Unknown comparison task type: {task_type}")
-            
-            worker_queue.comparison_queue.task_done()
-            
-        except asyncio.TimeoutError:
-            continue
-        except Exception as e:
-            logger.error(f"Error in comparison worker {worker_id}: {e}")
-            await asyncio.sleep(1)
+    async def handle(task: Dict[str, Any]):
+        logger.debug(f"Worker {worker_id} processing comparison task: {task.get('type')}")
+        
+        task_type = task.get('type')
+        if task_type == 'player_comparison':
+            return await process_player_comparison(client, task)
+        elif task_type == 'enhanced_comparison':
+            return await process_enhanced_comparison(client, task)
+        else:
+            logger.warning(f"Unknown comparison task type: {task_type}")
     
-    await client.close()
+    try:
+        await run_worker_loop('comparison', consumer_name('comparison', worker_id), handle, stop)
+    finally:
+        await client.close()
 
 
-async def notification_worker(worker_id: int):
+async def notification_worker(worker_id: int, stop: Optional[asyncio.Event] = None):
     """Воркер для отправки уведомлений"""
     logger.info(f"📢 Notification worker {worker_id} started")
     
-    while True:
-        try:
-            task = await asyncio.wait_for(
-                worker_queue.notification_queue.get(),
-                timeout=settings.worker_timeout
-            )
-            
-            logger.debug(f"Processing notification task: {task.get('type')}")
-            
-            task_type = task.get('type')
-            if task_type == 'match_notification':
-                await process_match_notification(task)
-            elif task_type == 'stats_notification':
-                await process_stats_notification(task)
-            else:
-                logger.warning(f"Unknown notification task type: {task_type}")
-            
-            worker_queue.notification_queue.task_done()
-            
-        except asyncio.TimeoutError:
-            continue
-        except Exception as e:
-            logger.error(f"Error in notification worker {worker_id}: {e}")
-            await asyncio.sleep(1)
+    async def handle(task: Dict[str, Any]):
+        logger.debug(f"Processing notification task: {task.get('type')}")
+        
+        task_type = task.get('type')
+        if task_type == 'match_notification':
+            await process_match_notification(task)
+        elif task_type == 'stats_notification':
+            await process_stats_notification(task)
+        else:
+            logger.warning(f"Unknown notification task type: {task_type}")
+    
+    await run_worker_loop('notification', consumer_name('notification', worker_id), handle, stop)
+
+
+def create_worker_supervisor() -> WorkerSupervisor:
+    """Супервизор пулов воркеров: начальный размер - *_workers, предел - *_workers_max"""
+    supervisor = WorkerSupervisor(
+        worker_queue,
+        interval=settings.worker_autoscale_interval,
+        target_wait_ms=settings.worker_target_wait_ms,
+        backlog_per_worker=settings.worker_backlog_per_worker,
+        scale_down_checks=settings.worker_scale_down_checks,
+        autoscale=settings.worker_autoscale
+    )
+    pools = (
+        ('stats', stats_analysis_worker, settings.stats_workers, settings.stats_workers_max),
+        ('history', match_history_worker, settings.history_workers, settings.history_workers_max),
+        ('comparison', comparison_worker, settings.comparison_workers, settings.comparison_workers_max),
+        ('notification', notification_worker, settings.notification_workers, settings.notification_workers_max),
+    )
+    for queue, worker, initial, max_size in pools:
+        supervisor.add_pool(queue, worker, initial, settings.worker_min_per_pool, max_size)
+    return supervisor
+
+
+# Глобальный супервизор пулов (воркеры запускает run() в lifespan)
+worker_supervisor = create_worker_supervisor()
 
 
 # Функции обработки задач
@@ -202,31 +586,34 @@ async def notification_worker(worker_id: int):
 async def process_player_stats(client: FaceitAPIClient, task: Dict[str, Any]):
     """Обработка задачи получения статистики игрока"""
     try:
-        player_id = task['player_id']
-        user_id = task['user_id']
-        
-        # Получаем статистику игрока
-        player_details = await client.get_player_details(player_id)
-        if not player_details:
-            logger.warning(f"No details found for player {player_id}")
-            return
-        
-        player_stats = await client.get_player_stats(player_id)
-        if not player_stats:
-            logger.warning(f"No stats found for player {player_id}")
-            return
-        
-        # Форматируем статистику
-        formatted_stats = client.format_player_stats(player_details, player_stats)
-        
-        # Сохраняем в кэш
-        cache_key = f"player_stats_{player_id}"
-        await storage.cache_data(cache_key, formatted_stats, ttl_minutes=15)
-        
-        logger.info(f"Processed stats for player {player_id}")
-        
+        return (await process_player_stats_batch(client, [task]))[0]
     except Exception as e:
         logger.error(f"Error processing player stats: {e}")
+        raise
+
+
+async def process_player_stats_batch(client: FaceitAPIClient, tasks: List[Dict[str, Any]]) -> List[Any]:
+    """Статистика группы игроков: кэш - одним MGET, промахи - пакетным запросом
+    клиента, новые результаты - в кэш одним пайплайном"""
+    player_ids = list(dict.fromkeys(task['player_id'] for task in tasks))
+    cache_keys = {player_id: f"player_stats_{player_id}" for player_id in player_ids}
+    
+    cached = await storage.get_cached_many(list(cache_keys.values()))
+    missing = [player_id for player_id in player_ids if cache_keys[player_id] not in cached]
+    
+    formatted = {player_id: cached[key] for player_id, key in cache_keys.items() if key in cached}
+    fresh = {}
+    if missing:
+        responses = await client.get_players_details_and_stats(missing)
+        for player_id, (player_details, player_stats) in responses.items():
+            if not player_details or not player_stats:
+                logger.warning(f"No details or stats found for player {player_id}")
+                continue
+            formatted[player_id] = fresh[cache_keys[player_id]] = client.format_player_stats(player_details, player_stats)
+        await storage.set_cached_many(fresh, ttl_minutes=15)
+    
+    logger.info(f"Processed stats for {len(player_ids)} players ({len(cached)} cached, {len(fresh)} fetched)")
+    return [formatted.get(task['player_id']) for task in tasks]
 
 
 async def process_current_match(client: FaceitAPIClient, task: Dict[str, Any]):
@@ -243,16 +630,19 @@ async def process_current_match(client: FaceitAPIClient, task: Dict[str, Any]):
         participants = await client.analyze_match_participants(current_match)
         
         # Сохраняем результат
-        cache_key = f"current_match_{player_id}"
-        await storage.cache_data(cache_key, {
+        result = {
             'match': current_match,
             'participants': participants
-        }, ttl_minutes=5)
+        }
+        cache_key = f"current_match_{player_id}"
+        await storage.set_cached_data(cache_key, result, ttl_minutes=5)
         
         logger.info(f"Processed current match for player {player_id}")
+        return result
         
     except Exception as e:
         logger.error(f"Error processing current match: {e}")
+        raise
 
 
 async def process_form_analysis(client: FaceitAPIClient, task: Dict[str, Any]):
@@ -270,12 +660,25 @@ async def process_form_analysis(client: FaceitAPIClient, task: Dict[str, Any]):
         
         # Сохраняем результат
         cache_key = f"form_analysis_{player_id}"
-        await storage.cache_data(cache_key, form_analysis, ttl_minutes=30)
+        await storage.set_cached_data(cache_key, form_analysis, ttl_minutes=30)
         
         logger.info(f"Processed form analysis for player {player_id}")
+        return form_analysis
         
     except Exception as e:
         logger.error(f"Error processing form analysis: {e}")
+        raise
+
+
+async def process_form_periods(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Статистика двух периодов анализа формы (для обработчика, ждущего результат)"""
+    from bot.handlers.form_analysis_handler import analyze_matches_period
+    
+    player_id = task['player_id']
+    user_id = task.get('user_id')
+    recent = await analyze_matches_period(task['recent'], player_id, "Текущий период", user_id)
+    previous = await analyze_matches_period(task['previous'], player_id, "Предыдущий период", user_id)
+    return {'recent': recent, 'previous': previous}
 
 
 async def process_match_history(client: FaceitAPIClient, task: Dict[str, Any]):
@@ -298,12 +701,14 @@ async def process_match_history(client: FaceitAPIClient, task: Dict[str, Any]):
         
         # Сохраняем результат
         cache_key = f"match_history_{player_id}_{limit}"
-        await storage.cache_data(cache_key, processed_matches, ttl_minutes=20)
+        await storage.set_cached_data(cache_key, processed_matches, ttl_minutes=20)
         
         logger.info(f"Processed {len(processed_matches)} matches for player {player_id}")
+        return processed_matches
         
     except Exception as e:
         logger.error(f"Error processing match history: {e}")
+        raise
 
 
 async def process_last_matches(client: FaceitAPIClient, task: Dict[str, Any]):
@@ -331,12 +736,14 @@ async def process_last_matches(client: FaceitAPIClient, task: Dict[str, Any]):
         
         # Сохраняем результат
         cache_key = f"last_matches_{player_id}"
-        await storage.cache_data(cache_key, detailed_matches, ttl_minutes=10)
+        await storage.set_cached_data(cache_key, detailed_matches, ttl_minutes=10)
         
         logger.info(f"Processed last matches for player {player_id}")
+        return detailed_matches
         
     except Exception as e:
         logger.error(f"Error processing last matches: {e}")
+        raise
 
 
 async def process_session_stats(client: FaceitAPIClient, task: Dict[str, Any]):
@@ -350,11 +757,25 @@ async def process_session_stats(client: FaceitAPIClient, task: Dict[str, Any]):
         if not session:
             return
         
-        # Получаем матчи за период сессии
-        matches = await client.get_player_matches_since(player_id, session['start_time'])
-        
-        # Анализируем статистику сессии
-        session_stats = await client.calculate_session_stats(matches)
+        # Итоги сессии считаются одним запросом по сохраненной истории матчей
+        session_start = session.get('session_start') or session.get('start_time')
+        window = await storage.get_window_stats(user_id, since=session_start)
+        
+        if window['total_matches'] > 0:
+            session_stats = {
+                'matches_count': window['total_matches'],
+                'wins': window['wins'],
+                'losses': window['losses'],
+                'total_kills': window['kills'],
+                'total_deaths': window['deaths'],
+                'total_assists': window['assists'],
+                'avg_adr': window['adr'],
+                'avg_hltv_rating': window['player_rating']
+            }
+        else:
+            # Истории в БД нет - считаем по API
+            matches = await client.get_player_matches_since(player_id, session_start)
+            session_stats = await client.calculate_session_stats(matches)
         
         # Обновляем сессию в БД
         await storage.update_session_stats(session['id'], session_stats)
@@ -363,79 +784,108 @@ async def process_session_stats(client: FaceitAPIClient, task: Dict[str, Any]):
         
     except Exception as e:
         logger.error(f"Error processing session stats: {e}")
+        raise
+
+
+async def build_comparison(client: FaceitAPIClient, players: List[str], with_form: bool = False) -> Dict[str, Any]:
+    """Сравнение любого числа игроков
+    
+    Этапы: profiles - детали, статистика и (для формы) последние матчи всех
+    игроков запрашиваются одновременно; match_stats - статистика их матчей
+    (общие матчи один раз, из долгого кэша завершенных матчей); analysis -
+    форма и сравнение. Время этапов возвращается в timings_ms.
+    """
+    timings: Dict[str, float] = {}
+    started = stage_started = time.monotonic()
+    
+    def mark(stage: str):
+        nonlocal stage_started
+        now = time.monotonic()
+        timings[stage] = round((now - stage_started) * 1000, 1)
+        stage_started = now
+    
+    form_matches = settings.comparison_form_matches
+    profiles, *histories = await asyncio.gather(
+        client.get_players_details_and_stats(players),
+        *(client.get_player_history(player_id, limit=form_matches) for player_id in players if with_form)
+    )
+    mark('profiles')
+    
+    player_data = {}
+    for player_id in players:
+        details, stats = profiles.get(player_id, (None, None))
+        if details and stats:
+            player_data[player_id] = client.format_player_stats(details, stats)
+    
+    if with_form:
+        recent = {
+            player_id: (history or {}).get('items', [])[:form_matches]
+            for player_id, history in zip(players, histories)
+        }
+        match_rows = await client.get_matches_player_rows(
+            [match.get('match_id') for items in recent.values() for match in items]
+        )
+        mark('match_stats')
+        
+        enhanced_data = []
+        for player_id, player in player_data.items():
+            matches = []
+            for match in recent.get(player_id, []):
+                row = match_rows.get(match.get('match_id'), {}).get(player_id)
+                if not row:
+                    continue
+                won = client._determine_player_result(match, player_id)
+                matches.append({'match_id': match['match_id'], 'result': 'win' if won else 'loss', **row})
+            enhanced_data.append({
+                'player': player,
+                'form': await client.analyze_player_form(matches) if matches else None,
+                'recent_matches': matches[:5]
+            })
+        comparison = await client.create_enhanced_comparison(enhanced_data)
+    else:
+        comparison = await client.create_comparison(list(player_data.values()))
+    mark('analysis')
+    
+    timings['total'] = round((time.monotonic() - started) * 1000, 1)
+    comparison['timings_ms'] = timings
+    logger.info(
+        f"Comparison of {len(player_data)}/{len(players)} players"
+        f"{' with form' if with_form else ''}: "
+        + ", ".join(f"{stage} {ms:.0f}ms" for stage, ms in timings.items())
+    )
+    return comparison
 
 
 async def process_player_comparison(client: FaceitAPIClient, task: Dict[str, Any]):
     """Обработка задачи сравнения игроков"""
     try:
         players = task['players']  # Список player_id
-        
-        # Получаем статистику всех игроков параллельно
-        semaphore = asyncio.Semaphore(settings.concurrent_requests)
-        
-        async def get_player_data(player_id):
-            async with semaphore:
-                details = await client.get_player_details(player_id)
-                stats = await client.get_player_stats(player_id)
-                return client.format_player_stats(details, stats) if details and stats else None
-        
-        tasks = [get_player_data(pid) for pid in players]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Фильтруем успешные результаты
-        player_data = []
-        for result in results:
-            if not isinstance(result, Exception) and result:
-                player_data.append(result)
-        
-        # Создаем сравнение
-        comparison_result = await client.create_comparison(player_data)
+        comparison_result = await build_comparison(client, players)
         
         # Сохраняем результат
         cache_key = f"comparison_{'_'.join(players)}"
-        await storage.cache_data(cache_key, comparison_result, ttl_minutes=20)
-        
-        logger.info(f"Created comparison for {len(player_data)} players")
+        await storage.set_cached_data(cache_key, comparison_result, ttl_minutes=20)
+        return comparison_result
         
     except Exception as e:
         logger.error(f"Error processing player comparison: {e}")
+        raise
 
 
 async def process_enhanced_comparison(client: FaceitAPIClient, task: Dict[str, Any]):
     """Обработка задачи расширенного сравнения"""
     try:
         players = task['players']
-        
-        # Получаем расширенные данные для каждого игрока
-        enhanced_data = []
-        
-        for player_id in players:
-            # Базовая статистика
-            details = await client.get_player_details(player_id)
-            stats = await client.get_player_stats(player_id)
-            
-            if details and stats:
-                # Последние матчи для анализа формы
-                matches = await client.get_player_matches(player_id, limit=10)
-                form = await client.analyze_player_form(matches) if matches else None
-                
-                enhanced_data.append({
-                    'player': client.format_player_stats(details, stats),
-                    'form': form,
-                    'recent_matches': matches[:5] if matches else []
-                })
-        
-        # Создаем расширенное сравнение
-        enhanced_comparison = await client.create_enhanced_comparison(enhanced_data)
+        enhanced_comparison = await build_comparison(client, players, with_form=True)
         
         # Сохраняем результат
         cache_key = f"enhanced_comparison_{'_'.join(players)}"
-        await storage.cache_data(cache_key, enhanced_comparison, ttl_minutes=30)
-        
-        logger.info(f"Created enhanced comparison for {len(enhanced_data)} players")
+        await storage.set_cached_data(cache_key, enhanced_comparison, ttl_minutes=30)
+        return enhanced_comparison
         
     except Exception as e:
         logger.error(f"Error processing enhanced comparison: {e}")
+        raise
 
 
 async def process_match_notification(task: Dict[str, Any]):
@@ -450,6 +900,7 @@ async def process_match_notification(task: Dict[str, Any]):
         
     except Exception as e:
         logger.error(f"Error processing match notification: {e}")
+        raise
 
 
 async def process_stats_notification(task: Dict[str, Any]):
@@ -464,6 +915,7 @@ async def process_stats_notification(task: Dict[str, Any]):
         
     except Exception as e:
         logger.error(f"Error processing stats notification: {e}")
+        raise
 
 
 def get_worker_queue() -> WorkerQueue: